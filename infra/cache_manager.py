@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Disk-budgeted cache manager for everything cached under reports/.
+
+Managed caches:
+    charts     reports/.charts/*          generated chart PNGs
+    responses  reports/.cache/*           API response cache (the shared mmap cache is
+                                          cleared in place, never deleted)
+    models     reports/*_model.xlsx       downloaded Excel models
+    exports    reports/*_export.csv       CSV exports
+
+When the total exceeds the budget, files are evicted LRU (oldest last access
+first); among equally recent files the larger one goes first. Files belonging
+to pinned tickers are never evicted. Last access is the newest of atime, mtime
+and any access recorded through `touch` / record_access().
+
+A file belongs to a ticker through its name prefix (AAPL_model.xlsx,
+AAPL_revenue.png). Charts saved under chart_generator.py's default name
+(<type>_<timestamp>.png) carry no ticker and cannot be pinned; pass
+--output reports/.charts/<TICKER>_<name>.png to keep one.
+
+Usage:
+    python infra/cache_manager.py stats
+    python infra/cache_manager.py evict --budget 5GB [--dry-run]
+    python infra/cache_manager.py pin AAPL MSFT
+    python infra/cache_manager.py unpin AAPL
+    python infra/cache_manager.py touch reports/AAPL_model.xlsx
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "recipes"))
+
+import shared_cache  # noqa: E402
+
+REPORTS_DIR = os.path.join(ROOT, "reports")
+INDEX_PATH = os.path.join(REPORTS_DIR, ".cache_index.json")
+INDEX_LOCK = INDEX_PATH + ".lock"
+PINS_PATH = os.path.join(REPORTS_DIR, ".cache_pins.json")
+DEFAULT_BUDGET = os.environ.get("DALOOPA_CACHE_BUDGET", "5GB")
+
+# category -> (directory relative to reports/, filename regex)
+CACHE_SPECS = {
+    "charts": (".charts", r".+"),
+    "responses": (".cache", r".+"),
+    "models": ("", r".+_model\.xlsx$"),
+    "exports": ("", r".+_export\.csv$"),
+}
+
+# chart_generator.py's default <type>_<timestamp>.png names, whose prefix is a chart type, not a ticker
+DEFAULT_CHART_NAME = re.compile(r"^[a-z_]+_\d{8}_\d{6}\.png$")
+
+# Files every live process has mapped (recipes/shared_cache.py); unlinking one would split the cache
+SHARED_CACHE_FILE = re.compile(r"^responses-py\d+\.bin$")
+
+UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2,
+         "G": 1024 ** 3, "GB": 1024 ** 3, "T": 1024 ** 4, "TB": 1024 ** 4}
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def parse_size(text):
+    """Parse '500MB', '5G', '1.5GB' or plain bytes into an int byte count."""
+    m = re.match(r"^\s*([\d.]+)\s*([A-Za-z]*)\s*$", str(text))
+    if not m or m.group(2).upper() not in UNITS:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(m.group(1)) * UNITS[m.group(2).upper()])
+
+
+def format_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f}{unit}" if unit != "B" else f"{n}B"
+        n /= 1024
+    return f"{n:.1f}TB"
+
+
+def _load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return default
+
+
+def _write_json(path, data):
+    """Atomic write: a crash never leaves a half-written index behind."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def load_pins():
+    return set(_load_json(PINS_PATH, []))
+
+
+@contextmanager
+def _index_lock():
+    """Exclusive lock around a read-modify-write of the access index, across processes."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(INDEX_LOCK), exist_ok=True)
+    with open(INDEX_LOCK, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield  # closing the file drops the lock
+
+
+def record_access(path):
+    """Record a read of a cached file (bumps its LRU time)."""
+    key = os.path.relpath(os.path.abspath(path), REPORTS_DIR)
+    with _index_lock():
+        index = _load_json(INDEX_PATH, {})
+        index[key] = {"last_access": time.time()}
+        _write_json(INDEX_PATH, index)
+
+
+def _disk_usage(st):
+    """Bytes a file actually occupies (sparse files such as the shared response cache count as used)."""
+    blocks = getattr(st, "st_blocks", None)
+    return min(st.st_size, blocks * 512) if blocks is not None else st.st_size
+
+
+def _ticker_of(name):
+    """Ticker prefix of a cached file name (AAPL_model.xlsx -> AAPL), if any."""
+    if "_" not in name or DEFAULT_CHART_NAME.match(name):
+        return None
+    return name.split("_", 1)[0].upper()
+
+
+def scan():
+    """List every managed cache file with its size, last access and pin state."""
+    index = _load_json(INDEX_PATH, {})
+    pins = load_pins()
+    entries = []
+    for category, (subdir, pattern) in CACHE_SPECS.items():
+        root = os.path.join(REPORTS_DIR, subdir)
+        if not os.path.isdir(root):
+            continue
+        regex = re.compile(pattern)
+        for dirpath, _, files in os.walk(root):
+            if not subdir and dirpath != root:
+                break  # top-level patterns only match files directly in reports/
+            for name in files:
+                if not regex.match(name) or name.startswith(".cache_"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                rel = os.path.relpath(path, REPORTS_DIR)
+                recorded = index.get(rel, {})
+                entries.append({
+                    "path": path,
+                    "key": rel,
+                    "category": category,
+                    "size": _disk_usage(st),
+                    "last_access": max(st.st_atime, st.st_mtime, recorded.get("last_access", 0)),
+                    "pinned": _ticker_of(name) in pins,
+                })
+    return entries
+
+
+def eviction_order(entries):
+    """Unpinned entries in the order they should be evicted."""
+    candidates = [e for e in entries if not e["pinned"]]
+    # LRU; files last used within the same minute go largest-first
+    return sorted(candidates, key=lambda e: (int(e["last_access"] // 60), -e["size"]))
+
+
+def _evict(path):
+    """Delete a cached file, or empty the shared response cache in place. Returns the bytes still used."""
+    if SHARED_CACHE_FILE.match(os.path.basename(path)):
+        if shared_cache.fcntl is None:
+            raise OSError("the shared cache needs fcntl")
+        cache = shared_cache.SharedCache(path)
+        try:
+            cache.clear()
+        finally:
+            cache.close()
+        return _disk_usage(os.stat(path))
+    os.remove(path)
+    return 0
+
+
+def enforce_budget(budget, dry_run=False):
+    """Evict files until the managed caches fit in `budget` bytes. Returns evicted entries."""
+    entries = scan()
+    total = sum(e["size"] for e in entries)
+    evicted = []
+    for e in eviction_order(entries):
+        if total <= budget:
+            break
+        freed = e["size"]
+        if not dry_run:
+            try:
+                freed -= _evict(e["path"])
+            except OSError:
+                continue
+        total -= freed
+        evicted.append(dict(e, size=freed))
+    if evicted and not dry_run:
+        with _index_lock():
+            index = _load_json(INDEX_PATH, {})
+            for e in evicted:
+                index.pop(e["key"], None)
+            _write_json(INDEX_PATH, index)
+    return evicted
+
+
+# ---------------------------------------------------------------------------
+# Commands
+# ---------------------------------------------------------------------------
+
+def cmd_stats(args):
+    entries = scan()
+    budget = parse_size(args.budget)
+    total = sum(e["size"] for e in entries)
+    print(f"Cache root: {REPORTS_DIR}")
+    print(f"Budget:     {format_size(budget)}  (used {format_size(total)}, {total / budget:.0%})")
+    print(f"Pinned:     {', '.join(sorted(load_pins())) or '(none)'}\n")
+    print(f"{'Category':<12}{'Files':>8}{'Size':>12}{'Pinned':>12}{'Oldest access':>22}")
+    print("-" * 66)
+    for category in CACHE_SPECS:
+        group = [e for e in entries if e["category"] == category]
+        if not group:
+            continue
+        oldest = datetime.fromtimestamp(min(e["last_access"] for e in group)).strftime("%Y-%m-%d %H:%M")
+        pinned = sum(e["size"] for e in group if e["pinned"])
+        print(f"{category:<12}{len(group):>8}{format_size(sum(e['size'] for e in group)):>12}"
+              f"{format_size(pinned):>12}{oldest:>22}")
+    if entries:
+        print("\nNext to evict:")
+        for e in eviction_order(entries)[:5]:
+            accessed = datetime.fromtimestamp(e["last_access"]).strftime("%Y-%m-%d %H:%M")
+            print(f"  {format_size(e['size']):>10}  {accessed}  {e['key']}")
+
+
+def cmd_evict(args):
+    evicted = enforce_budget(parse_size(args.budget), args.dry_run)
+    verb = "Would evict" if args.dry_run else "Evicted"
+    for e in evicted:
+        print(f"  {verb.split()[-1].lower()} {e['key']} ({format_size(e['size'])})")
+    print(f"{verb} {len(evicted)} file(s), {format_size(sum(e['size'] for e in evicted))} freed.")
+
+
+def cmd_pin(args):
+    pins = load_pins() | {t.upper() for t in args.tickers}
+    _write_json(PINS_PATH, sorted(pins))
+    print(f"Pinned: {', '.join(sorted(pins))}")
+
+
+def cmd_unpin(args):
+    pins = load_pins() - {t.upper() for t in args.tickers}
+    _write_json(PINS_PATH, sorted(pins))
+    print(f"Pinned: {', '.join(sorted(pins)) or '(none)'}")
+
+
+def cmd_touch(args):
+    for path in args.paths:
+        if not os.path.exists(path):
+            print(f"  Warning: {path} not found, skipping.", file=sys.stderr)
+            continue
+        record_access(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage on-disk caches under reports/ within a disk budget.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stats_parser = subparsers.add_parser("stats", help="Cache usage by category and eviction preview")
+    stats_parser.add_argument("--budget", default=DEFAULT_BUDGET, help=f"Disk budget (default: {DEFAULT_BUDGET})")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    evict_parser = subparsers.add_parser("evict", help="Evict files until caches fit the budget")
+    evict_parser.add_argument("--budget", default=DEFAULT_BUDGET, help=f"Disk budget (default: {DEFAULT_BUDGET})")
+    evict_parser.add_argument("--dry-run", action="store_true", help="Show what would be evicted")
+    evict_parser.set_defaults(func=cmd_evict)
+
+    pin_parser = subparsers.add_parser("pin", help="Never evict files for these tickers")
+    pin_parser.add_argument("tickers", nargs="+")
+    pin_parser.set_defaults(func=cmd_pin)
+
+    unpin_parser = subparsers.add_parser("unpin", help="Remove tickers from the pin list")
+    unpin_parser.add_argument("tickers", nargs="+")
+    unpin_parser.set_defaults(func=cmd_unpin)
+
+    touch_parser = subparsers.add_parser("touch", help="Record an access to cached files")
+    touch_parser.add_argument("paths", nargs="+")
+    touch_parser.set_defaults(func=cmd_touch)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
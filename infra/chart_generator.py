@@ -33,6 +33,8 @@ import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import numpy as np
 
+from metric_engine import MetricEngine
+
 
 # ---------------------------------------------------------------------------
 # Design system colors
@@ -124,12 +126,7 @@ def _error(message):
 def _compute_yoy_growth(values):
     """Compute YoY growth percentages. Returns list same length as values,
     with None for the first 4 entries (no prior-year comp)."""
-    growth = [None] * len(values)
-    for i in range(4, len(values)):
-        prior = values[i - 4]
-        if prior and prior != 0:
-            growth[i] = ((values[i] - prior) / abs(prior)) * 100
-    return growth
+    return MetricEngine.from_series({"value": values}).values("yoy(value) * 100")
 
 
 # ---------------------------------------------------------------------------
@@ -34,6 +34,8 @@ from openpyxl.styles import (
 )
 from openpyxl.utils import get_column_letter
 
+from metric_engine import STANDARD_METRICS, MetricEngine
+
 # ---------------------------------------------------------------------------
 # Style constants (matching excel_builder.py design system)
 # ---------------------------------------------------------------------------
@@ -175,6 +177,31 @@ def _companies(ctx: dict) -> list[dict]:
     return ctx.get("companies", [])
 
 
+def _fill_derived_metrics(ctx: dict) -> None:
+    """Fill margins/growth the context omits from each company's financials.
+
+    One engine covers the whole universe, so each ratio is computed once as an
+    array op across all companies. Values already in the context win.
+    """
+    companies = _companies(ctx)
+    if not companies:
+        return
+    engine = MetricEngine.from_companies(companies)
+    for name, expr in STANDARD_METRICS.items():
+        target_key = "growth" if "Growth" in name else "margins"
+        try:
+            engine.evaluate(expr)
+        except KeyError:
+            continue  # no company reports the inputs
+        for co in companies:
+            target = co.setdefault(target_key, {})
+            if target.get(name):
+                continue
+            series = engine.series(expr, co.get("ticker"))
+            if series:
+                target[name] = series
+
+
 def _target(ctx: dict) -> dict | None:
     for c in _companies(ctx):
         if c.get("is_target"):
@@ -921,6 +948,8 @@ def build_workbook(ctx: dict) -> Workbook:
     global _STYLES_REGISTERED
     _STYLES_REGISTERED = False
 
+    _fill_derived_metrics(ctx)
+
     wb = Workbook()
     register_styles(wb)
 
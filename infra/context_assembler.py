@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+CLI tool to assemble excel_builder / comp_builder context JSON from the API.
+
+For each ticker it resolves the company, discovers its series catalog, pulls
+the last N quarters of fundamentals for the statement lines the builders use,
+and fetches market data. All of it runs as one job on a thread pool: every
+company's Daloopa calls and its market-data fetch proceed concurrently, while
+the client's rate limiter keeps the whole job inside RATE_LIMIT. Catalog and
+fundamentals responses come from the shared response cache when warm and are
+written through to the local store; market data is cached for
+MARKET_DATA_TTL seconds in the same shared cache.
+
+Statement lines are matched from full series names ("Income Statement | Total
+net sales" -> Revenue) by ordered patterns per builder metric; the shortest
+matching series wins, so totals are preferred over breakdowns. Lines the model
+does not report directly (Gross Profit, EBITDA, Free Cash Flow) are derived
+with the metric engine. Metric names and sections are exactly the ones the
+builders read; `check` builds the workbook from a context and fails if any
+input excel_builder projects from has no history.
+
+Usage:
+    python infra/context_assembler.py model AAPL --output reports/.tmp/AAPL_context.json
+    python infra/context_assembler.py model AAPL --peers MSFT GOOG --quarters 16
+    python infra/context_assembler.py comps AAPL MSFT GOOG AMZN META --output comps_context.json
+    python infra/context_assembler.py check AAPL
+    python infra/context_assembler.py check --context reports/.tmp/AAPL_context.json
+"""
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "recipes"))
+
+from daloopa_client import get, get_fundamentals, resolve_company  # noqa: E402
+from datapoint_meter import QuotaExceeded, metered_job  # noqa: E402
+from fundamentals_store import get_store  # noqa: E402
+from shared_cache import get_cache  # noqa: E402
+
+from excel_builder import build_workbook, missing_inputs  # noqa: E402
+from market_data import get_market_data  # noqa: E402
+from metric_engine import MetricEngine  # noqa: E402
+
+OUTPUT_DIR = ROOT / "reports" / ".tmp"
+DEFAULT_QUARTERS = 12
+DEFAULT_WORKERS = 8
+MARKET_DATA_TTL = 900  # seconds
+MAX_KPIS = 12
+MAX_SEGMENTS = 10
+
+# builder section -> [(metric name, statement prefix, line-item patterns in order of preference)].
+# Names and sections are the ones infra/excel_builder.py reads (see its HISTORICAL_INPUTS):
+# D&A is an income-statement line there even though it is reported on the cash flow.
+STATEMENT_LINES = {
+    "income_statement": [
+        ("Revenue", "Income Statement", [r"^total (net )?revenues?$", r"^total net sales$", r"^(net )?revenues?$",
+                                          r"^net sales$", r"^total revenues? and other income$"]),
+        ("Cost of Sales", "Income Statement", [r"^total cost of (sales|revenues?|goods sold)$",
+                                                r"^cost of (sales|revenues?|goods sold)$"]),
+        ("Gross Profit", "Income Statement", [r"^gross (profit|margin)$"]),
+        ("Research & Development", "Income Statement", [r"^research and development"]),
+        ("Selling, General & Administrative", "Income Statement",
+         [r"^selling, general and administrative", r"^sales, general and administrative", r"^sg&a"]),
+        ("Total Operating Expenses", "Income Statement", [r"^total operating expenses$"]),
+        ("D&A", "Cash Flow", [r"depreciation and amortization", r"depreciation, amortization"]),
+        ("Operating Income", "Income Statement", [r"^(total )?operating income", r"^income from operations"]),
+        ("Other Income/(Expense)", "Income Statement", [r"^other income", r"^total other income"]),
+        ("Pre-tax Income", "Income Statement", [r"^income before (provision for )?income taxes"]),
+        ("Tax Provision", "Income Statement", [r"^provision for income taxes", r"^income tax"]),
+        ("Net Income", "Income Statement", [r"^net income$", r"^net income attributable to"]),
+        ("EPS", "Income Statement", [r"(eps|earnings per share).*diluted", r"^diluted (eps|earnings per share)",
+                                     r"^(eps|earnings per share)$"]),
+        ("Diluted Shares", "Income Statement", [r"diluted.*shares", r"shares.*diluted"]),
+    ],
+    "balance_sheet": [
+        ("Cash & Equivalents", "Balance Sheet", [r"^cash and cash equivalents$", r"^cash and cash equivalents"]),
+        ("Short-term Investments", "Balance Sheet", [r"^(current )?marketable securities", r"^short-term investments",
+                                                     r"^current assets:? \| marketable securities$"]),
+        ("Accounts Receivable", "Balance Sheet", [r"^accounts receivable"]),
+        ("Vendor Non-trade Receivables", "Balance Sheet", [r"vendor non-trade receivables"]),
+        ("Inventories", "Balance Sheet", [r"^inventor(y|ies)$"]),
+        ("Other Current Assets", "Balance Sheet", [r"other current assets$"]),
+        ("Total Current Assets", "Balance Sheet", [r"^total current assets$"]),
+        ("Long-term Investments", "Balance Sheet", [r"^(non-current|long-term) marketable securities",
+                                                    r"^long-term investments",
+                                                    r"^non-current assets:? \| marketable securities$"]),
+        ("PP&E (net)", "Balance Sheet", [r"property,? (plant )?and equipment, net"]),
+        ("Other Non-current Assets", "Balance Sheet", [r"other non-current assets$"]),
+        ("Total Non-current Assets", "Balance Sheet", [r"^total non-current assets$"]),
+        ("Total Assets", "Balance Sheet", [r"^total assets$"]),
+        ("Accounts Payable", "Balance Sheet", [r"^accounts payable"]),
+        ("Deferred Revenue (Current)", "Balance Sheet", [r"^deferred revenue"]),
+        ("Commercial Paper", "Balance Sheet", [r"^commercial paper$"]),
+        ("Current Term Debt", "Balance Sheet", [r"^(current portion of )?term debt", r"^short-term debt"]),
+        ("Other Current Liabilities", "Balance Sheet", [r"other current liabilities$"]),
+        ("Total Current Liabilities", "Balance Sheet", [r"^total current liabilities$"]),
+        ("Long-term Debt", "Balance Sheet", [r"^long-term debt", r"^term debt$"]),
+        ("Other Non-current Liabilities", "Balance Sheet", [r"other non-current liabilities$",
+                                                            r"^other long-term liabilities"]),
+        ("Total Non-current Liabilities", "Balance Sheet", [r"^total non-current liabilities$"]),
+        ("Total Liabilities", "Balance Sheet", [r"^total liabilities$"]),
+        ("Total Shareholders Equity", "Balance Sheet", [r"^total (shareholders'?|stockholders'?) equity$"]),
+    ],
+    "cash_flow": [
+        ("Depreciation & Amortization", "Cash Flow", [r"depreciation and amortization",
+                                                      r"depreciation, amortization"]),
+        ("Share-based Compensation", "Cash Flow", [r"^(share|stock)-based compensation"]),
+        ("Operating Cash Flow", "Cash Flow", [r"^cash generated by operating activities",
+                                              r"^net cash (provided by|from) operating activities"]),
+        ("Capital Expenditures", "Cash Flow", [r"^payments for acquisition of property",
+                                               r"^purchases? of property", r"^capital expenditures"]),
+        ("Net Cash from Investing", "Cash Flow", [r"^cash (generated by|used in) investing activities",
+                                                  r"^net cash (provided by|used in|from) investing activities"]),
+        ("Dividends Paid", "Cash Flow", [r"^payments for dividends", r"^dividends paid"]),
+        ("Share Repurchases", "Cash Flow", [r"^repurchases? of common stock", r"^common stock repurchased"]),
+        ("Net Cash from Financing", "Cash Flow", [r"^cash (generated by|used in) financing activities",
+                                                  r"^net cash (provided by|used in|from) financing activities"]),
+    ],
+}
+
+# Lines computed when the model does not report them: (section, metric, expression)
+DERIVED_LINES = [
+    ("income_statement", "Gross Profit", "revenue - cost_of_sales"),
+    ("cash_flow", "Free Cash Flow", "operating_cash_flow - abs(capital_expenditures)"),
+]
+
+KPI_PREFIXES = ("Operating Metrics", "KPI", "Key Performance Indicators", "Segment")
+# comp_builder shows the first six; Free Cash Flow feeds its FCF Margin
+COMP_FINANCIALS = ["Revenue", "Gross Profit", "Operating Income", "EBITDA", "Net Income", "EPS", "Free Cash Flow"]
+COMP_MARKET_SCALE = {"market_cap": 1e-6, "enterprise_value": 1e-6}  # comp sheet shows $mm
+
+
+# ---------------------------------------------------------------------------
+# Series discovery
+# ---------------------------------------------------------------------------
+
+def _split_name(full_name: str) -> list[str]:
+    return [part.strip() for part in (full_name or "").split("|")]
+
+
+def match_statement_lines(catalog: list[dict]) -> dict[str, dict[str, dict]]:
+    """{section: {metric: series}} for the builder metrics found in a series catalog."""
+    parsed = [(s, _split_name(s.get("full_series_name"))) for s in catalog]
+    matched = {}
+    for section, lines in STATEMENT_LINES.items():
+        found = {}
+        for metric, statement, patterns in lines:
+            candidates = [(s, parts) for s, parts in parsed
+                          if len(parts) >= 2 and parts[0].lower().startswith(statement.lower())]
+            for pattern in patterns:
+                regex = re.compile(pattern, re.IGNORECASE)
+                hits = [(len(parts), s["id"], s) for s, parts in candidates
+                        if regex.search(" | ".join(parts[1:]))]
+                if hits:
+                    found[metric] = min(hits, key=lambda h: (h[0], h[1]))[2]
+                    break
+        matched[section] = found
+    return matched
+
+
+def revenue_segments(catalog: list[dict], revenue: dict | None) -> list[dict]:
+    """Direct breakdowns of the chosen revenue series ("Income Statement | Net sales | Products")."""
+    if not revenue:
+        return []
+    prefix = _split_name(revenue.get("full_series_name"))
+    if prefix[-1].lower().startswith("total "):  # "Total net sales" is broken down under "Net sales"
+        prefix = prefix[:-1] + [prefix[-1][len("total "):]]
+    base = [p.lower() for p in prefix]
+    segments = []
+    for s in catalog:
+        parts = _split_name(s.get("full_series_name"))
+        if len(parts) == len(base) + 1 and [p.lower() for p in parts[:-1]] == base:
+            segments.append(s)
+    return segments[:MAX_SEGMENTS]
+
+
+def kpi_series(catalog: list[dict]) -> list[dict]:
+    """Top-level operating KPI series (two-part names under a KPI/segment heading)."""
+    kpis = [s for s in catalog
+            if len(_split_name(s.get("full_series_name"))) == 2
+            and _split_name(s.get("full_series_name"))[0].startswith(KPI_PREFIXES)]
+    return kpis[:MAX_KPIS]
+
+
+# ---------------------------------------------------------------------------
+# Fetching
+# ---------------------------------------------------------------------------
+
+def quarters_back(latest: str, n: int) -> list[str]:
+    """The n calendar quarters ending at latest ("2024Q4"), oldest first."""
+    year, quarter = int(latest[:4]), int(latest[-1])
+    periods = []
+    for _ in range(n):
+        periods.append(f"{year}Q{quarter}")
+        year, quarter = (year, quarter - 1) if quarter > 1 else (year - 1, 4)
+    return periods[::-1]
+
+
+def fetch_market_data(ticker: str) -> dict:
+    """Quote and multiples for a ticker, shared across processes for MARKET_DATA_TTL."""
+    cache = get_cache()
+    key = f"market_data|{ticker}"
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    try:
+        data = get_market_data(ticker)
+    except ImportError:
+        print(f"  Warning: yfinance is not installed; no market data for {ticker}.", file=sys.stderr)
+        return {}
+    data = {k: v for k, v in data.items() if v is not None and k != "ticker"}
+    if cache is not None:
+        cache.put(key, data, MARKET_DATA_TTL)
+    return data
+
+
+def fetch_company(ticker: str, quarters: int) -> dict:
+    """Catalog and fundamentals for one ticker as {company, periods, sections, segments, kpis}."""
+    company = resolve_company(ticker)
+    if not company:
+        raise LookupError(f"No company found for '{ticker}'")
+    if not company.get("latest_quarter"):
+        raise LookupError(f"'{ticker}' has no latest_quarter; its model may not be available")
+    company_id = company["id"]
+    catalog = get("/companies/series", params={"company_id": company_id})
+    get_store().upsert_series(company_id, catalog)
+
+    matched = match_statement_lines(catalog)
+    segments = revenue_segments(catalog, matched["income_statement"].get("Revenue"))
+    kpis = kpi_series(catalog)
+
+    periods = quarters_back(company["latest_quarter"], quarters)
+    series_ids = sorted({s["id"] for lines in matched.values() for s in lines.values()}
+                        | {s["id"] for s in segments} | {s["id"] for s in kpis})
+    values: dict[int, dict[str, float]] = {}
+    if series_ids:
+        for dp in get_fundamentals(company_id, periods, series_ids):
+            if dp.value_raw is not None:
+                values.setdefault(dp.series_id, {})[dp.calendar_period] = dp.value_raw
+
+    def section(named: dict[str, dict]) -> dict[str, dict[str, float]]:
+        return {name: values[s["id"]] for name, s in named.items() if values.get(s["id"])}
+
+    sections = {key: section(lines) for key, lines in matched.items()}
+    reported = {p for series in values.values() for p in series}
+    return {
+        "company": company,
+        "periods": [p for p in periods if p in reported],
+        "sections": sections,
+        "segments": section({_split_name(s["full_series_name"])[-1]: s for s in segments}),
+        "kpis": section({_split_name(s["full_series_name"])[-1]: s for s in kpis}),
+    }
+
+
+def fetch_all(tickers: list[str], quarters: int = DEFAULT_QUARTERS,
+              workers: int = DEFAULT_WORKERS) -> tuple[dict, dict]:
+    """Fetch every ticker's fundamentals and market data concurrently.
+
+    Returns ({ticker: company data}, {ticker: market data}); tickers that fail
+    are reported and left out. QuotaExceeded stops the whole job.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        fundamentals = {t: pool.submit(fetch_company, t, quarters) for t in tickers}
+        market = {t: pool.submit(fetch_market_data, t) for t in tickers}
+        companies, market_data = {}, {}
+        for t in tickers:
+            try:
+                companies[t] = fundamentals[t].result()
+            except QuotaExceeded:
+                for f in [*fundamentals.values(), *market.values()]:
+                    f.cancel()
+                raise
+            except Exception as e:
+                print(f"  Warning: {t}: {e}", file=sys.stderr)
+                continue
+            try:
+                market_data[t] = market[t].result()
+            except Exception as e:
+                print(f"  Warning: market data for {t}: {e}", file=sys.stderr)
+                market_data[t] = {}
+    return companies, market_data
+
+
+# ---------------------------------------------------------------------------
+# Context assembly
+# ---------------------------------------------------------------------------
+
+def _derive_lines(data: dict) -> dict:
+    """Fill DERIVED_LINES and EBITDA into the statement sections where they are missing."""
+    sections = data["sections"]
+    engine = MetricEngine.from_sections(list(sections.values()), data["periods"])
+    derived = DERIVED_LINES + [("income_statement", "EBITDA", "operating_income + d_a")]
+    for section, metric, expr in derived:
+        if metric in sections[section]:
+            continue
+        try:
+            series = engine.series(expr)
+        except KeyError:
+            continue
+        if series:
+            sections[section][metric] = series
+    return sections
+
+
+def model_context(data: dict, market: dict, peers: list[tuple[dict, dict]] | None = None) -> dict:
+    """excel_builder context for one company, with an optional peer multiples table."""
+    company = data["company"]
+    sections = _derive_lines(data)
+    ctx = {
+        "company": {
+            "name": company.get("name") or market.get("name"),
+            "ticker": company.get("ticker"),
+            "exchange": market.get("exchange"),
+            "currency": market.get("currency"),
+        },
+        "market_data": {k: v for k, v in market.items() if k not in ("name", "exchange", "currency")},
+        "periods": data["periods"],
+        "projected_periods": [],
+        **sections,
+    }
+    if data["segments"]:
+        ctx["segments"] = {"Revenue by Segment": data["segments"]}
+    if data["kpis"]:
+        ctx["kpis"] = data["kpis"]
+    if peers:
+        ctx["comps"] = {"peers": [_peer_row(d, m) for d, m in peers]}
+    return ctx
+
+
+def _peer_row(data: dict, market: dict) -> dict:
+    income = _derive_lines(data)["income_statement"]
+    engine = MetricEngine.from_sections(income, data["periods"])
+    row = {"ticker": data["company"].get("ticker"), "name": data["company"].get("name") or market.get("name")}
+    for key in ("trailing_pe", "ev_ebitda", "price_to_sales"):
+        if market.get(key) is not None:
+            row[key] = market[key]
+    for key, expr in (("revenue_growth", "yoy(revenue)"), ("op_margin", "operating_income / revenue")):
+        try:
+            series = engine.series(expr)
+        except KeyError:
+            continue
+        if series:
+            row[key] = series[max(series)]
+    return row
+
+
+def comp_context(target: str, companies: dict, market_data: dict) -> dict:
+    """comp_builder context; margins and growth are left for comp_builder to derive."""
+    entries = []
+    for ticker, data in companies.items():
+        sections = _derive_lines(data)
+        lines = {**sections["cash_flow"], **sections["income_statement"]}
+        market = {k: (v * COMP_MARKET_SCALE[k] if k in COMP_MARKET_SCALE else v)
+                  for k, v in market_data.get(ticker, {}).items()}
+        entries.append({
+            "ticker": data["company"].get("ticker") or ticker,
+            "name": data["company"].get("name") or market.get("name"),
+            "is_target": ticker == target,
+            "periods": data["periods"],
+            "financials": {m: lines[m] for m in COMP_FINANCIALS if m in lines},
+            "market_data": market,
+            "kpis": {**data["segments"], **data["kpis"]},
+            "kpi_categories": {"Segment Revenue": list(data["segments"]), "Other KPIs": list(data["kpis"])},
+        })
+    return {
+        "target_ticker": target,
+        "as_of_date": date.today().isoformat(),
+        "companies": entries,
+    }
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def _write(ctx: dict, output: str | None, default_name: str) -> Path:
+    path = Path(output) if output else OUTPUT_DIR / default_name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(ctx, indent=2, default=str))
+    return path
+
+
+def cmd_model(args):
+    ticker = args.ticker.upper()
+    peers = [p.upper() for p in args.peers or []]
+    start = time.perf_counter()
+    try:
+        with metered_job(f"context model {ticker}", quota=args.quota) as meter:
+            companies, market_data = fetch_all([ticker] + peers, args.quarters, args.workers)
+    except QuotaExceeded as e:
+        print(f"Stopped: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(meter.report())
+    if ticker not in companies:
+        sys.exit(1)
+    peer_data = [(companies[p], market_data[p]) for p in peers if p in companies]
+    ctx = model_context(companies[ticker], market_data[ticker], peer_data)
+    path = _write(ctx, args.output, f"{ticker}_context.json")
+    print(f"Wrote model context for {ticker} ({len(ctx['periods'])} quarters, "
+          f"{len(peer_data)} peers) to {path} in {time.perf_counter() - start:.1f}s")
+
+
+def cmd_comps(args):
+    tickers = [t.upper() for t in args.tickers]
+    start = time.perf_counter()
+    try:
+        with metered_job(f"context comps {tickers[0]}", quota=args.quota) as meter:
+            companies, market_data = fetch_all(tickers, args.quarters, args.workers)
+    except QuotaExceeded as e:
+        print(f"Stopped: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(meter.report())
+    if tickers[0] not in companies:
+        sys.exit(1)
+    ctx = comp_context(tickers[0], companies, market_data)
+    path = _write(ctx, args.output, f"{tickers[0]}_comps_context.json")
+    print(f"Wrote comp context for {len(ctx['companies'])} companies to {path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def cmd_check(args):
+    """Build the workbook from a context and fail if the builder had to fall back to defaults."""
+    if args.context:
+        ctx = json.loads(Path(args.context).read_text())
+        label = args.context
+    elif args.ticker:
+        label = args.ticker.upper()
+        companies, market_data = fetch_all([label], args.quarters, args.workers)
+        if label not in companies:
+            sys.exit(1)
+        ctx = model_context(companies[label], market_data[label])
+    else:
+        print("check needs a TICKER or --context", file=sys.stderr)
+        sys.exit(2)
+    missing = missing_inputs(ctx)
+    wb = build_workbook(copy.deepcopy(ctx))
+    print(f"Built {len(wb.sheetnames)} sheets from {label} ({len(ctx.get('periods', []))} quarters)")
+    if missing:
+        print(f"{len(missing)} builder inputs have no history, so their projections use defaults:")
+        for m in missing:
+            print(f"  {m}")
+        sys.exit(1)
+    print("Every builder input has history.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Assemble excel_builder / comp_builder context JSON from the Daloopa API.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python infra/context_assembler.py model AAPL
+  python infra/context_assembler.py model AAPL --peers MSFT GOOG --quarters 16
+  python infra/context_assembler.py comps AAPL MSFT GOOG AMZN META --output comps_context.json
+  python infra/context_assembler.py check AAPL
+        """,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    model_parser = subparsers.add_parser("model", help="Context for excel_builder.py")
+    model_parser.add_argument("ticker", help="Company ticker")
+    model_parser.add_argument("--peers", nargs="+", help="Peer tickers for the Comps tab")
+    model_parser.set_defaults(func=cmd_model)
+
+    comps_parser = subparsers.add_parser("comps", help="Context for comp_builder.py (first ticker is the target)")
+    comps_parser.add_argument("tickers", nargs="+", help="Target ticker followed by its peers")
+    comps_parser.set_defaults(func=cmd_comps)
+
+    for p in (model_parser, comps_parser):
+        p.add_argument("--quarters", type=int, default=DEFAULT_QUARTERS,
+                       help=f"Quarters of history (default: {DEFAULT_QUARTERS})")
+        p.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                       help=f"Concurrent fetch threads (default: {DEFAULT_WORKERS})")
+        p.add_argument("--output", help="Output path (default: reports/.tmp/<TICKER>_context.json)")
+        p.add_argument("--quota", type=int, help="Fail before pulling more than this many datapoints")
+
+    check_parser = subparsers.add_parser("check", help="Build a model from a context; fail on missing builder inputs")
+    check_parser.add_argument("ticker", nargs="?", help="Assemble the context for this ticker first")
+    check_parser.add_argument("--context", help="Check an existing context JSON instead")
+    check_parser.add_argument("--quarters", type=int, default=DEFAULT_QUARTERS,
+                              help=f"Quarters of history (default: {DEFAULT_QUARTERS})")
+    check_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                              help=f"Concurrent fetch threads (default: {DEFAULT_WORKERS})")
+    check_parser.set_defaults(func=cmd_check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,8 @@ from openpyxl.styles import (
 )
 from openpyxl.utils import get_column_letter
 
+from metric_engine import MetricEngine
+
 
 # ---------------------------------------------------------------------------
 # Style helpers
@@ -1137,33 +1139,20 @@ def _merge_projections_into_financials(ctx: dict) -> None:
                 break
 
 
-def _historical_ratio(section: dict, numerator: str, denominator: str,
-                      periods: list) -> float | None:
-    """Compute trailing average ratio of numerator/denominator over recent periods."""
-    num_series = section.get(numerator, {})
-    den_series = section.get(denominator, {})
-    ratios = []
-    for p in reversed(periods):
-        n = num_series.get(p)
-        d = den_series.get(p)
-        if n is not None and d is not None and d != 0:
-            ratios.append(n / d)
-        if len(ratios) >= 4:
-            break
-    return sum(ratios) / len(ratios) if ratios else None
+def _historical_ratio(hist: MetricEngine, numerator: str, denominator: str) -> float | None:
+    """Trailing 4-period average of numerator/denominator over the historical periods."""
+    try:
+        return hist.trailing_mean(f"{numerator!r} / {denominator!r}")
+    except KeyError:
+        return None
 
 
-def _trailing_avg(section: dict, metric: str, periods: list, n: int = 4) -> float | None:
-    """Compute trailing average of a metric over the last n available periods."""
-    series = section.get(metric, {})
-    vals = []
-    for p in reversed(periods):
-        v = series.get(p)
-        if v is not None:
-            vals.append(v)
-        if len(vals) >= n:
-            break
-    return sum(vals) / len(vals) if vals else None
+def _trailing_avg(hist: MetricEngine, metric: str, n: int = 4) -> float | None:
+    """Average of a metric over its last n available historical periods."""
+    try:
+        return hist.trailing_mean(repr(metric), n)
+    except KeyError:
+        return None
 
 
 def _last_value(section: dict, metric: str, periods: list):
@@ -1176,6 +1165,32 @@ def _last_value(section: dict, metric: str, periods: list):
     return None
 
 
+# Historical lines _enrich_projections reads; without them it falls back to
+# zeros, flat values or the default tax rate (see missing_inputs)
+HISTORICAL_INPUTS = {
+    "income_statement": ["Revenue", "Gross Profit", "Operating Income", "Net Income", "D&A",
+                         "Research & Development", "Selling, General & Administrative",
+                         "Other Income/(Expense)"],
+    "balance_sheet": ["Cash & Equivalents", "Accounts Receivable", "PP&E (net)", "Accounts Payable",
+                      "Total Current Assets", "Total Current Liabilities", "Total Assets",
+                      "Total Liabilities", "Total Shareholders Equity"],
+    "cash_flow": ["Operating Cash Flow", "Capital Expenditures", "Free Cash Flow", "Share-based Compensation",
+                  "Dividends Paid", "Share Repurchases"],
+}
+
+
+def missing_inputs(ctx: dict) -> list[str]:
+    """HISTORICAL_INPUTS with no historical value in the context, as "section: metric"."""
+    periods = ctx.get("periods", [])
+    missing = []
+    for section, metrics in HISTORICAL_INPUTS.items():
+        data = ctx.get(section) or {}
+        for metric in metrics:
+            if not any((data.get(metric) or {}).get(p) is not None for p in periods):
+                missing.append(f"{section}: {metric}")
+    return missing
+
+
 def _enrich_projections(ctx: dict) -> None:
     """Derive sub-line items for projected periods from high-level projections.
 
@@ -1193,6 +1208,10 @@ def _enrich_projections(ctx: dict) -> None:
     assumptions = ctx.get("projection_assumptions", {})
     tax_rate = assumptions.get("tax_rate", 0.16)
 
+    # Historical ratios are evaluated once over all three statements and reused
+    # for every projected period
+    hist = MetricEngine.from_sections([is_data, cf_data, bs_data], hist_periods)
+
     # ---- Income Statement derivations ----
     for p in proj_periods:
         rev = is_data.get("Revenue", {}).get(p)
@@ -1207,17 +1226,17 @@ def _enrich_projections(ctx: dict) -> None:
             is_data.setdefault("Cost of Sales", {})[p] = round(rev - gp)
 
         # D&A: project as % of revenue
-        da_ratio = _historical_ratio(is_data, "D&A", "Revenue", hist_periods)
+        da_ratio = _historical_ratio(hist, "D&A", "Revenue")
         if da_ratio is not None:
             is_data.setdefault("D&A", {})[p] = round(rev * da_ratio)
 
         # R&D: project as % of revenue
-        rd_ratio = _historical_ratio(is_data, "Research & Development", "Revenue", hist_periods)
+        rd_ratio = _historical_ratio(hist, "Research & Development", "Revenue")
         if rd_ratio is not None:
             is_data.setdefault("Research & Development", {})[p] = round(rev * rd_ratio)
 
         # SG&A: project as % of revenue
-        sga_ratio = _historical_ratio(is_data, "Selling, General & Administrative", "Revenue", hist_periods)
+        sga_ratio = _historical_ratio(hist, "Selling, General & Administrative", "Revenue")
         if sga_ratio is not None:
             is_data.setdefault("Selling, General & Administrative", {})[p] = round(rev * sga_ratio)
 
@@ -1226,7 +1245,7 @@ def _enrich_projections(ctx: dict) -> None:
             is_data.setdefault("Total Operating Expenses", {})[p] = round(rev - op_inc)
 
         # Other Income/(Expense): trailing average
-        other_avg = _trailing_avg(is_data, "Other Income/(Expense)", hist_periods)
+        other_avg = _trailing_avg(hist, "Other Income/(Expense)")
         if other_avg is not None:
             is_data.setdefault("Other Income/(Expense)", {})[p] = round(other_avg)
 
@@ -1254,19 +1273,19 @@ def _enrich_projections(ctx: dict) -> None:
             cf_data.setdefault("Depreciation & Amortization", {})[p] = da_val
 
         # SBC: project as % of revenue
-        sbc_ratio = _historical_ratio(cf_data, "Share-based Compensation", "Operating Cash Flow", hist_periods)
+        sbc_ratio = _historical_ratio(hist, "Share-based Compensation", "Operating Cash Flow")
         if sbc_ratio is not None:
             ocf = cf_data.get("Operating Cash Flow", {}).get(p)
             if ocf is not None:
                 cf_data.setdefault("Share-based Compensation", {})[p] = round(ocf * sbc_ratio)
 
         # Dividends Paid: trailing average
-        div_avg = _trailing_avg(cf_data, "Dividends Paid", hist_periods)
+        div_avg = _trailing_avg(hist, "Dividends Paid")
         if div_avg is not None:
             cf_data.setdefault("Dividends Paid", {})[p] = round(div_avg)
 
         # Share Repurchases: trailing average
-        buyback_avg = _trailing_avg(cf_data, "Share Repurchases", hist_periods)
+        buyback_avg = _trailing_avg(hist, "Share Repurchases")
         if buyback_avg is not None:
             cf_data.setdefault("Share Repurchases", {})[p] = round(buyback_avg)
 
@@ -1305,21 +1324,8 @@ def _enrich_projections(ctx: dict) -> None:
         for bs_metric in ["Accounts Receivable", "Inventories", "Accounts Payable",
                           "Deferred Revenue (Current)", "Other Current Assets",
                           "Other Current Liabilities"]:
-            ratio = _historical_ratio(bs_data, bs_metric, is_data.get("Revenue") and "Revenue",
-                                      hist_periods)
-            # Use direct ratio to revenue from historical
-            hist_series = bs_data.get(bs_metric, {})
-            rev_series = is_data.get("Revenue", {})
-            ratios = []
-            for hp in reversed(hist_periods):
-                bv = hist_series.get(hp)
-                rv = rev_series.get(hp)
-                if bv is not None and rv is not None and rv != 0:
-                    ratios.append(bv / rv)
-                if len(ratios) >= 4:
-                    break
-            if ratios:
-                avg_ratio = sum(ratios) / len(ratios)
+            avg_ratio = _historical_ratio(hist, bs_metric, "Revenue")
+            if avg_ratio is not None:
                 bs_data.setdefault(bs_metric, {})[p] = round(rev * avg_ratio)
 
         # Short/Long-term Investments: hold flat at last known value
@@ -70,18 +70,29 @@ def _safe_get(info, key):
 
 def cmd_quote(args):
     """Fetch current quote data for a single ticker."""
+    result = _get_quote(args.ticker.upper())
+    print(json.dumps(result, indent=2, default=str))
+
+
+def _get_info(ticker_str):
+    """yfinance info dict for a ticker, empty on failure."""
     import yfinance
 
-    ticker_str = args.ticker.upper()
     ticker = yfinance.Ticker(ticker_str)
 
     try:
-        info = ticker.info
+        return ticker.info
     except Exception as e:
         print(f"Error fetching data for {ticker_str}: {e}", file=sys.stderr)
-        info = {}
+        return {}
 
-    result = {
+
+def _get_quote(ticker_str, info=None):
+    """Internal helper to fetch quote data for a ticker. Returns a dict."""
+    if info is None:
+        info = _get_info(ticker_str)
+
+    return {
         "ticker": ticker_str,
         "name": _safe_get(info, "longName") or _safe_get(info, "shortName"),
         "price": _safe_get(info, "currentPrice") or _safe_get(info, "regularMarketPrice"),
@@ -94,7 +105,14 @@ def cmd_quote(args):
         "exchange": _safe_get(info, "exchange"),
     }
 
-    print(json.dumps(result, indent=2, default=str))
+
+def get_market_data(ticker_str):
+    """Quote and multiples for a ticker from a single info fetch. Returns a dict."""
+    info = _get_info(ticker_str)
+    result = _get_quote(ticker_str, info)
+    result.update(_get_multiples(ticker_str, info))
+    result["enterprise_value"] = _safe_get(info, "enterpriseValue")
+    return result
 
 
 def cmd_multiples(args):
@@ -106,17 +124,10 @@ def cmd_multiples(args):
     print(json.dumps(result, indent=2, default=str))
 
 
-def _get_multiples(ticker_str):
+def _get_multiples(ticker_str, info=None):
     """Internal helper to fetch multiples for a ticker. Returns a dict."""
-    import yfinance
-
-    ticker = yfinance.Ticker(ticker_str)
-
-    try:
-        info = ticker.info
-    except Exception as e:
-        print(f"Error fetching data for {ticker_str}: {e}", file=sys.stderr)
-        info = {}
+    if info is None:
+        info = _get_info(ticker_str)
 
     return {
         "ticker": ticker_str,
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Vectorized derived-metric engine.
+
+Holds base metrics as a NumPy cube (metric x entity x period, NaN = missing)
+and evaluates small expressions over it, for one company or a whole comp
+universe at once:
+
+    gross_margin = gross_profit / revenue
+    yoy(revenue)
+    ttm(net_income) / ttm(revenue)
+    "D&A" / revenue                   # quoted names match metrics exactly
+
+Identifiers match metric names after normalization ("Gross Profit" ->
+gross_profit). Division by zero and any missing operand give NaN. Every
+expression (and sub-expression) is evaluated once per engine and memoized, so
+consumers that ask for the same margin share one computation.
+
+Functions:
+    lag(x, n=1)   value n periods earlier        diff(x, n=1)  x - lag(x, n)
+    yoy(x)        growth vs. same period last year, over |prior|
+    qoq(x)        growth vs. previous period, over |prior|
+    ttm(x)        trailing sum over one year of periods (NaN if any missing)
+    avg(x, n)     rolling mean over n periods    abs(x)
+
+Shifts and windows move by period, not by column: YYYYQn and YYYYFY labels are
+mapped to period ordinals, so when a period is absent from the cube (a gap in
+one company's reporting, or in a peer union) yoy/lag/ttm give NaN instead of
+using the wrong quarter. Other labels are taken as consecutive periods.
+
+Usage:
+    from metric_engine import MetricEngine
+
+    engine = MetricEngine.from_sections(ctx["income_statement"], ctx["periods"])
+    engine.series("gross_profit / revenue")          # {period: margin}
+
+    universe = MetricEngine.from_companies(ctx["companies"])
+    universe.evaluate("yoy(revenue)")                # ndarray (companies x periods)
+
+    python infra/metric_engine.py --context context.json "operating_income / revenue"
+"""
+
+import argparse
+import ast
+import json
+import math
+import re
+import sys
+
+import numpy as np
+
+# Standard derived metrics, keyed by the names consumers already use
+STANDARD_METRICS = {
+    "Gross Margin": "gross_profit / revenue",
+    "Operating Margin": "operating_income / revenue",
+    "EBITDA Margin": "ebitda / revenue",
+    "Net Margin": "net_income / revenue",
+    "FCF Margin": "free_cash_flow / revenue",
+    "Revenue Growth YoY": "yoy(revenue)",
+    "EPS Growth YoY": "yoy(eps)",
+}
+
+_BINOPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: None,  # handled by _div (zero denominators -> NaN)
+    ast.Pow: np.power,
+}
+
+_FUNCTIONS = ("lag", "diff", "yoy", "qoq", "ttm", "avg", "abs")
+
+_QUARTER = re.compile(r"^(\d{4})\s*-?\s*Q([1-4])[AE]?$", re.IGNORECASE)
+_YEAR = re.compile(r"^(?:FY\s*)?(\d{4})(?:\s*FY)?[AE]?$", re.IGNORECASE)
+
+
+def normalize_name(name: str) -> str:
+    """Metric name -> identifier: 'Gross Profit' -> 'gross_profit', 'D&A' -> 'd_a'."""
+    return re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+
+
+def _div(a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.true_divide(a, b)
+    return np.where(b == 0, np.nan, out)
+
+
+def period_ordinals(periods: list[str]) -> list[int]:
+    """Consecutive-period ordinals: year*4 + quarter for YYYYQn, year for YYYYFY, else position."""
+    quarters = [_QUARTER.match(str(p)) for p in periods]
+    if periods and all(quarters):
+        return [int(m[1]) * 4 + int(m[2]) - 1 for m in quarters]
+    years = [_YEAR.match(str(p)) for p in periods]
+    if periods and all(years):
+        return [int(m[1]) for m in years]
+    return list(range(len(periods)))
+
+
+def _to_float(v):
+    if v is None:
+        return np.nan
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class MetricEngine:
+    """Base metrics as a (metric x entity x period) cube plus memoized expressions."""
+
+    def __init__(self, cube: np.ndarray, metrics: list[str], entities: list, periods: list[str],
+                 periods_per_year: int = 4):
+        self.cube = cube
+        self.metrics = list(metrics)
+        self.entities = list(entities)
+        self.periods = list(periods)
+        self.periods_per_year = periods_per_year
+        self.ordinals = period_ordinals(self.periods)
+        self._index = {}
+        for i, name in enumerate(self.metrics):
+            self._index.setdefault(name, i)
+            self._index.setdefault(normalize_name(name), i)
+        self._defined = {}
+        self._memo = {}
+
+    # -- constructors --------------------------------------------------------
+
+    @classmethod
+    def from_series(cls, data: dict[str, list], periods: list[str] | None = None, **kwargs) -> "MetricEngine":
+        """One entity from period-aligned lists: {"revenue": [..], "cost_of_revenue": [..]}."""
+        length = max((len(v) for v in data.values() if v is not None), default=0)
+        periods = list(periods) if periods is not None else [str(i) for i in range(length)]
+        cube = np.full((len(data), 1, len(periods)), np.nan)
+        for m, values in enumerate(data.values()):
+            for t, v in enumerate((values or [])[:len(periods)]):
+                cube[m, 0, t] = _to_float(v)
+        return cls(cube, list(data), [None], periods, **kwargs)
+
+    @classmethod
+    def from_sections(cls, sections: dict | list[dict], periods: list[str], **kwargs) -> "MetricEngine":
+        """One entity from {metric: {period: value}} sections (several are merged in order)."""
+        if isinstance(sections, dict):
+            sections = [sections]
+        merged = {}
+        for section in sections:
+            for metric, series in (section or {}).items():
+                if isinstance(series, dict):
+                    merged.setdefault(metric, series)
+        return cls._from_period_dicts([merged], [None], periods, **kwargs)
+
+    @classmethod
+    def from_companies(cls, companies: list[dict], keys: tuple = ("financials",), **kwargs) -> "MetricEngine":
+        """Whole comp universe: one entity per company, periods are the union of theirs."""
+        periods = sorted({p for co in companies for p in co.get("periods", [])})
+        per_company = []
+        for co in companies:
+            merged = {}
+            for key in keys:
+                for metric, series in (co.get(key) or {}).items():
+                    if isinstance(series, dict):
+                        merged.setdefault(metric, series)
+            per_company.append(merged)
+        entities = [co.get("ticker") for co in companies]
+        return cls._from_period_dicts(per_company, entities, periods, **kwargs)
+
+    @classmethod
+    def from_store(cls, store, series_map: dict[str, dict[int, int]], field: str = "value_raw",
+                   **kwargs) -> "MetricEngine":
+        """Companies in the local fundamentals store.
+
+        `series_map` maps a metric name to each company's series for it, e.g.
+        {"revenue": {2: 1464412, 7: 2211850}, "gross_profit": {...}}.
+        """
+        company_ids = sorted({cid for by_company in series_map.values() for cid in by_company})
+        per_company = [{} for _ in company_ids]
+        for e, cid in enumerate(company_ids):
+            wanted = {by_company[cid]: metric for metric, by_company in series_map.items() if cid in by_company}
+            for dp in store.datapoints(cid, series_ids=list(wanted)):
+                per_company[e].setdefault(wanted[dp.series_id], {})[dp.calendar_period] = getattr(dp, field)
+        periods = sorted({p for d in per_company for s in d.values() for p in s})
+        engine = cls._from_period_dicts(per_company, company_ids, periods, **kwargs)
+        for metric in series_map:
+            if metric not in engine._index:
+                engine._add_metric(metric, np.full((len(company_ids), len(periods)), np.nan))
+        return engine
+
+    @classmethod
+    def _from_period_dicts(cls, per_entity: list[dict], entities: list, periods: list[str], **kwargs):
+        metrics = list(dict.fromkeys(m for d in per_entity for m in d))
+        col = {p: t for t, p in enumerate(periods)}
+        cube = np.full((len(metrics), len(entities), len(periods)), np.nan)
+        for m, metric in enumerate(metrics):
+            for e, d in enumerate(per_entity):
+                for p, v in (d.get(metric) or {}).items():
+                    t = col.get(p)
+                    if t is not None:
+                        cube[m, e, t] = _to_float(v)
+        return cls(cube, metrics, entities, periods, **kwargs)
+
+    def _add_metric(self, name: str, values: np.ndarray):
+        self.cube = np.concatenate([self.cube, values[np.newaxis]], axis=0)
+        self.metrics.append(name)
+        self._index.setdefault(name, len(self.metrics) - 1)
+        self._index.setdefault(normalize_name(name), len(self.metrics) - 1)
+
+    # -- expressions ---------------------------------------------------------
+
+    def define(self, name: str, expr: str) -> "MetricEngine":
+        """Name a derived metric so other expressions can refer to it."""
+        self._defined[normalize_name(name)] = self._parse(expr)
+        self._memo.clear()
+        return self
+
+    def has(self, name: str) -> bool:
+        return name in self._index or normalize_name(name) in self._index or normalize_name(name) in self._defined
+
+    def evaluate(self, expr: str) -> np.ndarray:
+        """Evaluate an expression to an (entity x period) array. Memoized; do not mutate the result."""
+        return self._eval(self._parse(expr))
+
+    def values(self, expr: str, entity=None) -> list:
+        """Period-aligned list for one entity, None where missing."""
+        row = self.evaluate(expr)[self._entity_index(entity)]
+        return [None if math.isnan(v) else float(v) for v in row]
+
+    def series(self, expr: str, entity=None) -> dict:
+        """{period: value} for one entity, missing periods omitted."""
+        row = self.evaluate(expr)[self._entity_index(entity)]
+        return {p: float(v) for p, v in zip(self.periods, row) if not math.isnan(v)}
+
+    def trailing_mean(self, expr: str, n: int = 4, entity=None) -> float | None:
+        """Mean of the last n non-missing values for one entity, None if there are none."""
+        arr = self.evaluate(expr)
+        valid = ~np.isnan(arr)
+        # rank valid cells from the right: 1 = most recent
+        rank = np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+        take = valid & (rank <= n)
+        counts = take.sum(axis=1)
+        with np.errstate(invalid="ignore"):
+            means = np.where(take, arr, 0.0).sum(axis=1) / counts
+        e = self._entity_index(entity)
+        return None if counts[e] == 0 else float(means[e])
+
+    def _entity_index(self, entity) -> int:
+        if entity is None:
+            return 0
+        try:
+            return self.entities.index(entity)
+        except ValueError:
+            raise KeyError(f"Unknown entity: {entity!r}") from None
+
+    def _parse(self, expr: str) -> ast.AST:
+        try:
+            return ast.parse(expr.strip(), mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"Invalid metric expression {expr!r}: {e.msg}") from None
+
+    def _eval(self, node: ast.AST) -> np.ndarray:
+        key = ast.dump(node)
+        cached = self._memo.get(key)
+        if cached is None:
+            cached = self._memo[key] = self._compute(node)
+        return cached
+
+    def _compute(self, node: ast.AST):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, str):
+                return self._lookup(node.value, exact=True)
+            if isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+                return np.full((len(self.entities), len(self.periods)), float(node.value))
+        elif isinstance(node, ast.Name):
+            return self._lookup(node.id)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+            left, right = self._eval(node.left), self._eval(node.right)
+            if isinstance(node.op, ast.Div):
+                return _div(left, right)
+            with np.errstate(invalid="ignore", over="ignore"):
+                return _BINOPS[type(node.op)](left, right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self._eval(node.operand)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            return self._call(node.func.id, node.args)
+        raise ValueError(f"Unsupported expression: {ast.unparse(node)!r}")
+
+    def _lookup(self, name: str, exact: bool = False) -> np.ndarray:
+        if name in self._index:
+            return self.cube[self._index[name]]
+        key = normalize_name(name)
+        if not exact and key in self._index:
+            return self.cube[self._index[key]]
+        if key in self._defined:
+            return self._eval(self._defined[key])
+        raise KeyError(f"Unknown metric: {name!r}")
+
+    def _call(self, fn: str, args: list[ast.AST]) -> np.ndarray:
+        def int_arg(i, default):
+            if len(args) <= i:
+                return default
+            node = args[i]
+            if isinstance(node, ast.Constant) and isinstance(node.value, int) and node.value > 0:
+                return node.value
+            raise ValueError(f"{fn}() expects a positive integer, got {ast.unparse(node)!r}")
+
+        if fn not in _FUNCTIONS:
+            raise ValueError(f"Unknown function: {fn}()")
+        if not args:
+            raise ValueError(f"{fn}() needs an argument")
+        x = self._eval(args[0])
+        ppy = self.periods_per_year
+        if fn == "lag":
+            return self._shift(x, int_arg(1, 1))
+        if fn == "diff":
+            return x - self._shift(x, int_arg(1, 1))
+        if fn in ("yoy", "qoq"):
+            prior = self._shift(x, ppy if fn == "yoy" else 1)
+            return _div(x - prior, np.abs(prior))
+        if fn == "ttm":
+            return self._rolling_sum(x, ppy)
+        if fn == "avg":
+            n = int_arg(1, ppy)
+            return self._rolling_sum(x, n) / n
+        return np.abs(x)
+
+    def _shift(self, x: np.ndarray, n: int) -> np.ndarray:
+        """Value n periods earlier, NaN where that period is not in the cube."""
+        column = {o: t for t, o in enumerate(self.ordinals)}
+        source = np.array([column.get(o - n, -1) for o in self.ordinals], dtype=int)
+        present = source >= 0
+        out = np.full_like(x, np.nan)
+        out[:, present] = x[:, source[present]]
+        return out
+
+    def _rolling_sum(self, x: np.ndarray, n: int) -> np.ndarray:
+        """Sum over the n periods ending at each period (NaN if any is missing)."""
+        out = x.copy()
+        for k in range(1, n):
+            out = out + self._shift(x, k)
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate derived-metric expressions over a context JSON.")
+    parser.add_argument("--context", required=True, help="Model or comp context JSON")
+    parser.add_argument("expressions", nargs="+", help='e.g. "gross_profit / revenue" or "yoy(revenue)"')
+    args = parser.parse_args()
+
+    with open(args.context) as f:
+        ctx = json.load(f)
+    if ctx.get("companies"):
+        engine = MetricEngine.from_companies(ctx["companies"])
+    else:
+        sections = [ctx.get(k, {}) for k in ("income_statement", "cash_flow", "balance_sheet")]
+        engine = MetricEngine.from_sections(sections, ctx.get("periods", []))
+
+    try:
+        if engine.entities == [None]:
+            out = {expr: engine.series(expr) for expr in args.expressions}
+        else:
+            out = {expr: {e: engine.series(expr, e) for e in engine.entities} for expr in args.expressions}
+    except (KeyError, ValueError) as e:
+        print(json.dumps({"error": str(e).strip("'\"")}), file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ import statistics
 import sys
 from datetime import date
 
+from metric_engine import MetricEngine
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -109,11 +111,8 @@ def qoq_growth_rates(series):
 
 def yoy_growth_rates(series):
     """Compute list of year-over-year growth rates (i vs i-4), skipping None."""
-    rates = []
-    for i in range(4, len(series)):
-        if series[i] is not None and series[i - 4] is not None and series[i - 4] != 0:
-            rates.append(series[i] / series[i - 4] - 1.0)
-    return rates
+    growth = MetricEngine.from_series({"x": series}).values("x / lag(x, 4) - 1")
+    return [g for g in growth if g is not None]
 
 
 # ---------------------------------------------------------------------------
@@ -202,12 +201,9 @@ def project_gross_margin(historical, guidance, n_quarters):
         return None, "insufficient data"
 
     # Compute historical gross margins
-    margins = []
-    for r, c in zip(revenue, cost_of_revenue):
-        if r is not None and c is not None and r != 0:
-            margins.append(1 - c / r)
-        else:
-            margins.append(None)
+    n = min(len(revenue), len(cost_of_revenue))
+    engine = MetricEngine.from_series({"revenue": revenue[:n], "cost_of_revenue": cost_of_revenue[:n]})
+    margins = engine.values("1 - cost_of_revenue / revenue")
 
     valid_margins = [m for m in margins if m is not None]
     if len(valid_margins) < 2:
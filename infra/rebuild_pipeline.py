@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Debounced rebuild pipeline for tickers with new data.
+
+The poller (recipes/poll_for_updates.py --rebuild) queues a rebuild in the
+local store whenever it pulls new or revised datapoints for a company. A
+company has at most one pending rebuild: further updates fold into it, and it
+runs once no update has arrived for DEBOUNCE seconds (or MAX_DELAY after the
+first one, so a steady trickle cannot postpone it forever). Settled rebuilds
+run on a bounded worker pool, one at a time per company.
+
+A rebuild refreshes, in order:
+    context      model context JSON (infra/context_assembler.py), mostly served
+                 from the store the poller has just updated
+    projections  forward quarters (infra/projection_engine.py), merged into the context
+    model        the Excel model (infra/excel_builder.py) -> reports/<TICKER>_model.xlsx
+    charts       revenue and margin charts (infra/chart_generator.py) -> reports/.charts/
+    notes        what changed since the last rebuild (infra/report_differ.py)
+                 -> reports/<TICKER>_update_notes.json
+
+Status, total time and per-step timings are recorded in the store's rebuilds
+table. The builder CLIs run as subprocesses, so rebuilds use several cores.
+
+Usage:
+    python infra/rebuild_pipeline.py run [--workers 4]     # process the queue continuously
+    python infra/rebuild_pipeline.py enqueue AAPL MSFT     # queue rebuilds by hand
+    python infra/rebuild_pipeline.py status [--limit 20]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "recipes"))
+
+from daloopa_client import resolve_company  # noqa: E402
+from fundamentals_store import get_store  # noqa: E402
+
+from context_assembler import (  # noqa: E402
+    DEFAULT_QUARTERS,
+    OUTPUT_DIR,
+    fetch_company,
+    fetch_market_data,
+    model_context,
+)
+
+REPORTS_DIR = ROOT / "reports"
+CHARTS_DIR = REPORTS_DIR / ".charts"
+DEBOUNCE = 120  # seconds without a new update before a rebuild starts
+MAX_DELAY = 600  # seconds after the first update by which a rebuild starts regardless
+DEFAULT_WORKERS = 4
+POLL_SECONDS = 5
+STEP_TIMEOUT = 600
+
+# projection_engine historical input -> (context section, metric)
+PROJECTION_INPUTS = {
+    "revenue": ("income_statement", "Revenue"),
+    "cost_of_revenue": ("income_statement", "Cost of Sales"),
+    "net_income": ("income_statement", "Net Income"),
+    "shares_outstanding": ("income_statement", "Diluted Shares"),
+    "depreciation": ("cash_flow", "D&A"),
+    "capex": ("cash_flow", "Capital Expenditures"),
+    "pp_and_e": ("balance_sheet", "PP&E (net)"),
+}
+
+# projection_engine output -> context metric shown in the model
+PROJECTION_OUTPUTS = {
+    "revenue": "Revenue",
+    "gross_profit": "Gross Profit",
+    "operating_income": "Operating Income",
+    "net_income": "Net Income",
+    "eps": "EPS",
+    "shares_outstanding": "Diluted Shares",
+    "depreciation": "D&A",
+    "capex": "Capital Expenditures",
+    "fcf": "Free Cash Flow",
+}
+
+
+def _timestamp(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _run(script: str, *args: str):
+    """Run an infra CLI; raise with the tail of its stderr if it fails."""
+    result = subprocess.run([sys.executable, str(ROOT / "infra" / script), *args],
+                            capture_output=True, text=True, timeout=STEP_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"{script}: {(result.stderr or result.stdout).strip()[-500:]}")
+
+
+def projection_input(ctx: dict) -> dict | None:
+    """projection_engine context from a model context, or None without enough revenue history."""
+    periods = ctx["periods"]
+    historical: dict = {"periods": periods}
+    for key, (section, metric) in PROJECTION_INPUTS.items():
+        values = ctx.get(section, {}).get(metric, {})
+        if all(values.get(p) is not None for p in periods):
+            historical[key] = [abs(values[p]) if key == "capex" else values[p] for p in periods]
+    income = ctx.get("income_statement", {})
+    gross, operating = income.get("Gross Profit", {}), income.get("Operating Income", {})
+    if all(gross.get(p) is not None and operating.get(p) is not None for p in periods):
+        historical["operating_expenses"] = [gross[p] - operating[p] for p in periods]
+    if len(historical.get("revenue", [])) < 4:
+        return None
+    return {"ticker": ctx["company"].get("ticker"), "historical": historical}
+
+
+def merge_projections(ctx: dict, output: dict):
+    """Add projection_engine output to a model context as projected_periods / projections."""
+    projections = output.get("projections", {})
+    periods = projections.get("periods", [])
+    ctx["projected_periods"] = periods
+    ctx["projections"] = {}
+    for key, metric in PROJECTION_OUTPUTS.items():
+        values = projections.get(key)
+        if values:
+            sign = -1 if key == "capex" else 1  # reported as an outflow in the cash flow statement
+            ctx["projections"][metric] = {p: (None if v is None else sign * v) for p, v in zip(periods, values)}
+
+
+def chart_data(ctx: dict) -> dict[str, dict]:
+    """chart_generator time-series inputs keyed by chart name."""
+    periods = ctx["periods"]
+    income = ctx.get("income_statement", {})
+    ticker = ctx["company"].get("ticker")
+    charts = {}
+    revenue = income.get("Revenue", {})
+    if revenue:
+        charts["revenue"] = {"periods": periods, "values": [revenue.get(p) for p in periods],
+                             "label": "Revenue", "title": f"{ticker} Revenue"}
+    margins = {}
+    for metric in ("Gross Profit", "Operating Income", "Net Income"):
+        values = income.get(metric, {})
+        if values and revenue:
+            margins[metric.replace("Profit", "Margin").replace("Income", "Margin")] = [
+                round(100 * values[p] / revenue[p], 1) if values.get(p) is not None and revenue.get(p) else None
+                for p in periods
+            ]
+    if margins:
+        charts["margins"] = {"periods": periods, "series": margins, "label": "%", "title": f"{ticker} Margins"}
+    return charts
+
+
+@contextmanager
+def _step(timings: dict, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+
+
+def rebuild(ticker: str, quarters: int = DEFAULT_QUARTERS, timings: dict | None = None) -> dict[str, float]:
+    """Rebuild one ticker's context, projections, model, charts and update notes. Returns step timings."""
+    timings = {} if timings is None else timings
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    CHARTS_DIR.mkdir(parents=True, exist_ok=True)
+    ctx_path = OUTPUT_DIR / f"{ticker}_context.json"
+    prev_path = OUTPUT_DIR / f"{ticker}_context.prev.json"
+
+    with _step(timings, "context"):
+        ctx = model_context(fetch_company(ticker, quarters), fetch_market_data(ticker))
+
+    with _step(timings, "projections"):
+        proj_input = projection_input(ctx)
+        if proj_input:
+            input_path = OUTPUT_DIR / f"{ticker}_projection_input.json"
+            output_path = OUTPUT_DIR / f"{ticker}_projections.json"
+            input_path.write_text(json.dumps(proj_input))
+            _run("projection_engine.py", "--context", str(input_path), "--output", str(output_path))
+            merge_projections(ctx, json.loads(output_path.read_text()))
+        if ctx_path.exists():
+            ctx_path.replace(prev_path)
+        ctx_path.write_text(json.dumps(ctx, indent=2, default=str))
+
+    with _step(timings, "model"):
+        _run("excel_builder.py", "--context", str(ctx_path), "--output", str(REPORTS_DIR / f"{ticker}_model.xlsx"))
+
+    with _step(timings, "charts"):
+        for name, data in chart_data(ctx).items():
+            data_path = OUTPUT_DIR / f"{ticker}_{name}_chart.json"
+            data_path.write_text(json.dumps(data))
+            _run("chart_generator.py", "time-series", "--data-file", str(data_path),
+                 "--output", str(CHARTS_DIR / f"{ticker}_{name}.png"))
+
+    with _step(timings, "notes"):
+        if prev_path.exists():
+            _run("report_differ.py", "--old", str(prev_path), "--new", str(ctx_path),
+                 "--output", str(REPORTS_DIR / f"{ticker}_update_notes.json"))
+    return timings
+
+
+class RebuildPipeline:
+    """Claims settled rebuilds from the store and runs them on a bounded worker pool."""
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, quarters: int = DEFAULT_QUARTERS):
+        self.store = get_store()
+        self.workers = workers
+        self.quarters = quarters
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rebuild")
+        self.slots = threading.Semaphore(workers)
+
+    def _run_one(self, job: dict):
+        ticker = job["ticker"] or (self.store.company(job["company_id"]) or {}).get("ticker")
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+        error = None
+        try:
+            if not ticker:
+                raise LookupError(f"no ticker known for company {job['company_id']}")
+            rebuild(ticker, self.quarters, timings)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            elapsed = time.perf_counter() - start
+            self.store.finish_rebuild(job["id"], round(elapsed, 3), timings, error)
+            self.slots.release()
+        steps = ", ".join(f"{k} {v:.1f}s" for k, v in timings.items())
+        status = f"failed: {error}" if error else "done"
+        print(f"  {ticker}: {status} in {elapsed:.1f}s ({steps}; {job['requests']} update(s) collapsed)")
+
+    def dispatch(self) -> int:
+        """Start as many settled rebuilds as there are free workers. Returns the number started."""
+        free = 0
+        while self.slots.acquire(blocking=False):
+            free += 1
+        now = datetime.now(timezone.utc)
+        jobs = self.store.claim_rebuilds(_timestamp(now - timedelta(seconds=DEBOUNCE)),
+                                         _timestamp(now - timedelta(seconds=MAX_DELAY)), free) if free else []
+        for _ in range(free - len(jobs)):
+            self.slots.release()
+        for job in jobs:
+            self.pool.submit(self._run_one, job)
+        return len(jobs)
+
+    def run(self):
+        requeued = self.store.requeue_rebuilds()
+        if requeued:
+            print(f"  Requeued {requeued} rebuild(s) interrupted by a previous run")
+        print(f"Rebuilding on {self.workers} workers (debounce {DEBOUNCE}s, max delay {MAX_DELAY}s; Ctrl+C to stop)")
+        while True:
+            self.dispatch()
+            time.sleep(POLL_SECONDS)
+
+
+def cmd_run(args):
+    try:
+        RebuildPipeline(args.workers, args.quarters).run()
+    except KeyboardInterrupt:
+        print("\nStopped; running rebuilds are requeued on the next start.")
+
+
+def cmd_enqueue(args):
+    store = get_store()
+    for t in args.tickers:
+        company = store.find_company(t.upper()) or resolve_company(t.upper())
+        if not company:
+            print(f"  Warning: '{t}' not found, skipping.", file=sys.stderr)
+            continue
+        store.request_rebuild(company["id"], company.get("ticker") or t.upper())
+        print(f"  Queued rebuild for {company.get('ticker') or t.upper()}")
+
+
+def cmd_status(args):
+    rows = get_store().rebuilds(limit=args.limit)
+    if not rows:
+        print("No rebuilds recorded.")
+        return
+    print(f"{'Ticker':<8} {'Status':<8} {'Updates':>7} {'Requested':<20} {'Seconds':>8}  Steps")
+    print("-" * 100)
+    for r in rows:
+        seconds = f"{r['seconds']:.1f}" if r["seconds"] is not None else "—"
+        steps = " ".join(f"{k}={v:.1f}" for k, v in r["steps"].items())
+        print(f"{(r['ticker'] or r['company_id']):<8} {r['status']:<8} {r['requests']:>7} "
+              f"{r['first_requested_at'][:19]:<20} {seconds:>8}  {steps}")
+        if r["error"]:
+            print(f"{'':<8} {r['error'][:90]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild projections, models, charts and notes for tickers with new data.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python infra/rebuild_pipeline.py run --workers 8
+  python infra/rebuild_pipeline.py enqueue AAPL MSFT
+  python infra/rebuild_pipeline.py status
+        """,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Process the rebuild queue continuously")
+    run_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                            help=f"Concurrent rebuilds (default: {DEFAULT_WORKERS})")
+    run_parser.add_argument("--quarters", type=int, default=DEFAULT_QUARTERS,
+                            help=f"Quarters of history (default: {DEFAULT_QUARTERS})")
+    run_parser.set_defaults(func=cmd_run)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Queue rebuilds for tickers")
+    enqueue_parser.add_argument("tickers", nargs="+")
+    enqueue_parser.set_defaults(func=cmd_enqueue)
+
+    status_parser = subparsers.add_parser("status", help="Recent rebuilds with timings")
+    status_parser.add_argument("--limit", type=int, default=20)
+    status_parser.set_defaults(func=cmd_status)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
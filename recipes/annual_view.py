@@ -0,0 +1,106 @@
+"""
+Recipe 13: Annual and LTM Views from the Local Store
+======================================================
+Print fiscal-year totals and the latest trailing-twelve-month (LTM) value for a
+company's key series straight from the store's materialized rollups: no
+quarters are re-summed and no API calls are made. Balance-sheet series show
+the fiscal year-end / latest balance instead of a sum.
+
+Run recipes/warm_cache.py (or load an export) first so the company is in the
+store.
+
+Usage:
+    python recipes/annual_view.py AAPL
+    python recipes/annual_view.py AAPL --years 2022 2023 2024 --keywords revenue "net income" eps
+
+    # LTM P/E for EPS series at a given share price
+    python recipes/annual_view.py AAPL --price 227.50
+"""
+
+import sys
+
+from fundamentals_store import get_store
+
+DEFAULT_KEYWORDS = ["revenue", "gross profit", "operating income", "net income", "eps", "cash and"]
+DEFAULT_YEARS = 4
+
+
+def find_series(company_id: int, keywords: list[str]) -> list[dict]:
+    """Stored series whose name contains any of the keywords (case-insensitive)."""
+    wanted = [k.lower() for k in keywords]
+    return [s for s in get_store().series(company_id)
+            if any(k in (s["full_series_name"] or "").lower() for k in wanted)]
+
+
+def annual_view(company_id: int, series_ids: list[int], years: list[int] | None = None) -> dict:
+    """{series_id: {"fy": {fiscal_year: value}, "ltm": rollup row}} from the materialized rollups."""
+    store = get_store()
+    view = {sid: {"fy": {}, "ltm": None} for sid in series_ids}
+    for r in store.rollups(company_id, "fy", series_ids=series_ids, fiscal_years=years):
+        view.setdefault(r["series_id"], {"fy": {}, "ltm": None})["fy"][r["fiscal_year"]] = r["value"]
+    for sid, r in store.latest_ttm(company_id, series_ids).items():
+        view.setdefault(sid, {"fy": {}, "ltm": None})["ltm"] = r
+    return view
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0].startswith("--"):
+        print("Usage: python recipes/annual_view.py TICKER [--years Y1 Y2 ...] [--keywords K1 K2 ...] [--price P]")
+        sys.exit(1)
+    ticker, years, keywords, price = args[0], [], [], None
+    i = 1
+    while i < len(args):
+        if args[i] == "--price":
+            price = float(args[i + 1])
+            i += 2
+        elif args[i] in ("--years", "--keywords"):
+            target = years if args[i] == "--years" else keywords
+            i += 1
+            while i < len(args) and not args[i].startswith("--"):
+                target.append(int(args[i]) if target is years else args[i])
+                i += 1
+        else:
+            print(f"Unknown option: {args[i]}")
+            sys.exit(1)
+
+    store = get_store()
+    company = store.find_company(ticker)
+    if not company:
+        print(f"'{ticker}' is not in the local store. Run recipes/warm_cache.py {ticker} first.")
+        sys.exit(1)
+    series = find_series(company["id"], keywords or DEFAULT_KEYWORDS)
+    if not series:
+        print("No matching series in the store.")
+        sys.exit(1)
+
+    view = annual_view(company["id"], [s["id"] for s in series], years or None)
+    if not years:
+        all_years = sorted({y for v in view.values() for y in v["fy"]})
+        years = all_years[-DEFAULT_YEARS:]
+
+    print(f"\n{company.get('name') or ticker} ({ticker}) — fiscal years and LTM\n")
+    header = f"{'Series':<48}" + "".join(f"{'FY' + str(y):>14}" for y in years) + f"{'LTM':>14}  {'(through)':<10}"
+    print(header)
+    print("-" * len(header))
+    for s in series:
+        v = view.get(s["id"])
+        if not v or not (v["fy"] or v["ltm"]):
+            continue
+        name = (s["full_series_name"] or str(s["id"]))[-47:]
+        cells = "".join(f"{v['fy'][y]:>14,.2f}" if v["fy"].get(y) is not None else f"{'—':>14}" for y in years)
+        ltm = v["ltm"]
+        ltm_cell = f"{ltm['value']:>14,.2f}  {ltm['period']:<10}" if ltm else f"{'—':>14}"
+        print(f"{name:<48}{cells}{ltm_cell}")
+
+    if price is not None:
+        print()
+        for s in series:
+            ltm = view.get(s["id"], {}).get("ltm")
+            if "eps" in (s["full_series_name"] or "").lower() and ltm and ltm["value"]:
+                print(f"LTM P/E ({s['full_series_name']}): {price / ltm['value']:.1f}x "
+                      f"on LTM EPS {ltm['value']:.2f} through {ltm['period']}")
+
+
+if __name__ == "__main__":
+    main()
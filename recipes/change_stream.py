@@ -0,0 +1,309 @@
+"""
+Change-event stream for downstream consumers.
+
+Incremental pulls (recipes/poll_for_updates.py, recipes/webhook_receiver.py)
+journal every new or revised datapoint to the store's change_events table in
+the same transaction as the data itself; the journal id is the event's offset.
+ChangeStream tails that journal and
+
+  * appends each event as one JSON line to reports/.events/changes-<offset>.jsonl,
+    starting a new file every ROTATE_BYTES and keeping the newest ROTATE_KEEP;
+  * fans it out to subscribers connected to a local Unix socket.
+
+A subscriber connects and sends one JSON line: {"offset": N} to receive every
+event after N (replayed from the journal) followed by live events, or {} for
+live events only. Each subscriber has a bounded queue; one that falls more than
+QUEUE_SIZE events behind stops being fed live and catches up from the journal
+at its own pace, so a slow consumer never holds up detection or the other
+subscribers. The files can be read from an offset in the same way.
+
+Event fields: offset, detected_at, company_id, ticker, series_id, series_name,
+period, change ("new" | "revised"), old_value, new_value, restated, document_id.
+
+Usage:
+    python recipes/change_stream.py serve                     # next to a poller or webhook receiver
+    python recipes/poll_for_updates.py --poll --stream AAPL   # or inside the poller
+    python recipes/change_stream.py subscribe --offset 1200
+    python recipes/change_stream.py read --offset 1200        # from the JSONL files
+
+    from change_stream import subscribe
+    for event in subscribe(offset=1200):
+        ...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator
+
+from fundamentals_store import get_store
+
+EVENTS_DIR = Path(os.environ.get(
+    "DALOOPA_EVENTS_DIR",
+    Path(__file__).resolve().parent.parent / "reports" / ".events",
+))
+SOCKET_PATH = Path(os.environ.get("DALOOPA_EVENTS_SOCKET", EVENTS_DIR / "changes.sock"))
+
+ROTATE_BYTES = 64 * 2 ** 20
+ROTATE_KEEP = 10
+QUEUE_SIZE = 10_000  # events buffered per subscriber before it is switched to catch-up
+PAGE = 1000  # journal rows read at a time
+TAIL_INTERVAL = 1.0  # seconds between journal reads when not notified
+RETENTION = timedelta(days=7)  # journal rows kept in the store for replay
+PRUNE_INTERVAL = 3600
+
+
+def to_event(row: dict) -> dict:
+    """A change_events row as a stream event."""
+    return {
+        "offset": row["id"],
+        "detected_at": row["detected_at"],
+        "company_id": row["company_id"],
+        "ticker": row["ticker"],
+        "series_id": row["series_id"],
+        "series_name": row["full_series_name"],
+        "period": row["period"],
+        "change": row["change"],
+        "old_value": row["old_value"],
+        "new_value": row["new_value"],
+        "restated": None if row["restated"] is None else bool(row["restated"]),
+        "document_id": row["document_id"],
+    }
+
+
+class EventLog:
+    """Rotating JSONL files of change events, each named by the first offset it holds."""
+
+    def __init__(self, directory: str | Path = EVENTS_DIR):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.files = sorted(self.dir.glob("changes-*.jsonl"))
+        self.fh = None
+        self.last_offset = self._recover()
+
+    def _recover(self) -> int:
+        """Offset of the last complete line on disk, dropping a line torn by a crash."""
+        for path in reversed(self.files):
+            with path.open("rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - 2 ** 20))
+                tail = f.read()
+                end = tail.rfind(b"\n") + 1
+                if end < len(tail):
+                    f.truncate(size - len(tail) + end)
+                lines = tail[:end].splitlines()
+            if lines:
+                return json.loads(lines[-1])["offset"]
+        return 0
+
+    def append(self, events: list[dict]):
+        if not events:
+            return
+        if self.fh is None or self.fh.tell() >= ROTATE_BYTES:
+            self._rotate(events[0]["offset"])
+        self.fh.write("".join(json.dumps(e) + "\n" for e in events))
+        self.fh.flush()
+        self.last_offset = events[-1]["offset"]
+
+    def _rotate(self, first_offset: int):
+        if self.fh is not None:
+            self.fh.close()
+        if self.files and self.files[-1].stat().st_size < ROTATE_BYTES:
+            path = self.files[-1]  # resume the newest file after a restart
+        else:
+            path = self.dir / f"changes-{first_offset:012d}.jsonl"
+            self.files.append(path)
+            for old in self.files[:-ROTATE_KEEP]:
+                old.unlink(missing_ok=True)
+            self.files = self.files[-ROTATE_KEEP:]
+        self.fh = path.open("a", encoding="utf-8")
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+
+
+def read_log(offset: int = 0, directory: str | Path = EVENTS_DIR) -> Iterator[dict]:
+    """Events after `offset` from the JSONL files, oldest first."""
+    files = sorted(Path(directory).glob("changes-*.jsonl"))
+    starts = [int(f.stem.split("-")[1]) for f in files]
+    first = max([i for i, s in enumerate(starts) if s <= offset + 1], default=0)
+    for path in files[first:]:
+        with path.open(encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    return  # being written
+                event = json.loads(line)
+                if event["offset"] > offset:
+                    yield event
+
+
+class _Subscriber:
+    def __init__(self, offset: int, behind: bool):
+        self.offset = offset  # last offset sent
+        self.behind = behind
+        self.queue: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+
+    def offer(self, events: list[dict]):
+        if self.behind:
+            return
+        for e in events:
+            try:
+                self.queue.put_nowait(e)
+            except asyncio.QueueFull:
+                self.behind = True
+                return
+
+
+class ChangeStream:
+    """Tails the store's change journal into the JSONL log and the Unix-socket subscribers."""
+
+    def __init__(self, socket_path: str | Path = SOCKET_PATH, directory: str | Path = EVENTS_DIR):
+        self.store = get_store()
+        self.log = EventLog(directory)
+        self.socket_path = Path(socket_path)
+        self.offset = self.log.last_offset
+        self.subscribers: set[_Subscriber] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    def notify(self):
+        """Wake the tailer now (callable from any thread) instead of at the next TAIL_INTERVAL."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def tail(self):
+        pruned = 0.0
+        while True:
+            rows = await asyncio.to_thread(self.store.change_events, self.offset, PAGE)
+            if rows:
+                events = [to_event(r) for r in rows]
+                await asyncio.to_thread(self.log.append, events)
+                self.offset = events[-1]["offset"]
+                for sub in list(self.subscribers):
+                    sub.offer(events)
+                if len(rows) == PAGE:
+                    continue
+            if self._loop.time() - pruned > PRUNE_INTERVAL:
+                cutoff = (datetime.now(timezone.utc) - RETENTION).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                await asyncio.to_thread(self.store.prune_change_events, cutoff)
+                pruned = self._loop.time()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), TAIL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), 10) or b"{}")
+        except (asyncio.TimeoutError, ValueError):
+            hello = {}
+        offset = hello.get("offset") if isinstance(hello, dict) else None
+        sub = _Subscriber(self.offset, False) if offset is None else _Subscriber(int(offset), True)
+        self.subscribers.add(sub)
+        try:
+            while True:
+                if sub.behind:
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()  # superseded by the journal read
+                    rows = await asyncio.to_thread(self.store.change_events, sub.offset, PAGE)
+                    events = [to_event(r) for r in rows]
+                    if len(rows) < PAGE and max([sub.offset] + [e["offset"] for e in events]) >= self.offset:
+                        sub.behind = False  # caught up; the tailer feeds it from here
+                else:
+                    events = [await sub.queue.get()]
+                    while not sub.queue.empty():
+                        events.append(sub.queue.get_nowait())
+                events = [e for e in events if e["offset"] > sub.offset]
+                if events:
+                    writer.write("".join(json.dumps(e) + "\n" for e in events).encode())
+                    await writer.drain()
+                    sub.offset = events[-1]["offset"]
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.discard(sub)
+            writer.close()
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_path.unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(self.handle, path=str(self.socket_path))
+        print(f"Streaming change events from offset {self.offset} to {self.log.dir} and {self.socket_path}")
+        tail = asyncio.create_task(self.tail())
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                tail.cancel()
+                self.log.close()
+                self.socket_path.unlink(missing_ok=True)
+
+    def start(self) -> threading.Thread:
+        """Serve in a background daemon thread (e.g. inside the poller)."""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="change-stream", daemon=True)
+        thread.start()
+        return thread
+
+
+def subscribe(offset: int | None = None, socket_path: str | Path = SOCKET_PATH) -> Iterator[dict]:
+    """Events from a running stream: those after `offset`, then live ones (live only if None)."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(str(socket_path))
+    sock.sendall((json.dumps({} if offset is None else {"offset": offset}) + "\n").encode())
+    with sock, sock.makefile("r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _print(event: dict):
+    old = f"{event['old_value']:,.2f}" if event["old_value"] is not None else "—"
+    new = f"{event['new_value']:,.2f}" if event["new_value"] is not None else "—"
+    print(f"  [{event['offset']}] {event['ticker'] or event['company_id']} "
+          f"{event['series_name'] or event['series_id']} {event['period']}: {old} -> {new}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream datapoint change events to files and subscribers.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("serve", help="Tail the change journal into the JSONL log and the Unix socket")
+    sub_p = sub.add_parser("subscribe", help="Print events from a running stream")
+    sub_p.add_argument("--offset", type=int, help="Replay events after this offset first (default: live only)")
+    sub_p.add_argument("--json", action="store_true", help="Print raw JSON lines")
+    read_p = sub.add_parser("read", help="Print events from the JSONL files")
+    read_p.add_argument("--offset", type=int, default=0)
+    read_p.add_argument("--json", action="store_true", help="Print raw JSON lines")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(ChangeStream().serve())
+        except KeyboardInterrupt:
+            print("\nStopped.")
+        return
+    events = read_log(args.offset) if args.command == "read" else subscribe(args.offset)
+    try:
+        for event in events:
+            if args.json:
+                print(json.dumps(event), flush=True)
+            else:
+                _print(event)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No change stream is listening on {SOCKET_PATH}; run: python recipes/change_stream.py serve",
+              file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
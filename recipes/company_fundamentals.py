@@ -10,7 +10,9 @@ Usage:
 
 import sys
 
+import daloopa_client
 from daloopa_client import get
+from datapoint import Datapoint
 
 
 def search_company(keyword: str) -> list[dict]:
@@ -31,15 +33,9 @@ def discover_series(company_id: int, keywords: list[str]) -> list[dict]:
     return resp
 
 
-def get_fundamentals(company_id: int, periods: list[str], series_ids: list[int]) -> list[dict]:
+def get_fundamentals(company_id: int, periods: list[str], series_ids: list[int]) -> list[Datapoint]:
     """Fetch fundamental data for specific series and periods."""
-    param_tuples = [("company_id", company_id)]
-    for p in periods:
-        param_tuples.append(("periods", p))
-    for sid in series_ids:
-        param_tuples.append(("series_ids", sid))
-    data = get("/companies/fundamentals", params=param_tuples)
-    return data.get("results", []) if isinstance(data, dict) else data
+    return daloopa_client.get_fundamentals(company_id, periods, series_ids)
 
 
 def main():
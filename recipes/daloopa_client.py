@@ -9,15 +9,50 @@ Or create a .env file in the project root with those values.
 """
 
 import base64
+import hashlib
 import os
+import struct
+import threading
 import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from urllib.parse import urlencode
 
 import requests
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from datapoint import Datapoint
+from datapoint_meter import current_meter
+from fundamentals_store import get_store
+from shared_cache import get_cache
+
 BASE_URL = "https://app.daloopa.com/api/v2"
-RATE_LIMIT = 120  # requests per minute
+RATE_LIMIT = int(os.environ.get("DALOOPA_RATE_LIMIT", 120))  # requests per minute
+# share RATE_LIMIT across every process on the host (per account) instead of per process
+SHARED_RATE_LIMIT = os.environ.get("DALOOPA_SHARED_RATE_LIMIT", "1") != "0" and fcntl is not None
+# alongside the poll shard leases, outside reports/.cache where cache_manager evicts files
+RATE_LIMIT_DIR = Path(__file__).resolve().parent.parent / "reports" / ".poll"
+MAX_RETRIES = 3  # retries on HTTP 429 before giving up
+CONTINUATION_TTL = timedelta(days=1)  # how long a company's continuation graph is trusted
+# how long stored datapoints are served instead of refetched (never past the company's model update)
+STORE_MAX_AGE = timedelta(hours=float(os.environ.get("DALOOPA_STORE_MAX_AGE_HOURS", 24)))
+
+# GET endpoints served from the host-level shared cache, with their TTLs in seconds
+CACHE_TTLS = {
+    "/companies": 3600,
+    "/companies/series": 86400,
+    "/companies/fundamentals": 900,
+    "/series-continuation": 86400,
+    "/taxonomy/metrics": 86400,
+    "/taxonomy/sub-industries": 86400,
+}
+
+# GET endpoints that consume datapoints from the account's allocation
+METERED_PATHS = {"/companies/fundamentals", "/companies/fundamental-updates"}
 
 
 def _load_dotenv():
@@ -47,39 +82,141 @@ def get_headers() -> dict:
     return {"Authorization": f"Basic {credentials}"}
 
 
-def get(path: str, params: dict | None = None) -> dict | list:
-    """GET request with auth. Returns parsed JSON."""
+class RateLimiter:
+    """Spaces requests evenly so all threads together stay within per_minute."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter whose schedule is kept in a file, so all processes on the host share per_minute.
+
+    The next free request slot (wall-clock seconds) is read and advanced under
+    an exclusive flock; callers then sleep until their slot outside the lock.
+    """
+
+    MAX_BACKLOG = 3600.0  # a slot further ahead than this means the clock jumped; start over
+
+    def __init__(self, per_minute: int, path: str | Path):
+        super().__init__(per_minute)
+        self.path = Path(path)
+        self._fd = None
+        self._pid = None
+
+    def _open(self):
+        if self._fd is None or self._pid != os.getpid():  # reopen after fork
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+
+    def wait(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                raw = os.pread(self._fd, 8, 0)
+                scheduled = struct.unpack("<d", raw)[0] if len(raw) == 8 else 0.0
+                now = time.time()
+                if scheduled - now > self.MAX_BACKLOG:
+                    scheduled = now
+                slot = max(now, scheduled)
+                os.pwrite(self._fd, struct.pack("<d", slot + self.interval), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _make_limiter() -> RateLimiter:
+    if not SHARED_RATE_LIMIT:
+        return RateLimiter(RATE_LIMIT)
+    account = hashlib.blake2b(os.environ.get("DALOOPA_EMAIL", "").encode(), digest_size=6).hexdigest()
+    return SharedRateLimiter(RATE_LIMIT, RATE_LIMIT_DIR / f"rate-limit-{account}.bin")
+
+
+limiter = _make_limiter()
+
+
+def _request(method: str, path: str, **kwargs) -> requests.Response:
+    """Rate-limited authenticated request, retrying on HTTP 429."""
     url = f"{BASE_URL}{path}"
-    resp = requests.get(url, headers=get_headers(), params=params, timeout=30)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.wait()
+        resp = requests.request(method, url, headers=get_headers(), **kwargs)
+        if resp.status_code != 429 or attempt == MAX_RETRIES:
+            break
+        retry_after = resp.headers.get("Retry-After", "")
+        time.sleep(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
     resp.raise_for_status()
-    return resp.json()
+    return resp
+
+
+def get(path: str, params: dict | list | None = None, fresh: bool = False) -> dict | list:
+    """GET request with auth. Returns parsed JSON.
+
+    Responses from CACHE_TTLS endpoints are shared with every other process on
+    the host through the shared cache. fresh=True skips the cached copy; the
+    new response still replaces it for everyone else.
+
+    Datapoints returned by METERED_PATHS are charged to the current job's
+    meter (or credited to it when served from the shared cache); a job already
+    over its quota fails here before the request is sent.
+    """
+    metered = path in METERED_PATHS
+    ttl = CACHE_TTLS.get(path)
+    cache = get_cache() if ttl else None
+    key = f"{os.environ.get('DALOOPA_EMAIL', '')}|{path}?{urlencode(params or {}, doseq=True)}"
+    if cache is not None and not fresh:
+        cached = cache.get(key)
+        if cached is not None:
+            if metered:
+                current_meter().credit(_count_results(cached), "cache")
+            return cached
+    if metered:
+        current_meter().check()
+    data = _request("GET", path, params=params, timeout=30).json()
+    if metered:
+        current_meter().charge(_count_results(data))
+    if cache is not None:
+        cache.put(key, data, ttl)
+    return data
+
+
+def _count_results(data: dict | list) -> int:
+    return len(data.get("results", [])) if isinstance(data, dict) else len(data)
 
 
 def post(path: str, json_body: dict | None = None) -> dict | list:
     """POST request with auth. Returns parsed JSON."""
-    url = f"{BASE_URL}{path}"
-    resp = requests.post(url, headers=get_headers(), json=json_body, timeout=30)
-    resp.raise_for_status()
-    return resp.json()
+    return _request("POST", path, json=json_body, timeout=30).json()
 
 
 def download(path: str, dest: str, params: dict | None = None) -> str:
     """Download a file (CSV, Excel) to dest path. Returns the path written."""
-    url = f"{BASE_URL}{path}"
-    resp = requests.get(url, headers=get_headers(), params=params, timeout=60, stream=True)
-    resp.raise_for_status()
+    resp = _request("GET", path, params=params, timeout=60, stream=True)
     with open(dest, "wb") as f:
         for chunk in resp.iter_content(chunk_size=8192):
             f.write(chunk)
     return dest
 
 
-def paginate(path: str, params: dict | None = None) -> list:
+def paginate(path: str, params: dict | None = None, fresh: bool = False) -> list:
     """Auto-paginate a list endpoint that returns {count, next, results}."""
     params = dict(params or {})
     all_results = []
     while True:
-        data = get(path, params)
+        data = get(path, params, fresh=fresh)
         if isinstance(data, list):
             return data
         all_results.extend(data.get("results", []))
@@ -87,3 +224,109 @@ def paginate(path: str, params: dict | None = None) -> list:
             break
         params["offset"] = params.get("offset", 0) + len(data.get("results", []))
     return all_results
+
+
+def resolve_company(ticker: str) -> dict | None:
+    """Resolve a ticker to a company record, checking the local store before the API."""
+    ticker = ticker.upper()
+    store = get_store()
+    cached = store.find_company(ticker)
+    if cached:
+        return cached
+    results = get("/companies", params={"keyword": ticker})
+    match = next((c for c in results if (c.get("ticker") or "").upper() == ticker), None)
+    if match:
+        store.upsert_company(match)
+    return match
+
+
+def refresh_continuations(company_id: int, force: bool = False) -> dict[int, list[int]]:
+    """Sync a company's series-continuation graph into the local store.
+
+    Skips the API call when the graph was synced within CONTINUATION_TTL unless
+    force is set. Returns the resolved old -> live series mapping.
+    """
+    store = get_store()
+    synced_at = store.continuations_synced_at(company_id)
+    if force or not synced_at or _parse_ts(synced_at) < datetime.now(timezone.utc) - CONTINUATION_TTL:
+        if store.company(company_id) is None:
+            store.upsert_company({"id": company_id})
+        store.save_continuations(company_id, get("/series-continuation", params={"company_id": company_id},
+                                                 fresh=force))
+    return store.redirects(company_id)
+
+
+def get_fundamentals(company_id: int, periods: list[str], series_ids: list[int],
+                     fresh: bool = False) -> list[Datapoint]:
+    """Fetch fundamentals, rewriting deprecated series IDs to their live replacements.
+
+    Datapoints the store already holds from a fetch within STORE_MAX_AGE (and
+    after the company's model was last updated) are served from the store and
+    not charged against the datapoint allocation again: series are requested
+    only for the periods they are missing, one request per distinct set of
+    missing periods. fresh=True requests everything. With no periods (or no
+    series) the store cannot tell what is missing, so one request goes out
+    with whichever filter was given, returning all periods (or series).
+    Results are returned as compact Datapoint records and written through to
+    the local store.
+    """
+    refresh_continuations(company_id)
+    store = get_store()
+    live = store.resolve_series(series_ids)
+    if not periods or not live:
+        current_meter().check()
+        return _fetch_fundamentals(company_id, periods, live, fresh)
+    held = [] if fresh else store.datapoints(company_id, live, periods, fetched_since=_store_cutoff(company_id))
+    have = {(dp.series_id, dp.calendar_period) for dp in held}
+    groups: dict[tuple, list[int]] = {}  # missing periods -> series missing exactly those
+    for sid in live:
+        missing = tuple(p for p in periods if (sid, p) not in have)
+        if missing:
+            groups.setdefault(missing, []).append(sid)
+    meter = current_meter()
+    meter.credit(len(held), "store")
+    meter.check(sum(len(ps) * len(sids) for ps, sids in groups.items()))
+
+    results = list(held)
+    for missing, sids in groups.items():
+        results.extend(_fetch_fundamentals(company_id, missing, sids, fresh))
+    return results
+
+
+def _fetch_fundamentals(company_id: int, periods, series_ids, fresh: bool) -> list[Datapoint]:
+    """One /companies/fundamentals request (empty filters are left out), written through to the store."""
+    param_tuples = [("company_id", company_id)]
+    for p in periods:
+        param_tuples.append(("periods", p))
+    for sid in series_ids:
+        param_tuples.append(("series_ids", sid))
+    data = get("/companies/fundamentals", params=param_tuples, fresh=fresh)
+    fetched = Datapoint.from_api_list(data.get("results", []) if isinstance(data, dict) else data)
+    get_store().upsert_datapoints(company_id, fetched)
+    return fetched
+
+
+def get_fundamental_updates(company_id: int, since: str) -> list[Datapoint]:
+    """Datapoints of a company created or changed since an ISO-8601 timestamp.
+
+    Only the changed datapoints are transferred (and metered). The caller is
+    responsible for storing them and advancing its high-water mark, see
+    FundamentalsStore.upsert_updates.
+    """
+    refresh_continuations(company_id)
+    rows = paginate("/companies/fundamental-updates", params={"company_id": company_id, "since": since}, fresh=True)
+    return Datapoint.from_api_list(rows)
+
+
+def _store_cutoff(company_id: int) -> str:
+    """Oldest fetch time at which a stored datapoint is still served instead of refetched."""
+    cutoff = datetime.now(timezone.utc) - STORE_MAX_AGE
+    company = get_store().company(company_id)
+    if company and company.get("model_updated_at"):
+        cutoff = max(cutoff, _parse_ts(company["model_updated_at"]))
+    return cutoff.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _parse_ts(ts: str) -> datetime:
+    """Parse an API ISO-8601 timestamp (trailing Z) into an aware datetime."""
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
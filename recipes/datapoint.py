@@ -0,0 +1,84 @@
+"""
+Compact datapoint record used in place of per-row API dicts.
+
+A /companies/fundamentals result is a ~20-key dict; holding hundreds of
+thousands of them costs well over 1 KB each. `Datapoint` stores the same fields
+in __slots__ and interns the low-cardinality strings (periods, units, labels,
+dates), which shrinks a large pull several-fold and speeds up attribute access.
+
+Records also answer dict-style reads (`dp["value_raw"]`, `dp.get("unit")`) so
+code written against the raw API dicts keeps working unchanged.
+
+Usage:
+    from datapoint import Datapoint
+
+    records = Datapoint.from_api_list(results)
+    total = sum(dp.value_raw for dp in records if dp.value_raw is not None)
+    as_json = [dp.to_dict() for dp in records]
+"""
+
+import sys
+
+FIELDS = (
+    "id", "series_id", "calendar_period", "fiscal_period", "value_raw", "value_normalized",
+    "unit", "label", "category", "title", "span", "fiscal_date", "filing_type",
+    "document_id", "filing_date", "document_released_at", "restated", "created_at", "updated_at",
+)
+_FIELD_SET = frozenset(FIELDS)
+
+# String fields with few distinct values across a pull; interned so records share them
+_INTERNED = frozenset(("calendar_period", "fiscal_period", "unit", "label", "category", "title", "span",
+                       "fiscal_date", "filing_type", "filing_date", "document_released_at"))
+
+
+class Datapoint:
+    """One fundamental datapoint with the API's field names as attributes."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for f in FIELDS:
+            setattr(self, f, fields.get(f))
+
+    @classmethod
+    def from_api(cls, d: dict) -> "Datapoint":
+        """Build a record from an API result dict (unknown keys are dropped)."""
+        dp = cls.__new__(cls)
+        intern = sys.intern
+        for f in FIELDS:
+            v = d.get(f)
+            if f in _INTERNED and isinstance(v, str):
+                v = intern(v)
+            setattr(dp, f, v)
+        return dp
+
+    @classmethod
+    def from_api_list(cls, rows: list[dict]) -> list["Datapoint"]:
+        return [cls.from_api(r) for r in rows]
+
+    def to_dict(self) -> dict:
+        """Back to the API dict shape (for JSON output or older helpers)."""
+        return {f: getattr(self, f) for f in FIELDS}
+
+    # dict-style access for code written against raw API results; only the API fields are keys
+    def __getitem__(self, key: str):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in _FIELD_SET else default
+
+    def __eq__(self, other):
+        if not isinstance(other, Datapoint):
+            return NotImplemented
+        return all(getattr(self, f) == getattr(other, f) for f in FIELDS)
+
+    # Compared by value like the dicts they replace, so unhashable like them too: records are
+    # mutable, and a value hash would change under a set or dict key. Key by (series_id,
+    # calendar_period) or use id() for identity.
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"Datapoint(series_id={self.series_id}, period={self.calendar_period!r}, "
+                f"value_raw={self.value_raw!r}, unit={self.unit!r})")
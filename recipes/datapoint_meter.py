@@ -0,0 +1,161 @@
+"""
+Local metering of datapoint consumption.
+
+Daloopa meters every datapoint the fundamentals endpoints return against the
+account's allocation. The client charges each job's meter with the datapoints
+it actually pulls from the API, and credits the ones it served instead from
+the shared response cache or the local store, so a job can report what it
+cost and what caching saved. A job may also set a quota: requests that would
+take it past the quota raise QuotaExceeded before they are sent, so a runaway
+job stops at once instead of silently burning the allocation.
+
+Finished jobs are logged to the store's datapoint_usage table.
+
+Usage:
+    from datapoint_meter import metered_job
+
+    with metered_job("nightly-comps", quota=50_000) as meter:
+        ...  # daloopa_client calls are charged to this job
+    print(meter.report())
+
+    python recipes/datapoint_meter.py [--days 7]     # usage log summary
+
+Without an explicit job, calls are charged to a process-wide "default" meter
+whose quota comes from DALOOPA_DATAPOINT_QUOTA (unset = unlimited).
+"""
+
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from fundamentals_store import get_store, utcnow
+
+DEFAULT_QUOTA = int(os.environ["DALOOPA_DATAPOINT_QUOTA"]) if os.environ.get("DALOOPA_DATAPOINT_QUOTA") else None
+
+
+class QuotaExceeded(RuntimeError):
+    """A job's datapoint quota would be exceeded by the next request."""
+
+
+class DatapointMeter:
+    """Datapoints one job pulled from the API, and those served locally instead."""
+
+    def __init__(self, job: str, quota: int | None = None):
+        self.job = job
+        self.quota = quota
+        self.started_at = utcnow()
+        self.requests = 0
+        self.fetched = 0
+        self.from_cache = 0
+        self.from_store = 0
+        self._lock = threading.Lock()
+
+    def check(self, estimate: int = 0):
+        """Raise QuotaExceeded if pulling up to `estimate` more datapoints could exceed the quota."""
+        if self.quota is None:
+            return
+        with self._lock:
+            if self.fetched + estimate > self.quota:
+                raise QuotaExceeded(
+                    f"job '{self.job}' has used {self.fetched:,} of its {self.quota:,} datapoint quota; "
+                    f"refusing a request for up to {estimate:,} more"
+                )
+
+    def charge(self, n: int):
+        """Record n datapoints returned by one API request."""
+        with self._lock:
+            self.requests += 1
+            self.fetched += n
+
+    def credit(self, n: int, source: str):
+        """Record n datapoints served from 'cache' or 'store' instead of the API."""
+        with self._lock:
+            if source == "cache":
+                self.from_cache += n
+            else:
+                self.from_store += n
+
+    @property
+    def saved(self) -> int:
+        return self.from_cache + self.from_store
+
+    def summary(self) -> dict:
+        return {
+            "job": self.job,
+            "started_at": self.started_at,
+            "requests": self.requests,
+            "fetched": self.fetched,
+            "from_cache": self.from_cache,
+            "from_store": self.from_store,
+            "quota": self.quota,
+        }
+
+    def report(self) -> str:
+        total = self.fetched + self.saved
+        pct = 100 * self.saved / total if total else 0.0
+        quota = f" of {self.quota:,} quota" if self.quota is not None else ""
+        return (f"Datapoints for '{self.job}': {self.fetched:,} pulled{quota} in {self.requests:,} requests; "
+                f"{self.saved:,} served locally ({self.from_cache:,} shared cache, {self.from_store:,} store), "
+                f"{pct:.0f}% saved")
+
+
+_default_meter = DatapointMeter("default", DEFAULT_QUOTA)
+_current = _default_meter
+_current_lock = threading.Lock()
+
+
+def current_meter() -> DatapointMeter:
+    """The meter API calls are charged to: the active job's, or the process default."""
+    return _current
+
+
+@contextmanager
+def metered_job(job: str, quota: int | None = DEFAULT_QUOTA):
+    """Charge client calls made inside the block (from any thread) to a new job meter.
+
+    The job's totals are written to the store's usage log when the block exits,
+    with status 'ok', 'quota_exceeded' or 'failed'.
+    """
+    global _current
+    meter = DatapointMeter(job, quota)
+    with _current_lock:
+        previous, _current = _current, meter
+    status = "ok"
+    try:
+        yield meter
+    except QuotaExceeded:
+        status = "quota_exceeded"
+        raise
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        with _current_lock:
+            _current = previous
+        get_store().record_usage(meter.summary(), status)
+
+
+def main():
+    days = 7
+    if "--days" in sys.argv:
+        days = int(sys.argv[sys.argv.index("--days") + 1])
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    rows = get_store().usage(since)
+    if not rows:
+        print(f"No metered jobs in the last {days} days.")
+        return
+    print(f"{'Job':<28} {'Started':<20} {'Status':<15} {'Pulled':>12} {'Served locally':>15} {'Quota':>12}")
+    print("-" * 107)
+    for r in rows:
+        quota = f"{r['quota']:,}" if r["quota"] is not None else "—"
+        print(f"{r['job'][:27]:<28} {r['started_at'][:19]:<20} {r['status']:<15} {r['fetched']:>12,} "
+              f"{r['from_cache'] + r['from_store']:>15,} {quota:>12}")
+    pulled = sum(r["fetched"] for r in rows)
+    saved = sum(r["from_cache"] + r["from_store"] for r in rows)
+    print(f"\n{len(rows)} jobs: {pulled:,} datapoints pulled, {saved:,} served locally.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Detection-latency instrumentation for the poller and webhook receiver.
+
+Every incremental pull records, per document it brought in, how long the
+update took to reach us:
+
+    release_to_detect    document_released_at -> detected by our pull
+    created_to_detect    first datapoint created/updated in Daloopa -> detected
+    release_to_complete  document_released_at -> downstream rebuild finished
+    created_to_complete  first datapoint created/updated -> rebuild finished
+
+Completion is filled in by infra/rebuild_pipeline.py when the rebuild that
+covered a detection succeeds, so it is only recorded for pulls that queue
+rebuilds (poll_for_updates.py / webhook_receiver.py serve with --rebuild). Revisions to documents released before the
+previous pull have no release latency (it would measure the revision, not the
+release). The first pull for a company only seeds its high-water mark and is
+not recorded.
+
+The summary reports p50/p90/p99 per stage and per company, plus cumulative
+histograms over LATENCY_BUCKETS, which can also be exported in the Prometheus
+text format for a node_exporter textfile collector or similar.
+
+Usage:
+    python recipes/detection_latency.py                        # last 7 days, all companies
+    python recipes/detection_latency.py --days 30 AAPL MSFT
+    python recipes/detection_latency.py --histogram
+    python recipes/detection_latency.py --export reports/.metrics/detection_latency.prom
+"""
+
+import math
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from datapoint import Datapoint
+from fundamentals_store import get_store, utcnow
+
+STAGES = ["release_to_detect", "created_to_detect", "release_to_complete", "created_to_complete"]
+LATENCY_BUCKETS = [30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 43200, 86400, math.inf]  # seconds
+DEFAULT_DAYS = 7
+
+
+def _parse(ts: str) -> datetime:
+    """API timestamp (trailing Z, offset or bare date) as an aware datetime; naive ones are UTC."""
+    parsed = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _released_since(released_at: str | None, since: datetime) -> bool:
+    try:
+        return bool(released_at) and _parse(released_at) >= since
+    except ValueError:
+        return False
+
+
+def detection_rows(company_id: int, results: list[Datapoint], since: str) -> list[tuple]:
+    """One detection row per document in an incremental pull made from high-water mark `since`.
+
+    The poller hands these to FundamentalsStore.upsert_updates, which writes
+    them with the pulled rows.
+    """
+    detected_at = utcnow()
+    documents: dict[int, dict] = {}
+    for r in results:
+        if r.document_id is None:
+            continue
+        doc = documents.setdefault(r.document_id, {"released_at": r.document_released_at, "changed": [], "n": 0})
+        doc["changed"].append(r.updated_at or r.created_at)
+        doc["n"] += 1
+    since_at = _parse(since)
+    rows = []
+    for document_id, doc in documents.items():
+        released_at = doc["released_at"] if _released_since(doc["released_at"], since_at) else None
+        changed = [c for c in doc["changed"] if c]
+        rows.append((company_id, document_id, detected_at, released_at, min(changed) if changed else None, doc["n"]))
+    return rows
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile of unsorted values (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def histogram(values: list[float], buckets: list[float] = LATENCY_BUCKETS) -> list[tuple[float, int]]:
+    """Cumulative (upper bound, count) pairs, Prometheus-style."""
+    return [(le, sum(1 for v in values if v <= le)) for le in buckets]
+
+
+def latencies(rows: list[dict], stage: str) -> list[float]:
+    return [r[stage] for r in rows if r[stage] is not None and r[stage] >= 0]
+
+
+def prometheus(rows: list[dict]) -> str:
+    """Histograms of every stage in the Prometheus text exposition format."""
+    name = "daloopa_detection_latency_seconds"
+    lines = [f"# HELP {name} Time from document release / datapoint creation to detection and rebuild.",
+             f"# TYPE {name} histogram"]
+    for stage in STAGES:
+        values = latencies(rows, stage)
+        for le, count in histogram(values):
+            bound = "+Inf" if math.isinf(le) else f"{le:g}"
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {sum(values):.3f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {len(values)}')
+    return "\n".join(lines) + "\n"
+
+
+def _fmt(seconds: float | None) -> str:
+    if seconds is None:
+        return "—"
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds / 3600:.1f}h"
+
+
+def _bound(le: float) -> str:
+    return "+inf" if math.isinf(le) else _fmt(le)
+
+
+def main():
+    args = sys.argv[1:]
+    days = DEFAULT_DAYS
+    export = None
+    show_histogram = "--histogram" in args
+    if show_histogram:
+        args.remove("--histogram")
+    if "--days" in args:
+        i = args.index("--days")
+        days = int(args[i + 1])
+        del args[i:i + 2]
+    if "--export" in args:
+        i = args.index("--export")
+        export = Path(args[i + 1])
+        del args[i:i + 2]
+    if any(a.startswith("--") for a in args):
+        print("Usage: python recipes/detection_latency.py [--days N] [--histogram] [--export PATH] [TICKER ...]")
+        sys.exit(1)
+
+    store = get_store()
+    company_ids = None
+    if args:
+        company_ids = [c["id"] for c in map(store.find_company, args) if c]
+        if not company_ids:
+            print("None of those tickers are in the local store.")
+            sys.exit(1)
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    rows = store.detections(since, company_ids)
+
+    if export:
+        export.parent.mkdir(parents=True, exist_ok=True)
+        tmp = export.with_name(export.name + ".tmp")
+        tmp.write_text(prometheus(rows))
+        tmp.replace(export)  # atomic for scrapers
+        print(f"Wrote {len(rows)} detections as histograms to {export}")
+        return
+    if not rows:
+        print(f"No detections recorded in the last {days} days.")
+        return
+
+    print(f"\n{len(rows)} documents detected in the last {days} days\n")
+    print(f"{'Stage':<22} {'n':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    print("-" * 64)
+    for stage in STAGES:
+        values = latencies(rows, stage)
+        print(f"{stage:<22} {len(values):>6} {_fmt(percentile(values, 50)):>8} {_fmt(percentile(values, 90)):>8} "
+              f"{_fmt(percentile(values, 99)):>8} {_fmt(max(values, default=None)):>8}")
+
+    if show_histogram:
+        for stage in STAGES:
+            values = latencies(rows, stage)
+            if not values:
+                continue
+            print(f"\n{stage}")
+            previous = 0
+            for le, count in histogram(values):
+                bar = "#" * round(40 * (count - previous) / len(values))
+                print(f"  <= {_bound(le):>6} {count - previous:>6}  {bar}")
+                previous = count
+
+    by_company: dict[int, list[dict]] = {}
+    for r in rows:
+        by_company.setdefault(r["company_id"], []).append(r)
+    print(f"\n{'Ticker':<8} {'Docs':>5} {'Release->detect p50':>20} {'p90':>8} {'Created->detect p50':>20} {'p90':>8} "
+          f"{'Release->done p50':>18}")
+    print("-" * 94)
+    ranked = sorted(by_company.items(),
+                    key=lambda kv: -(percentile(latencies(kv[1], "release_to_detect"), 90) or 0))
+    for cid, company_rows in ranked:
+        release = latencies(company_rows, "release_to_detect")
+        created = latencies(company_rows, "created_to_detect")
+        complete = latencies(company_rows, "release_to_complete")
+        ticker = company_rows[0]["ticker"] or cid
+        print(f"{ticker:<8} {len(company_rows):>5} "
+              f"{_fmt(percentile(release, 50)):>20} {_fmt(percentile(release, 90)):>8} "
+              f"{_fmt(percentile(created, 50)):>20} {_fmt(percentile(created, 90)):>8} "
+              f"{_fmt(percentile(complete, 50)):>18}")
+
+
+if __name__ == "__main__":
+    main()
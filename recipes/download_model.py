@@ -7,6 +7,9 @@ Models include historical data, KPIs, guidance, and pre-built charts.
 Usage:
     python recipes/05_download_model.py AAPL
     python recipes/05_download_model.py --by-id 2
+
+    # Also ingest the model into the local fundamentals store
+    python recipes/05_download_model.py AAPL --ingest
 """
 
 import sys
@@ -15,6 +18,7 @@ from pathlib import Path
 import requests
 
 from daloopa_client import get
+from ingest_models import ingest_models
 
 OUTPUT_DIR = Path(__file__).resolve().parent.parent / "reports"
 
@@ -45,9 +49,11 @@ def download_file(url: str, dest: str) -> str:
 
 
 def main():
+    ingest = "--ingest" in sys.argv
+    sys.argv = [a for a in sys.argv if a != "--ingest"]
     if len(sys.argv) < 2:
-        print("Usage: python recipes/05_download_model.py TICKER")
-        print("       python recipes/05_download_model.py --by-id COMPANY_ID")
+        print("Usage: python recipes/05_download_model.py TICKER [--ingest]")
+        print("       python recipes/05_download_model.py --by-id COMPANY_ID [--ingest]")
         sys.exit(1)
 
     if sys.argv[1] == "--by-id":
@@ -77,6 +83,10 @@ def main():
     size_mb = Path(dest).stat().st_size / (1024 * 1024)
     print(f"  Done! ({size_mb:.1f} MB)")
 
+    if ingest:
+        print()
+        ingest_models([dest], workers=1)
+
 
 if __name__ == "__main__":
     main()
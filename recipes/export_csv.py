@@ -13,40 +13,222 @@ Usage:
 
     # Both historical + real-time
     python recipes/04_export_csv.py AAPL --real-time --include-historical
+
+    # Also load the export into the local fundamentals store
+    python recipes/04_export_csv.py AAPL --load
+
+    # Bulk: several tickers, a file of tickers (one per line) or a sub-industry
+    python recipes/04_export_csv.py AAPL MSFT GOOG --workers 8
+    python recipes/04_export_csv.py --tickers-file nightly.txt --load
+    python recipes/04_export_csv.py --sub-industry 281
+
+Bulk exports download concurrently through the client's rate limiter and keep
+reports/exports_manifest.json up to date with each file's size, row count,
+SHA-256 and the company's latest_datapoint_created_at at export time. Each file
+is written to a .part file and renamed when complete, and the manifest is
+rewritten after every ticker, so an interrupted run can simply be restarted:
+tickers whose file is intact and whose data has not changed since are skipped
+(--force downloads them anyway).
 """
 
+import asyncio
+import csv
+import hashlib
+import json
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from daloopa_client import download
+from daloopa_client import download, resolve_company
+from fundamentals_store import utcnow
+from industry_analysis import list_sub_industries
+from load_exports import load_exports
+from poll_for_updates import check_statuses
 
 OUTPUT_DIR = Path(__file__).resolve().parent.parent / "reports"
+MANIFEST_FILE = OUTPUT_DIR / "exports_manifest.json"
+WORKERS = 8  # downloads in flight at once (the rate limiter still applies)
 
 
-def export_csv(ticker: str, real_time: bool = False, include_historical: bool = False) -> str:
-    """Export company fundamentals to CSV."""
+def export_params(real_time: bool = False, include_historical: bool = False) -> dict:
     params = {}
     if real_time:
         params["real_time"] = "true"
         params["show_historical_data"] = "true" if include_historical else "false"
+    return params
 
-    OUTPUT_DIR.mkdir(exist_ok=True)
+
+def export_path(ticker: str, real_time: bool = False, include_historical: bool = False) -> Path:
     suffix = "_realtime" if real_time and not include_historical else "_full" if real_time else ""
-    dest = str(OUTPUT_DIR / f"{ticker.upper()}{suffix}_export.csv")
+    return OUTPUT_DIR / f"{ticker.upper()}{suffix}_export.csv"
+
+
+def export_csv(ticker: str, real_time: bool = False, include_historical: bool = False) -> str:
+    """Export company fundamentals to CSV."""
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    dest = str(export_path(ticker, real_time, include_historical))
 
     print(f"Exporting {ticker.upper()} to {dest}...")
-    download(f"/export/{ticker.upper()}", dest, params=params)
+    download(f"/export/{ticker.upper()}", dest, params=export_params(real_time, include_historical))
     return dest
 
 
-def main():
-    if len(sys.argv) < 2 or sys.argv[1].startswith("--"):
-        print("Usage: python recipes/04_export_csv.py TICKER [--real-time] [--include-historical]")
-        sys.exit(1)
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stats(path: Path) -> dict:
+    """Size, CSV row count (excluding the header) and SHA-256 of an export file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = max(0, sum(1 for _ in csv.reader(f)) - 1)
+    return {"bytes": path.stat().st_size, "rows": rows, "sha256": file_sha256(path)}
+
 
-    ticker = sys.argv[1]
-    real_time = "--real-time" in sys.argv
-    include_historical = "--include-historical" in sys.argv
+def load_manifest() -> dict:
+    try:
+        return json.loads(MANIFEST_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest: dict):
+    tmp = MANIFEST_FILE.with_name(MANIFEST_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    tmp.replace(MANIFEST_FILE)
+
+
+def _is_current(entry: dict | None, path: Path, latest: str | None) -> bool:
+    """Whether the manifest entry describes the file on disk and the company has no newer data."""
+    if not entry or not latest or entry.get("latest_datapoint_created_at") != latest:
+        return False
+    if not path.exists() or path.stat().st_size != entry.get("bytes"):
+        return False  # evicted or replaced since
+    return file_sha256(path) == entry.get("sha256")
+
+
+def sub_industry_tickers(sub_industry_id: int) -> list[str]:
+    """Tickers of every company in a sub-industry."""
+    for s in list_sub_industries():
+        if s.get("sub_industry_id") == sub_industry_id:
+            return [c["ticker"] for c in s.get("companies", []) if c.get("ticker")]
+    return []
+
+
+def export_many(tickers: list[str], real_time: bool = False, include_historical: bool = False,
+                workers: int = WORKERS, force: bool = False) -> dict:
+    """Export many tickers concurrently, resuming from the manifest.
+
+    Returns {file name: manifest entry} for the files downloaded in this run.
+    """
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    params = export_params(real_time, include_historical)
+    companies = {}
+    with ThreadPoolExecutor(workers) as pool:
+        for t, c in zip(tickers, pool.map(resolve_company, tickers)):
+            if c:
+                companies[t.upper()] = c
+            else:
+                print(f"  Warning: '{t}' not found, skipping.")
+    statuses = asyncio.run(check_statuses([c["id"] for c in companies.values()]))
+    latest = {s["company_id"]: s.get("latest_datapoint_created_at") for s in statuses}
+
+    manifest = load_manifest()
+    lock = threading.Lock()
+    todo = []
+    for ticker, c in companies.items():
+        path = export_path(ticker, real_time, include_historical)
+        if force or not _is_current(manifest.get(path.name), path, latest.get(c["id"])):
+            todo.append((ticker, c, path))
+    print(f"Exporting {len(todo)} of {len(companies)} tickers "
+          f"({len(companies) - len(todo)} unchanged since the last export)...")
+
+    def export_one(ticker: str, company: dict, path: Path) -> dict:
+        part = path.with_name(path.name + ".part")
+        start = time.perf_counter()
+        download(f"/export/{ticker}", str(part), params=params)
+        entry = {"ticker": ticker, "company_id": company["id"], "params": params,
+                 "latest_datapoint_created_at": latest.get(company["id"]), "exported_at": utcnow(),
+                 **file_stats(part)}
+        part.replace(path)
+        with lock:
+            manifest[path.name] = entry
+            _save_manifest(manifest)
+        print(f"  {ticker}: {entry['rows']:,} rows, {entry['bytes'] / 2 ** 20:.1f} MB "
+              f"in {time.perf_counter() - start:.1f}s")
+        return entry
+
+    done = {}
+    failed = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(export_one, *job): job for job in todo}
+        for future in as_completed(futures):
+            ticker, _, path = futures[future]
+            try:
+                done[path.name] = future.result()
+            except Exception as e:
+                failed.append(ticker)
+                print(f"  {ticker}: export failed: {e}")
+                path.with_name(path.name + ".part").unlink(missing_ok=True)
+    if failed:
+        print(f"  {len(failed)} exports failed ({', '.join(sorted(failed))}); run again to retry them.")
+    return done
+
+
+def _option(args: list[str], name: str) -> str | None:
+    if name not in args:
+        return None
+    i = args.index(name)
+    if i + 1 >= len(args):
+        _usage()
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+def _usage():
+    print("Usage: python recipes/04_export_csv.py TICKER [--real-time] [--include-historical] [--load]")
+    print("       python recipes/04_export_csv.py (TICKER TICKER ... | --tickers-file PATH | --sub-industry ID)")
+    print("           [--workers N] [--force] [--real-time] [--include-historical] [--load]")
+    sys.exit(1)
+
+
+def main():
+    args = sys.argv[1:]
+    sub_industry = _option(args, "--sub-industry")
+    tickers_file = _option(args, "--tickers-file")
+    workers = _option(args, "--workers")
+    real_time = "--real-time" in args
+    include_historical = "--include-historical" in args
+    tickers = [a for a in args if not a.startswith("--")]
+    if tickers_file:
+        tickers += [line.split("#")[0].strip() for line in Path(tickers_file).read_text().splitlines()]
+        tickers = [t for t in tickers if t]
+    if sub_industry:
+        found = sub_industry_tickers(int(sub_industry))
+        if not found:
+            print(f"No companies found in sub-industry {sub_industry}.")
+            sys.exit(1)
+        tickers += found
+
+    if not tickers:
+        _usage()
+    if len(tickers) > 1 or sub_industry or tickers_file:
+        done = export_many(list(dict.fromkeys(t.upper() for t in tickers)), real_time, include_historical,
+                           workers=int(workers or WORKERS), force="--force" in args)
+        print(f"\nExported {len(done)} files, {sum(e['rows'] for e in done.values()):,} rows; "
+              f"manifest: {MANIFEST_FILE}")
+        if "--load" in args and done:
+            print()
+            load_exports([str(OUTPUT_DIR / name) for name in sorted(done)])
+        return
+
+    ticker = tickers[0]
 
     dest = export_csv(ticker, real_time=real_time, include_historical=include_historical)
 
@@ -57,6 +239,10 @@ def main():
     for line in lines[:6]:
         print(f"  {line[:120]}")
 
+    if "--load" in args:
+        print()
+        load_exports([dest], workers=1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,217 @@
+"""
+Recipe 12: Export the Local Store to Parquet / Arrow
+======================================================
+Write the local fundamentals store as a hive-partitioned Parquet dataset (by
+company or by period) so notebooks can read only the columns and partitions
+they need, or stream it as Arrow IPC for zero-copy handoff to another process.
+Rows are streamed from SQLite in chunks; the store is never loaded whole.
+
+Each partition scheme has its own directory (reports/parquet/company,
+reports/parquet/period). A company partition holds only that company, so
+--tickers rewrites just those partitions. A period partition holds every
+company, so a full export replaces the whole period dataset, and a --tickers
+export by period must go to a directory of its own (--out), which it replaces.
+
+Requires pyarrow (pip install pyarrow).
+
+Usage:
+    # Partitioned Parquet, one directory per company (reports/parquet/company/company_id=2/...)
+    python recipes/export_parquet.py
+
+    # Refresh only some companies' partitions
+    python recipes/export_parquet.py --tickers AAPL MSFT
+
+    # Partition by calendar period (reports/parquet/period/period=2024Q3/...)
+    python recipes/export_parquet.py --partition-by period
+    python recipes/export_parquet.py --partition-by period --tickers AAPL MSFT --out reports/parquet/aapl_msft
+
+    # Arrow IPC stream to a file, or to stdout for a consuming process
+    python recipes/export_parquet.py --ipc reports/fundamentals.arrows
+    python recipes/export_parquet.py --ipc - | python my_consumer.py
+
+Reading it back:
+    import pyarrow.dataset as ds
+    table = ds.dataset("reports/parquet/company", partitioning="hive").to_table(
+        columns=["series_id", "period", "value_raw"], filter=ds.field("company_id") == 2)
+"""
+
+import shutil
+import sys
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+from fundamentals_store import get_store
+
+OUTPUT_DIR = Path(__file__).resolve().parent.parent / "reports" / "parquet"
+PARTITIONS = {"company": "company_id", "period": "period"}
+
+# (column, arrow type factory) in output order
+COLUMNS = [
+    ("company_id", lambda: pa.int64()),
+    ("ticker", lambda: pa.string()),
+    ("series_id", lambda: pa.int64()),
+    ("period", lambda: pa.string()),
+    ("fiscal_period", lambda: pa.string()),
+    ("span", lambda: pa.string()),
+    ("label", lambda: pa.string()),
+    ("category", lambda: pa.string()),
+    ("title", lambda: pa.string()),
+    ("unit", lambda: pa.string()),
+    ("value_raw", lambda: pa.float64()),
+    ("value_normalized", lambda: pa.float64()),
+    ("restated", lambda: pa.bool_()),
+    ("id", lambda: pa.int64()),
+    ("document_id", lambda: pa.int64()),
+    ("filing_type", lambda: pa.string()),
+    ("fiscal_date", lambda: pa.string()),
+    ("filing_date", lambda: pa.string()),
+    ("document_released_at", lambda: pa.string()),
+    ("created_at", lambda: pa.string()),
+    ("updated_at", lambda: pa.string()),
+]
+
+
+def require_pyarrow():
+    if pa is None:
+        print("pyarrow is required for Parquet/Arrow export. Install with: pip install pyarrow",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+def arrow_schema() -> "pa.Schema":
+    return pa.schema([(name, factory()) for name, factory in COLUMNS])
+
+
+def record_batches(company_ids: list[int] | None = None, chunk_size: int = 50_000):
+    """Yield Arrow record batches straight from the store, one chunk at a time."""
+    schema = arrow_schema()
+    names = [name for name, _ in COLUMNS]
+    for chunk in get_store().iter_rows(names, company_ids=company_ids, chunk_size=chunk_size):
+        columns = list(zip(*chunk))
+        arrays = []
+        for (name, _), values, field in zip(COLUMNS, columns, schema):
+            if name == "restated":
+                values = [None if v is None else bool(v) for v in values]
+            arrays.append(pa.array(values, type=field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def batch_reader(company_ids: list[int] | None = None) -> "pa.RecordBatchReader":
+    return pa.RecordBatchReader.from_batches(arrow_schema(), record_batches(company_ids))
+
+
+def export_parquet(output_dir: Path | None = None, partition_by: str = "company",
+                   company_ids: list[int] | None = None) -> Path:
+    """Write a hive-partitioned Parquet dataset (default directory: OUTPUT_DIR / partition_by).
+
+    By company with company_ids, only those companies' partitions are
+    replaced. Otherwise the dataset is written beside the directory and
+    swapped in whole, since a period partition mixes every company. A
+    company subset by period therefore needs its own output_dir.
+    """
+    require_pyarrow()
+    column = PARTITIONS[partition_by]
+    default_dir = OUTPUT_DIR / partition_by
+    output_dir = Path(output_dir or default_dir)
+    if output_dir.resolve() == OUTPUT_DIR.resolve():
+        raise ValueError(f"{OUTPUT_DIR} holds one directory per partition scheme; write into {default_dir}")
+    if partition_by == "period" and company_ids and output_dir.resolve() == default_dir.resolve():
+        raise ValueError(f"period partitions in {default_dir} hold every company; "
+                         "export a subset of companies to a separate directory")
+    if output_dir.is_dir() and any(p.name.split("=")[0] != column for p in output_dir.glob("*=*")):
+        raise ValueError(f"{output_dir} holds a dataset partitioned by something other than {column}")
+
+    replace_all = not (partition_by == "company" and company_ids)
+    target = output_dir.with_name(output_dir.name + ".tmp") if replace_all else output_dir
+    if replace_all:
+        shutil.rmtree(target, ignore_errors=True)
+    ds.write_dataset(
+        batch_reader(company_ids),
+        base_dir=str(target),
+        format="parquet",
+        partitioning=[column],
+        partitioning_flavor="hive",
+        existing_data_behavior="delete_matching",
+        max_partitions=100_000,
+    )
+    if replace_all:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        target.rename(output_dir)
+    return output_dir
+
+
+def export_ipc(dest: str, company_ids: list[int] | None = None) -> int:
+    """Write an Arrow IPC stream to a path (or '-' for stdout). Returns rows written."""
+    require_pyarrow()
+    sink = pa.output_stream(sys.stdout.buffer) if dest == "-" else pa.OSFile(dest, "wb")
+    rows = 0
+    with sink, pa.ipc.new_stream(sink, arrow_schema()) as writer:
+        for batch in record_batches(company_ids):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def main():
+    args = sys.argv[1:]
+    partition_by = "company"
+    ipc_dest = None
+    output_dir = None
+    tickers = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--partition-by":
+            partition_by = args[i + 1]
+            i += 2
+        elif args[i] == "--ipc":
+            ipc_dest = args[i + 1]
+            i += 2
+        elif args[i] == "--out":
+            output_dir = Path(args[i + 1])
+            i += 2
+        elif args[i] == "--tickers":
+            i += 1
+            while i < len(args) and not args[i].startswith("--"):
+                tickers.append(args[i])
+                i += 1
+        else:
+            print("Usage: python recipes/export_parquet.py [--partition-by company|period] "
+                  "[--tickers T1 T2 ...] [--out DIR] [--ipc PATH|-]")
+            sys.exit(1)
+    if partition_by not in PARTITIONS:
+        print(f"--partition-by must be one of: {', '.join(PARTITIONS)}")
+        sys.exit(1)
+
+    company_ids = None
+    if tickers:
+        store = get_store()
+        company_ids = []
+        for t in tickers:
+            c = store.find_company(t)
+            if c:
+                company_ids.append(c["id"])
+            else:
+                print(f"  Warning: '{t}' is not in the local store, skipping.", file=sys.stderr)
+        if not company_ids:
+            sys.exit(1)
+
+    log = sys.stderr if ipc_dest == "-" else sys.stdout
+    if ipc_dest:
+        rows = export_ipc(ipc_dest, company_ids)
+        print(f"Streamed {rows:,} rows as Arrow IPC to {'stdout' if ipc_dest == '-' else ipc_dest}", file=log)
+    else:
+        try:
+            out = export_parquet(output_dir, partition_by, company_ids)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Wrote Parquet dataset partitioned by {PARTITIONS[partition_by]} to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1319 @@
+"""
+Local fundamentals store — a SQLite cache of Daloopa companies, series and
+datapoints shared by all recipes.
+
+Datapoints are keyed by (company_id, series_id, calendar_period), so a refetch
+replaces the current value in place. Every value change is also appended to a
+compact version log (value fields only, one row per change rather than a copy
+per snapshot), which answers point-in-time queries such as "what did we know
+on 2025-02-01?" without refetching. Series continuations are stored as the
+raw old -> new edges returned by `/series-continuation` plus a resolved redirect
+table, so lookups by a deprecated series ID transparently land on the live
+series even across chained restructures (A -> B -> C). Value changes and
+restated-flag flips are additionally indexed by detection time, so "what was
+restated this week" is a range scan.
+
+TTM, fiscal YTD and fiscal-year rollups are materialized per series and kept
+current by upsert_datapoints: only the fiscal years a write touches (and the
+year after, whose TTM windows reach back into it) are recomputed. Flow series
+(income statement, cash flow) are summed over the window; stock series
+(balance sheet, share counts, headcount) take the value at the end of the
+window; percentages and ratios are not rolled up.
+
+Usage:
+    from fundamentals_store import get_store
+
+    store = get_store()
+    store.upsert_datapoints(company_id, results)
+    rows = store.datapoints(company_id, series_ids=[123], periods=["2024Q4"])
+    known = store.as_of(company_id, "2025-02-01", series_ids=[123])
+    ltm = store.rollups(company_id, "ttm", series_ids=[123], periods=["2024Q4"])
+    restated = store.restated_since("2025-02-01")
+
+The database lives at reports/.store/fundamentals.db; set DALOOPA_STORE to
+override the location.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from datapoint import Datapoint
+
+STORE_PATH = Path(os.environ.get(
+    "DALOOPA_STORE",
+    Path(__file__).resolve().parent.parent / "reports" / ".store" / "fundamentals.db",
+))
+
+# Datapoint fields persisted from /companies/fundamentals results (besides the key)
+DATAPOINT_FIELDS = [
+    "id", "label", "category", "title", "value_raw", "value_normalized", "unit",
+    "fiscal_period", "span", "fiscal_date", "filing_type", "document_id",
+    "filing_date", "document_released_at", "restated", "created_at", "updated_at",
+]
+
+# Fields tracked in the version log; a change in any of them starts a new version
+VERSIONED_FIELDS = ["value_raw", "value_normalized", "restated", "document_id", "id"]
+
+# Rollup kinds materialized in the rollups table
+ROLLUP_KINDS = ("ttm", "ytd", "fy")
+
+# Words in a series' category/title that mark it as a point-in-time balance
+STOCK_KEYWORDS = ("balance sheet", "shares outstanding", "headcount", "employees",
+                  "end of period", "ending balance")
+
+# Units, and words in a series' category/title, that mark values as rates rather than
+# amounts ("Percentage", "% of revenue", "Gross margin", "EPS"); these series are not rolled up
+RATIO_UNITS = re.compile(r"percent|%|ratio|\bbps\b|basis point|multiple|^x$|\btimes\b|per share|\bdays\b",
+                         re.IGNORECASE)
+RATIO_KEYWORDS = re.compile(r"\bmargins?\b|\bratios?\b|%|percent|per share|\beps\b|\bgrowth\b|\byields?\b"
+                            r"|\brates?\b|\breturn on\b|\bmultiples?\b|\baverage\b|\bper unit\b|\bdays\b",
+                            re.IGNORECASE)
+
+FISCAL_QUARTER = re.compile(r"^(\d{4})Q([1-4])$")
+FISCAL_YEAR = re.compile(r"^(\d{4})FY$")
+
+SCHEMA_VERSION = 7
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS companies (
+    id INTEGER PRIMARY KEY,
+    ticker TEXT,
+    name TEXT,
+    model_updated_at TEXT,
+    earliest_quarter TEXT,
+    latest_quarter TEXT,
+    continuations_synced_at TEXT,
+    updates_synced_through TEXT  -- high-water mark of /companies/fundamental-updates pulls
+);
+CREATE INDEX IF NOT EXISTS idx_companies_ticker ON companies (ticker);
+
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    company_id INTEGER NOT NULL,
+    full_series_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_series_company ON series (company_id);
+
+CREATE TABLE IF NOT EXISTS datapoints (
+    company_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    id INTEGER,
+    label TEXT,
+    category TEXT,
+    title TEXT,
+    value_raw REAL,
+    value_normalized REAL,
+    unit TEXT,
+    fiscal_period TEXT,
+    span TEXT,
+    fiscal_date TEXT,
+    filing_type TEXT,
+    document_id INTEGER,
+    filing_date TEXT,
+    document_released_at TEXT,
+    restated INTEGER,
+    created_at TEXT,
+    updated_at TEXT,
+    fetched_at TEXT,
+    PRIMARY KEY (company_id, series_id, period)
+);
+
+-- One row per distinct value of a datapoint, effective from valid_from until
+-- the next version. fundamental_id mirrors datapoints.id.
+CREATE TABLE IF NOT EXISTS datapoint_versions (
+    company_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    valid_from TEXT NOT NULL,
+    value_raw REAL,
+    value_normalized REAL,
+    restated INTEGER,
+    document_id INTEGER,
+    fundamental_id INTEGER,
+    PRIMARY KEY (company_id, series_id, period, valid_from)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS series_continuations (
+    company_id INTEGER NOT NULL,
+    old_id INTEGER NOT NULL,
+    new_id INTEGER NOT NULL,
+    type TEXT,
+    created_at TEXT,
+    PRIMARY KEY (old_id, new_id)
+);
+CREATE INDEX IF NOT EXISTS idx_continuations_company ON series_continuations (company_id);
+
+-- Checkpoints of the coverage warm-up job (warm_cache.py)
+CREATE TABLE IF NOT EXISTS warmup_progress (
+    company_id INTEGER PRIMARY KEY,
+    model_updated_at TEXT,
+    status TEXT NOT NULL,
+    datapoints INTEGER,
+    error TEXT,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS series_redirects (
+    old_id INTEGER NOT NULL,
+    live_id INTEGER NOT NULL,
+    company_id INTEGER NOT NULL,
+    PRIMARY KEY (old_id, live_id)
+);
+
+-- Materialized rollups. period is the calendar period of the last quarter in
+-- the window (ttm/ytd) or of the fiscal year's Q4 (fy; the reported annual
+-- period if there are no quarters).
+CREATE TABLE IF NOT EXISTS rollups (
+    company_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    period TEXT NOT NULL,
+    fiscal_year INTEGER NOT NULL,
+    fiscal_quarter INTEGER,
+    value REAL,
+    PRIMARY KEY (company_id, series_id, kind, period)
+) WITHOUT ROWID;
+
+-- Index of datapoints whose value_raw changed or whose restated flag flipped
+-- between fetches. detected_at is the fetch that saw the change, changed_at the
+-- API's updated_at for the new value.
+CREATE TABLE IF NOT EXISTS restatements (
+    company_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    detected_at TEXT NOT NULL,
+    changed_at TEXT,
+    old_value REAL,
+    new_value REAL,
+    old_restated INTEGER,
+    new_restated INTEGER,
+    document_id INTEGER,
+    PRIMARY KEY (company_id, series_id, period, detected_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_restatements_detected ON restatements (detected_at, company_id);
+
+-- Last /companies/status seen and processed per company by the poller
+-- (poll_for_updates.py); committed in the same transaction as the data pulled.
+CREATE TABLE IF NOT EXISTS poll_state (
+    company_id INTEGER PRIMARY KEY,
+    latest_datapoint_created_at TEXT,
+    latest_period TEXT,
+    processed_at TEXT NOT NULL
+);
+
+-- Journal of datapoint changes found by incremental pulls (poller, webhook
+-- receiver); id is the offset change_stream.py subscribers resume from.
+CREATE TABLE IF NOT EXISTS change_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    detected_at TEXT NOT NULL,
+    company_id INTEGER NOT NULL,
+    series_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    change TEXT NOT NULL,
+    old_value REAL,
+    new_value REAL,
+    restated INTEGER,
+    document_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_change_events_detected ON change_events (detected_at);
+
+-- Durable queue of received webhook deliveries (webhook_receiver.py). digest
+-- is a hash of the raw body, used to drop repeated deliveries.
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest TEXT NOT NULL,
+    received_at TEXT NOT NULL,
+    event_type TEXT,
+    company_id INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    processed_at TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_digest ON webhook_events (digest, received_at);
+CREATE INDEX IF NOT EXISTS idx_webhook_status ON webhook_events (status, id);
+
+-- Debounced rebuild queue (infra/rebuild_pipeline.py). A company has at most
+-- one pending rebuild; further update notifications only bump requests and
+-- last_requested_at. steps holds per-step timings as JSON.
+CREATE TABLE IF NOT EXISTS rebuilds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    company_id INTEGER NOT NULL,
+    ticker TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    requests INTEGER NOT NULL DEFAULT 1,
+    first_requested_at TEXT NOT NULL,
+    last_requested_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    seconds REAL,
+    steps TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_rebuilds_status ON rebuilds (status, company_id);
+
+-- One row per document seen in an incremental pull (detection_latency.py):
+-- when it was released, when its first datapoint landed in Daloopa
+-- (changed_at), when the poller or receiver detected it, and when the rebuild
+-- it triggered finished. released_at is NULL for revisions to documents
+-- released before the previous pull.
+CREATE TABLE IF NOT EXISTS detection_latency (
+    company_id INTEGER NOT NULL,
+    document_id INTEGER NOT NULL,
+    detected_at TEXT NOT NULL,
+    released_at TEXT,
+    changed_at TEXT,
+    completed_at TEXT,
+    datapoints INTEGER NOT NULL,
+    PRIMARY KEY (company_id, document_id, detected_at)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_detection_latency_detected ON detection_latency (detected_at);
+
+-- Datapoint consumption per metered job (datapoint_meter.py)
+CREATE TABLE IF NOT EXISTS datapoint_usage (
+    job TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    fetched INTEGER NOT NULL,
+    from_cache INTEGER NOT NULL,
+    from_store INTEGER NOT NULL,
+    quota INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_usage_started ON datapoint_usage (started_at);
+"""
+
+
+def utcnow() -> str:
+    """Current UTC time as an ISO-8601 string (the format the API uses)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def resolve_chains(edges: dict[int, list[int]]) -> dict[int, list[int]]:
+    """Resolve old -> new edges transitively to the live (non-deprecated) series.
+
+    A series that was split maps to several live series; a chain A -> B -> C
+    maps A straight to C. Cycles are broken by ignoring already-visited nodes.
+    """
+    resolved: dict[int, list[int]] = {}
+
+    def walk(node, seen):
+        if node in resolved:
+            return resolved[node]
+        targets = edges.get(node)
+        if not targets:
+            return [node]
+        live = []
+        for t in targets:
+            if t in seen:
+                continue
+            for leaf in walk(t, seen | {t}):
+                if leaf not in live:
+                    live.append(leaf)
+        return live or [node]
+
+    for old in edges:
+        resolved[old] = walk(old, {old})
+    return resolved
+
+
+class FundamentalsStore:
+    """Thread-safe wrapper around the local SQLite fundamentals database."""
+
+    def __init__(self, path: str | Path | None = None):
+        self.path = Path(path or STORE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Bring databases created by older versions up to SCHEMA_VERSION."""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        with self.conn:
+            columns = {r[1] for r in self.conn.execute("PRAGMA table_info(companies)")}
+            if "updates_synced_through" not in columns:
+                self.conn.execute("ALTER TABLE companies ADD COLUMN updates_synced_through TEXT")
+            if version < 2:
+                # Seed the version log with the values already held
+                self.conn.execute(
+                    """INSERT OR IGNORE INTO datapoint_versions
+                       SELECT company_id, series_id, period, COALESCE(created_at, fetched_at),
+                              value_raw, value_normalized, restated, document_id, id
+                       FROM datapoints"""
+                )
+            if version < 6:  # rollups added in 3; ratio classification widened in 6
+                for (company_id,) in self.conn.execute("SELECT DISTINCT company_id FROM datapoints").fetchall():
+                    self._refresh_rollups(company_id)
+            if version < 7:  # version stamps normalized, first sightings moved off created_at
+                self._normalize_valid_from()
+            if version < 4:
+                # Index the restatements already recorded in the version log
+                self.conn.execute(
+                    """INSERT OR IGNORE INTO restatements
+                       SELECT company_id, series_id, period, valid_from, valid_from,
+                              prev_raw, value_raw, prev_restated, restated, document_id
+                       FROM (SELECT *, LAG(value_raw) OVER w AS prev_raw, LAG(restated) OVER w AS prev_restated,
+                                    ROW_NUMBER() OVER w AS n
+                             FROM datapoint_versions
+                             WINDOW w AS (PARTITION BY company_id, series_id, period ORDER BY valid_from))
+                       WHERE n > 1 AND (prev_raw IS NOT value_raw
+                                        OR COALESCE(prev_restated, 0) != COALESCE(restated, 0))"""
+                )
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _normalize_valid_from(self):
+        """Rewrite version stamps in utcnow()'s format, and move single versions off created_at.
+
+        A datapoint with one version whose row was updated after that
+        version's stamp was revised before it was first fetched: its value is
+        only known since updated_at.
+        """
+        rows = self.conn.execute(
+            """SELECT v.company_id, v.series_id, v.period, v.valid_from, d.updated_at,
+                      COUNT(*) OVER (PARTITION BY v.company_id, v.series_id, v.period) AS versions
+               FROM datapoint_versions v LEFT JOIN datapoints d USING (company_id, series_id, period)"""
+        ).fetchall()
+        updates = []
+        for company_id, series_id, period, valid_from, updated_at, versions in rows:
+            stamp = _normalize_timestamp(valid_from) or valid_from
+            updated = _normalize_timestamp(updated_at)
+            if versions == 1 and updated and updated > stamp:
+                stamp = updated
+            if stamp != valid_from:
+                updates.append((stamp, company_id, series_id, period, valid_from))
+        self.conn.executemany(
+            "UPDATE OR REPLACE datapoint_versions SET valid_from = ? "
+            "WHERE company_id = ? AND series_id = ? AND period = ? AND valid_from = ?",
+            updates,
+        )
+        changed = self.conn.execute("SELECT DISTINCT changed_at FROM restatements").fetchall()
+        self.conn.executemany(
+            "UPDATE restatements SET changed_at = ? WHERE changed_at = ?",
+            [(_normalize_timestamp(c), c) for (c,) in changed if c and _normalize_timestamp(c) not in (None, c)],
+        )
+
+    @contextmanager
+    def _write(self):
+        """Write transaction that takes the database write lock up front.
+
+        BEGIN IMMEDIATE makes concurrent writers (other processes loading into
+        the same file) wait on the busy timeout instead of failing mid-upgrade.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- companies / series --------------------------------------------------
+
+    def upsert_company(self, company: dict):
+        """Insert or refresh a company record from a /companies result."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO companies (id, ticker, name, model_updated_at, earliest_quarter, latest_quarter)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET
+                     ticker = COALESCE(excluded.ticker, companies.ticker),
+                     name = COALESCE(excluded.name, companies.name),
+                     model_updated_at = COALESCE(excluded.model_updated_at, companies.model_updated_at),
+                     earliest_quarter = COALESCE(excluded.earliest_quarter, companies.earliest_quarter),
+                     latest_quarter = COALESCE(excluded.latest_quarter, companies.latest_quarter)""",
+                (company["id"], company.get("ticker"), company.get("name"),
+                 company.get("model_updated_at"), company.get("earliest_quarter"),
+                 company.get("latest_quarter")),
+            )
+
+    def company(self, company_id: int) -> dict | None:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM companies WHERE id = ?", (company_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_company(self, ticker: str) -> dict | None:
+        """Look up a cached company by ticker (case-insensitive)."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM companies WHERE upper(ticker) = ?", (ticker.upper(),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def upsert_series(self, company_id: int, series: list[dict]):
+        """Cache a /companies/series result list for a company."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                """INSERT INTO series (id, company_id, full_series_name) VALUES (?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET full_series_name = excluded.full_series_name""",
+                [(s["id"], company_id, s.get("full_series_name")) for s in series],
+            )
+
+    def series(self, company_id: int) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, full_series_name FROM series WHERE company_id = ? ORDER BY id", (company_id,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    # -- datapoints ----------------------------------------------------------
+
+    def upsert_datapoints(self, company_id: int, rows: list[dict] | list[Datapoint]) -> int:
+        """Insert or replace /companies/fundamentals results (dicts or Datapoints). Returns rows written.
+
+        Rows whose versioned fields differ from the stored value (or that are new)
+        are appended to the version log, effective from the datapoint's
+        updated_at (created_at for first sightings), falling back to now.
+        Changes to value_raw or the restated flag are also added to the
+        restatement index. The rollups of changed series are refreshed in the
+        same transaction.
+        """
+        with self._write():
+            return self._upsert_rows(company_id, rows)
+
+    def _upsert_rows(self, company_id: int, rows: list[dict] | list[Datapoint], journal: bool = False) -> int:
+        """upsert_datapoints inside an open write transaction; `journal` also records change_events."""
+        fetched_at = utcnow()
+        cols = ["company_id", "series_id", "period"] + DATAPOINT_FIELDS + ["fetched_at"]
+        params = []
+        versions = []
+        restatements = []
+        events = []
+        touched_years = set()
+        existing = self._current_values(company_id, {r["series_id"] for r in rows})
+        for r in rows:
+            key = (company_id, r["series_id"], r["calendar_period"])
+            params.append(key + tuple(map(r.get, DATAPOINT_FIELDS)) + (fetched_at,))
+            current = existing.get(key[1:])
+            new = _versioned_values(r)
+            if current is None:
+                # a row revised before we first saw it has only been known since updated_at
+                valid_from = _normalize_timestamp(r.get("updated_at") or r.get("created_at")) or fetched_at
+            elif tuple(current) != new:
+                valid_from = _normalize_timestamp(r.get("updated_at")) or fetched_at
+                if current[0] != new[0] or bool(current[2]) != bool(new[2]):
+                    restatements.append(key + (fetched_at, valid_from, current[0], new[0],
+                                               current[2], new[2], new[3]))
+            else:
+                continue
+            versions.append(key + (valid_from,) + new)
+            if journal:
+                events.append((fetched_at,) + key + ("new" if current is None else "revised",
+                                                      None if current is None else current[0],
+                                                      new[0], new[2], new[3]))
+            touched_years.add(_fiscal_year(r.get("fiscal_period")))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO datapoints ({', '.join(cols)}) "
+            f"VALUES ({', '.join('?' * len(cols))})",
+            params,
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO datapoint_versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", versions
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO restatements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", restatements
+        )
+        self.conn.executemany(
+            "INSERT INTO change_events (detected_at, company_id, series_id, period, change, old_value, "
+            "new_value, restated, document_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            events,
+        )
+        if versions:
+            self._refresh_rollups(company_id, {v[1] for v in versions},
+                                  None if None in touched_years else touched_years)
+        return len(params)
+
+    def _current_values(self, company_id: int, series_ids: set[int]) -> dict[tuple, tuple]:
+        """Stored VERSIONED_FIELDS keyed by (series_id, period), fetched in bulk."""
+        current = {}
+        ids = list(series_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            for r in self.conn.execute(
+                f"SELECT series_id, period, {', '.join(VERSIONED_FIELDS)} FROM datapoints "
+                f"WHERE company_id = ? AND series_id IN ({', '.join('?' * len(chunk))})",
+                [company_id] + chunk,
+            ):
+                current[(r[0], r[1])] = tuple(r)[2:]
+        return current
+
+    def datapoints(
+        self,
+        company_id: int,
+        series_ids: list[int] | None = None,
+        periods: list[str] | None = None,
+        fetched_since: str | None = None,
+    ) -> list[Datapoint]:
+        """Return cached datapoints as Datapoint records, remapping deprecated series IDs.
+
+        fetched_since limits the result to rows (re)fetched from the API at or
+        after that ISO-8601 timestamp.
+        """
+        where, args = self._filters(company_id, series_ids, periods)
+        if fetched_since:
+            where += " AND d.fetched_at >= ?"
+            args.append(fetched_since)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM datapoints d WHERE {where} ORDER BY d.series_id, d.period", args
+            ).fetchall()
+        return [_row_to_datapoint(r) for r in rows]
+
+    def iter_rows(self, columns: list[str], company_ids: list[int] | None = None, chunk_size: int = 50_000):
+        """Yield chunks of raw datapoint tuples (plus `ticker`) for bulk exporters.
+
+        Uses its own cursor and never materializes the whole table.
+        """
+        cols = ", ".join("c.ticker" if c == "ticker" else f"d.{c}" for c in columns)
+        sql = f"SELECT {cols} FROM datapoints d LEFT JOIN companies c ON c.id = d.company_id"
+        args: list = []
+        if company_ids:
+            sql += f" WHERE d.company_id IN ({', '.join('?' * len(company_ids))})"
+            args.extend(company_ids)
+        sql += " ORDER BY d.company_id, d.series_id, d.period"
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(sql, args)
+        while True:
+            with self._lock:
+                chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def fiscal_to_calendar(self, company_id: int) -> dict[str, str]:
+        """Fiscal -> calendar period mapping observed in a company's stored datapoints."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT fiscal_period, period FROM datapoints "
+                "WHERE company_id = ? AND fiscal_period IS NOT NULL",
+                (company_id,),
+            ).fetchall()
+        return {r["fiscal_period"]: r["period"] for r in rows}
+
+    def series_units(self, company_id: int) -> dict[int, str]:
+        """{series_id: unit} as reported by the API for a company's stored datapoints."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT series_id, MAX(unit) AS unit FROM datapoints "
+                "WHERE company_id = ? AND unit IS NOT NULL GROUP BY series_id",
+                (company_id,),
+            ).fetchall()
+        return {r["series_id"]: r["unit"] for r in rows}
+
+    def release_history(self, company_ids: list[int] | None = None) -> dict[int, list[tuple[str, str]]]:
+        """{company_id: [(calendar period, first document_released_at or filing_date), ...]}, oldest first."""
+        where = "COALESCE(document_released_at, filing_date) IS NOT NULL"
+        args: list = []
+        if company_ids:
+            where += f" AND company_id IN ({', '.join('?' * len(company_ids))})"
+            args.extend(company_ids)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT company_id, period, MIN(COALESCE(document_released_at, filing_date)) AS released_at "
+                f"FROM datapoints WHERE {where} GROUP BY company_id, period ORDER BY company_id, period",
+                args,
+            ).fetchall()
+        history: dict[int, list[tuple[str, str]]] = {}
+        for r in rows:
+            history.setdefault(r["company_id"], []).append((r["period"], r["released_at"]))
+        return history
+
+    # -- point-in-time -------------------------------------------------------
+
+    def as_of(
+        self,
+        company_id: int,
+        when: str,
+        series_ids: list[int] | None = None,
+        periods: list[str] | None = None,
+    ) -> list[dict]:
+        """Datapoints as they were known at `when` (ISO date or timestamp).
+
+        A bare date means the end of that day. Values first seen after `when`
+        are omitted; values revised after `when` are returned as they stood.
+        """
+        when = _as_timestamp(when)
+        where, args = self._filters(company_id, series_ids, periods)
+        with self._lock:
+            rows = self.conn.execute(
+                f"""SELECT d.*, v.valid_from, v.value_raw AS v_value_raw,
+                           v.value_normalized AS v_value_normalized, v.restated AS v_restated,
+                           v.document_id AS v_document_id, v.fundamental_id AS v_fundamental_id
+                    FROM datapoints d
+                    JOIN datapoint_versions v
+                      ON v.company_id = d.company_id AND v.series_id = d.series_id AND v.period = d.period
+                    WHERE {where}
+                      AND v.valid_from = (
+                        SELECT MAX(w.valid_from) FROM datapoint_versions w
+                        WHERE w.company_id = d.company_id AND w.series_id = d.series_id
+                          AND w.period = d.period AND w.valid_from <= ?)
+                    ORDER BY d.series_id, d.period""",
+                args + [when],
+            ).fetchall()
+        results = []
+        for r in rows:
+            d = _row_to_datapoint(r).to_dict()
+            d.update({
+                "value_raw": r["v_value_raw"],
+                "value_normalized": r["v_value_normalized"],
+                "restated": bool(r["v_restated"]) if r["v_restated"] is not None else None,
+                "document_id": r["v_document_id"],
+                "id": r["v_fundamental_id"],
+                "valid_from": r["valid_from"],
+            })
+            results.append(d)
+        return results
+
+    def history(self, company_id: int, series_id: int, period: str) -> list[dict]:
+        """All recorded versions of one datapoint, oldest first."""
+        series_id = self.resolve_series([series_id])[0]
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM datapoint_versions WHERE company_id = ? AND series_id = ? AND period = ? "
+                "ORDER BY valid_from",
+                (company_id, series_id, period),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def changes_between(self, company_id: int, start: str, end: str) -> list[dict]:
+        """Datapoints whose value changed in (start, end], with old and new values.
+
+        Equivalent to diffing as_of(start) against as_of(end), but only touches
+        the versions recorded inside the window.
+        """
+        start, end = _as_timestamp(start), _as_timestamp(end)
+        with self._lock:
+            keys = self.conn.execute(
+                """SELECT DISTINCT series_id, period FROM datapoint_versions
+                   WHERE company_id = ? AND valid_from > ? AND valid_from <= ?""",
+                (company_id, start, end),
+            ).fetchall()
+        changes = []
+        for k in keys:
+            old = self._version_at(company_id, k["series_id"], k["period"], start)
+            new = self._version_at(company_id, k["series_id"], k["period"], end)
+            if old is not None and new is not None and old["value_raw"] == new["value_raw"] \
+                    and old["restated"] == new["restated"]:
+                continue
+            changes.append({
+                "series_id": k["series_id"],
+                "calendar_period": k["period"],
+                "old_value": old["value_raw"] if old else None,
+                "new_value": new["value_raw"] if new else None,
+                "restated": bool(new["restated"]) if new and new["restated"] is not None else None,
+                "changed_at": new["valid_from"] if new else None,
+            })
+        return changes
+
+    def restated_since(self, since: str, company_ids: list[int] | None = None) -> list[dict]:
+        """Datapoints restated (value_raw changed or restated flag flipped) in fetches at or after `since`.
+
+        One row per detected change, newest first, with the ticker and series
+        name; answered from the restatement index without diffing snapshots.
+        """
+        where = "r.detected_at >= ?"
+        args: list = [f"{since}T00:00:00Z" if len(since) == 10 else since]  # a date means from its start
+        if company_ids:
+            where += f" AND r.company_id IN ({', '.join('?' * len(company_ids))})"
+            args.extend(company_ids)
+        with self._lock:
+            rows = self.conn.execute(
+                f"""SELECT r.*, c.ticker, s.full_series_name FROM restatements r
+                    LEFT JOIN companies c ON c.id = r.company_id
+                    LEFT JOIN series s ON s.id = r.series_id
+                    WHERE {where} ORDER BY r.detected_at DESC, r.company_id, r.series_id, r.period""",
+                args,
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def _version_at(self, company_id: int, series_id: int, period: str, when: str) -> sqlite3.Row | None:
+        with self._lock:
+            return self.conn.execute(
+                """SELECT * FROM datapoint_versions
+                   WHERE company_id = ? AND series_id = ? AND period = ? AND valid_from <= ?
+                   ORDER BY valid_from DESC LIMIT 1""",
+                (company_id, series_id, period, when),
+            ).fetchone()
+
+    def _filters(self, company_id, series_ids, periods) -> tuple[str, list]:
+        """WHERE clause (on alias d) for a company with optional series/period filters."""
+        where = "d.company_id = ?"
+        args: list = [company_id]
+        if series_ids:
+            live = self.resolve_series(series_ids)
+            where += f" AND d.series_id IN ({', '.join('?' * len(live))})"
+            args.extend(live)
+        if periods:
+            where += f" AND d.period IN ({', '.join('?' * len(periods))})"
+            args.extend(periods)
+        return where, args
+
+    # -- series continuations ------------------------------------------------
+
+    def save_continuations(self, company_id: int, continuations: list[dict]):
+        """Store a /series-continuation result and rebuild the resolved redirects."""
+        edges = [
+            (company_id, old["id"], new["id"], c.get("type"), c.get("created_at"))
+            for c in continuations
+            for old in c.get("old_series", [])
+            for new in c.get("new_series", [])
+        ]
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM series_continuations WHERE company_id = ?", (company_id,))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO series_continuations VALUES (?, ?, ?, ?, ?)", edges
+            )
+            graph: dict[int, list[int]] = {}
+            for _, old_id, new_id, _, _ in edges:
+                graph.setdefault(old_id, []).append(new_id)
+            self.conn.execute("DELETE FROM series_redirects WHERE company_id = ?", (company_id,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO series_redirects VALUES (?, ?, ?)",
+                [(old, live, company_id) for old, lives in resolve_chains(graph).items() for live in lives],
+            )
+            self.conn.execute(
+                "UPDATE companies SET continuations_synced_at = ? WHERE id = ?", (utcnow(), company_id)
+            )
+
+    def continuations_synced_at(self, company_id: int) -> str | None:
+        company = self.company(company_id)
+        return company.get("continuations_synced_at") if company else None
+
+    def updates_synced_through(self, company_id: int) -> str | None:
+        """High-water mark (latest updated_at) of the incremental updates pulled for a company."""
+        company = self.company(company_id)
+        return company.get("updates_synced_through") if company else None
+
+    def upsert_updates(self, company_id: int, rows: list[dict] | list[Datapoint], synced_through: str | None,
+                       poll_status: dict | None = None, detections: list[tuple] = (), rebuild: bool = False,
+                       ticker: str | None = None) -> int:
+        """Upsert incremental update rows and advance the company's high-water mark atomically.
+
+        New and revised values are journaled to change_events. Whatever else
+        the pull produced is written in the same transaction: the poller's
+        state for the company (if a /companies/status entry is given), the
+        detection-latency rows, and with `rebuild` a rebuild request if any
+        rows arrived. A process that dies mid-pull leaves none of it behind,
+        and the next pull starts again from the last committed mark.
+        """
+        with self._write():
+            written = self._upsert_rows(company_id, rows, journal=True)
+            if synced_through:
+                self.conn.execute(
+                    "INSERT INTO companies (id, updates_synced_through) VALUES (?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET updates_synced_through = "
+                    "MAX(COALESCE(companies.updates_synced_through, ''), excluded.updates_synced_through)",
+                    (company_id, synced_through),
+                )
+            if poll_status is not None:
+                self._save_poll_state(company_id, poll_status)
+            if detections:
+                self._insert_detections(detections)
+            if rebuild and rows:
+                self._request_rebuild(company_id, ticker)
+        return written
+
+    # -- change events -------------------------------------------------------
+
+    def change_events(self, after: int = 0, limit: int = 1000) -> list[dict]:
+        """Journaled changes with id > `after`, oldest first, with the ticker and series name."""
+        with self._lock:
+            rows = self.conn.execute(
+                """SELECT e.*, c.ticker, s.full_series_name FROM change_events e
+                   LEFT JOIN companies c ON c.id = e.company_id
+                   LEFT JOIN series s ON s.id = e.series_id
+                   WHERE e.id > ? ORDER BY e.id LIMIT ?""",
+                (after, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def last_change_event(self) -> int:
+        """Offset of the newest journaled change (0 if none)."""
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_events").fetchone()[0]
+
+    def prune_change_events(self, before: str) -> int:
+        """Drop journaled changes detected before a timestamp. Returns rows removed."""
+        with self._write():
+            return self.conn.execute("DELETE FROM change_events WHERE detected_at < ?", (before,)).rowcount
+
+    # -- poll state ----------------------------------------------------------
+
+    def poll_state(self) -> dict[int, dict]:
+        """{company_id: {latest_datapoint_created_at, latest_period, processed_at}} for every polled company."""
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM poll_state").fetchall()
+        return {r["company_id"]: dict(r) for r in rows}
+
+    def save_poll_states(self, statuses: dict[int, dict]):
+        """Record /companies/status entries as processed, without pulling data (e.g. on migration)."""
+        with self._write():
+            for company_id, status in statuses.items():
+                self._save_poll_state(company_id, status)
+
+    def _save_poll_state(self, company_id: int, status: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO poll_state VALUES (?, ?, ?, ?)",
+            (company_id, status.get("latest_datapoint_created_at"), status.get("latest_period"), utcnow()),
+        )
+
+    def checkpoint(self):
+        """Fold the write-ahead log back into the database file and truncate it."""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def redirects(self, company_id: int) -> dict[int, list[int]]:
+        """Resolved old -> live series mapping for a company."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT old_id, live_id FROM series_redirects WHERE company_id = ? ORDER BY old_id, live_id",
+                (company_id,),
+            ).fetchall()
+        mapping: dict[int, list[int]] = {}
+        for r in rows:
+            mapping.setdefault(r["old_id"], []).append(r["live_id"])
+        return mapping
+
+    def resolve_series(self, series_ids: list[int]) -> list[int]:
+        """Rewrite deprecated series IDs to their live replacements, keeping order."""
+        if not series_ids:
+            return []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT old_id, live_id FROM series_redirects WHERE old_id IN ({', '.join('?' * len(series_ids))}) "
+                "ORDER BY old_id, live_id",
+                list(series_ids),
+            ).fetchall()
+        redirects: dict[int, list[int]] = {}
+        for r in rows:
+            redirects.setdefault(r["old_id"], []).append(r["live_id"])
+        live = []
+        for sid in series_ids:
+            for target in redirects.get(sid, [sid]):
+                if target not in live:
+                    live.append(target)
+        return live
+
+    # -- rollups -------------------------------------------------------------
+
+    def rollups(
+        self,
+        company_id: int,
+        kind: str,
+        series_ids: list[int] | None = None,
+        periods: list[str] | None = None,
+        fiscal_years: list[int] | None = None,
+    ) -> list[dict]:
+        """Materialized TTM / YTD / FY values, oldest first.
+
+        `periods` filters on the calendar period the window ends at;
+        `fiscal_years` on the fiscal year it belongs to.
+        """
+        if kind not in ROLLUP_KINDS:
+            raise ValueError(f"kind must be one of {ROLLUP_KINDS}, got {kind!r}")
+        where, args = self._filters(company_id, series_ids, periods)
+        where += " AND d.kind = ?"
+        args.append(kind)
+        if fiscal_years:
+            where += f" AND d.fiscal_year IN ({', '.join('?' * len(fiscal_years))})"
+            args.extend(fiscal_years)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM rollups d WHERE {where} ORDER BY d.series_id, d.fiscal_year, d.period", args
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def latest_ttm(self, company_id: int, series_ids: list[int]) -> dict[int, dict]:
+        """Most recent TTM rollup per series (LTM figures for multiples)."""
+        latest: dict[int, dict] = {}
+        for r in self.rollups(company_id, "ttm", series_ids=series_ids):
+            latest[r["series_id"]] = r  # rows are ordered oldest first
+        return latest
+
+    def rebuild_rollups(self, company_id: int | None = None):
+        """Recompute every rollup for one company (or all) from the stored datapoints."""
+        with self._write():
+            if company_id is not None:
+                self._refresh_rollups(company_id)
+                return
+            for (cid,) in self.conn.execute("SELECT DISTINCT company_id FROM datapoints").fetchall():
+                self._refresh_rollups(cid)
+
+    def _refresh_rollups(self, company_id: int, series_ids: set[int] | None = None,
+                         fiscal_years: set[int] | None = None):
+        """Recompute rollups for some series and fiscal years (all when None). Caller holds the write lock.
+
+        A quarter landing in fiscal year Y changes Y's YTD and FY values and
+        the TTM windows ending in Y..Y+1, so years Y-1..Y+1 are read and Y..Y+1
+        are rewritten.
+        """
+        ids = sorted(series_ids) if series_ids is not None else [None]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            where, args = "company_id = ?", [company_id]
+            if series_ids is not None:
+                where += f" AND series_id IN ({', '.join('?' * len(chunk))})"
+                args.extend(chunk)
+            delete_where, delete_args = where, list(args)
+            if fiscal_years:
+                lo, hi = min(fiscal_years), max(fiscal_years) + 1
+                where += " AND CAST(substr(fiscal_period, 1, 4) AS INTEGER) BETWEEN ? AND ?"
+                args.extend([lo - 1, hi])
+                delete_where += " AND fiscal_year BETWEEN ? AND ?"
+                delete_args.extend([lo, hi])
+            rows = self.conn.execute(
+                f"SELECT series_id, period, fiscal_period, value_raw, category, title, unit "
+                f"FROM datapoints WHERE {where}",
+                args,
+            ).fetchall()
+            computed = compute_rollups(rows)
+            if fiscal_years:
+                computed = [r for r in computed if lo <= r[3] <= hi]
+            self.conn.execute(f"DELETE FROM rollups WHERE {delete_where}", delete_args)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(company_id,) + r for r in computed],
+            )
+
+    # -- warm-up checkpoints -------------------------------------------------
+
+    def warmup_checkpoint(self, company_id: int) -> dict | None:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM warmup_progress WHERE company_id = ?", (company_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_warmup_checkpoint(self, company_id: int, status: str, model_updated_at: str | None = None,
+                               datapoints: int | None = None, error: str | None = None):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO warmup_progress VALUES (?, ?, ?, ?, ?, ?)",
+                (company_id, model_updated_at, status, datapoints, error, utcnow()),
+            )
+
+    # -- webhook queue -------------------------------------------------------
+
+    def enqueue_webhook(self, digest: str, event_type: str | None, company_id: int | None, payload: str,
+                        dedupe_since: str) -> int | None:
+        """Queue a webhook delivery. Returns its event id, or None if the same body arrived since dedupe_since."""
+        with self._write():
+            seen = self.conn.execute(
+                "SELECT 1 FROM webhook_events WHERE digest = ? AND received_at >= ?", (digest, dedupe_since)
+            ).fetchone()
+            if seen:
+                return None
+            cur = self.conn.execute(
+                "INSERT INTO webhook_events (digest, received_at, event_type, company_id, payload) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (digest, utcnow(), event_type, company_id, payload),
+            )
+            return cur.lastrowid
+
+    def pending_webhooks(self, limit: int = 500) -> list[dict]:
+        """Queued deliveries not yet processed, oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM webhook_events WHERE status = 'pending' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def finish_webhooks(self, event_ids: list[int], error: str | None = None, max_attempts: int = 5):
+        """Mark deliveries done, or record a failed attempt (failed for good after max_attempts)."""
+        marks = ", ".join("?" * len(event_ids))
+        with self._write():
+            if error is None:
+                self.conn.execute(
+                    f"UPDATE webhook_events SET status = 'done', attempts = attempts + 1, processed_at = ?, "
+                    f"error = NULL WHERE id IN ({marks})",
+                    [utcnow()] + list(event_ids),
+                )
+            else:
+                self.conn.execute(
+                    f"UPDATE webhook_events SET attempts = attempts + 1, error = ?, processed_at = ?, "
+                    f"status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                    f"WHERE id IN ({marks})",
+                    [error, utcnow(), max_attempts] + list(event_ids),
+                )
+
+    def webhook_counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM webhook_events GROUP BY status").fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    # -- rebuild queue -------------------------------------------------------
+
+    def request_rebuild(self, company_id: int, ticker: str | None):
+        """Queue a rebuild for a company, folding into its pending one if there is one."""
+        with self._write():
+            self._request_rebuild(company_id, ticker)
+
+    def _request_rebuild(self, company_id: int, ticker: str | None):
+        now = utcnow()
+        bumped = self.conn.execute(
+            "UPDATE rebuilds SET requests = requests + 1, last_requested_at = ? "
+            "WHERE company_id = ? AND status = 'pending'",
+            (now, company_id),
+        ).rowcount
+        if not bumped:
+            self.conn.execute(
+                "INSERT INTO rebuilds (company_id, ticker, first_requested_at, last_requested_at) "
+                "VALUES (?, ?, ?, ?)",
+                (company_id, ticker, now, now),
+            )
+
+    def claim_rebuilds(self, quiet_since: str, overdue_since: str, limit: int) -> list[dict]:
+        """Mark up to `limit` settled pending rebuilds running and return them.
+
+        A rebuild is settled once no request has arrived since `quiet_since`, or
+        when it was first requested before `overdue_since` (so a steady trickle
+        of updates cannot postpone it forever). Companies with a rebuild
+        already running are skipped.
+        """
+        with self._write():
+            rows = self.conn.execute(
+                """SELECT * FROM rebuilds
+                   WHERE status = 'pending' AND (last_requested_at <= ? OR first_requested_at <= ?)
+                     AND company_id NOT IN (SELECT company_id FROM rebuilds WHERE status = 'running')
+                   ORDER BY first_requested_at LIMIT ?""",
+                (quiet_since, overdue_since, limit),
+            ).fetchall()
+            now = utcnow()
+            self.conn.executemany(
+                "UPDATE rebuilds SET status = 'running', started_at = ? WHERE id = ?",
+                [(now, r["id"]) for r in rows],
+            )
+        return [dict(r, status="running", started_at=now) for r in rows]
+
+    def finish_rebuild(self, rebuild_id: int, seconds: float, steps: dict[str, float], error: str | None = None):
+        """Record a finished rebuild; a successful one completes the detections it covered."""
+        now = utcnow()
+        with self._write():
+            self.conn.execute(
+                "UPDATE rebuilds SET status = ?, finished_at = ?, seconds = ?, steps = ?, error = ? WHERE id = ?",
+                ("failed" if error else "done", now, seconds, json.dumps(steps), error, rebuild_id),
+            )
+            if error is None:
+                self.conn.execute(
+                    """UPDATE detection_latency SET completed_at = ?
+                       WHERE completed_at IS NULL
+                         AND company_id = (SELECT company_id FROM rebuilds WHERE id = ?)
+                         AND detected_at <= (SELECT last_requested_at FROM rebuilds WHERE id = ?)""",
+                    (now, rebuild_id, rebuild_id),
+                )
+
+    def requeue_rebuilds(self) -> int:
+        """Put rebuilds left running by a dead pipeline back in the queue. Returns rows requeued."""
+        with self._write():
+            return self.conn.execute(
+                "UPDATE rebuilds SET status = 'pending', started_at = NULL WHERE status = 'running'"
+            ).rowcount
+
+    def rebuilds(self, since: str | None = None, limit: int = 100) -> list[dict]:
+        """Queued and recent rebuilds, newest first, with steps decoded."""
+        where, args = ("WHERE first_requested_at >= ?", [since]) if since else ("", [])
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM rebuilds {where} ORDER BY id DESC LIMIT ?", args + [limit]
+            ).fetchall()
+        return [dict(r, steps=json.loads(r["steps"]) if r["steps"] else {}) for r in rows]
+
+    # -- detection latency ---------------------------------------------------
+
+    def record_detections(self, rows: list[tuple]):
+        """Insert (company_id, document_id, detected_at, released_at, changed_at, datapoints) rows."""
+        with self._write():
+            self._insert_detections(rows)
+
+    def _insert_detections(self, rows: list[tuple]):
+        self.conn.executemany("INSERT OR REPLACE INTO detection_latency VALUES (?, ?, ?, ?, ?, NULL, ?)", rows)
+
+    def detections(self, since: str, company_ids: list[int] | None = None) -> list[dict]:
+        """Detections at or after `since` with their latencies in seconds (None where unknown)."""
+        where = "d.detected_at >= ?"
+        args: list = [since]
+        if company_ids:
+            where += f" AND d.company_id IN ({', '.join('?' * len(company_ids))})"
+            args.extend(company_ids)
+        with self._lock:
+            rows = self.conn.execute(
+                f"""SELECT d.*, c.ticker,
+                           (julianday(d.detected_at) - julianday(d.released_at)) * 86400 AS release_to_detect,
+                           (julianday(d.detected_at) - julianday(d.changed_at)) * 86400 AS created_to_detect,
+                           (julianday(d.completed_at) - julianday(d.released_at)) * 86400 AS release_to_complete,
+                           (julianday(d.completed_at) - julianday(d.changed_at)) * 86400 AS created_to_complete
+                    FROM detection_latency d LEFT JOIN companies c ON c.id = d.company_id
+                    WHERE {where} ORDER BY d.detected_at""",
+                args,
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    # -- datapoint usage -----------------------------------------------------
+
+    def record_usage(self, summary: dict, status: str):
+        """Log a finished metered job (a DatapointMeter.summary())."""
+        with self._write():
+            self.conn.execute(
+                "INSERT INTO datapoint_usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (summary["job"], summary["started_at"], utcnow(), status, summary["requests"],
+                 summary["fetched"], summary["from_cache"], summary["from_store"], summary["quota"]),
+            )
+
+    def usage(self, since: str | None = None) -> list[dict]:
+        """Logged jobs started at or after `since`, oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT * FROM datapoint_usage WHERE started_at >= ? ORDER BY started_at", (since or "",)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+
+def _row_to_datapoint(row: sqlite3.Row) -> Datapoint:
+    """Convert a datapoints row into a compact Datapoint record."""
+    d = {f: row[f] for f in DATAPOINT_FIELDS}
+    d["series_id"] = row["series_id"]
+    d["calendar_period"] = row["period"]
+    d["restated"] = bool(d["restated"]) if d["restated"] is not None else None
+    return Datapoint.from_api(d)
+
+
+def _versioned_values(r: dict) -> tuple:
+    """The VERSIONED_FIELDS of an API result, normalized the way SQLite stores them."""
+    raw, norm, restated = r.get("value_raw"), r.get("value_normalized"), r.get("restated")
+    return (
+        None if raw is None else float(raw),
+        None if norm is None else float(norm),
+        None if restated is None else int(restated),
+        r.get("document_id"),
+        r.get("id"),
+    )
+
+
+def series_kind(category: str | None, title: str | None, unit: str | None) -> str:
+    """Classify a series as 'flow' (summed), 'stock' (point in time) or 'ratio' (not rolled up)."""
+    text = f"{category or ''} {title or ''}".lower()
+    if RATIO_UNITS.search((unit or "").strip()) or RATIO_KEYWORDS.search(text):
+        return "ratio"
+    if any(k in text for k in STOCK_KEYWORDS):
+        return "stock"
+    return "flow"
+
+
+def compute_rollups(rows) -> list[tuple]:
+    """(series_id, kind, period, fiscal_year, fiscal_quarter, value) rollups for datapoint rows.
+
+    `rows` carry series_id, period, fiscal_period, value_raw, category, title
+    and unit. Flow windows with a missing quarter are left out rather than
+    summed short; a reported fiscal-year value wins over the summed quarters.
+    """
+    quarters: dict[int, dict[int, tuple]] = {}  # series -> fiscal quarter index -> (period, value)
+    annual: dict[int, dict[int, tuple]] = {}  # series -> fiscal year -> (period, value)
+    kinds: dict[int, str] = {}
+    for r in rows:
+        sid, fiscal, value = r["series_id"], r["fiscal_period"] or "", r["value_raw"]
+        if sid not in kinds:
+            kinds[sid] = series_kind(r["category"], r["title"], r["unit"])
+        m = FISCAL_QUARTER.match(fiscal)
+        if m:
+            quarters.setdefault(sid, {})[int(m.group(1)) * 4 + int(m.group(2)) - 1] = (r["period"], value)
+        elif FISCAL_YEAR.match(fiscal):
+            annual.setdefault(sid, {})[int(fiscal[:4])] = (r["period"], value)
+
+    out = []
+    for sid, kind in kinds.items():
+        if kind == "ratio":
+            continue
+        qs = quarters.get(sid, {})
+        fy_done = set()
+        for idx in sorted(qs):
+            period, value = qs[idx]
+            year, q = divmod(idx, 4)
+            if value is None:
+                continue
+            if kind == "stock":
+                ttm = ytd = value
+            else:
+                window = [qs.get(j, (None, None))[1] for j in range(idx - 3, idx + 1)]
+                ttm = sum(window) if None not in window else None
+                window = [qs.get(j, (None, None))[1] for j in range(idx - q, idx + 1)]
+                ytd = sum(window) if None not in window else None
+            if ttm is not None:
+                out.append((sid, "ttm", period, year, q + 1, ttm))
+            if ytd is not None:
+                out.append((sid, "ytd", period, year, q + 1, ytd))
+                if q == 3 and year not in annual.get(sid, {}):
+                    out.append((sid, "fy", period, year, None, ytd))
+                    fy_done.add(year)
+        for year, (period, value) in annual.get(sid, {}).items():
+            if value is not None and year not in fy_done:
+                q4 = qs.get(year * 4 + 3)
+                out.append((sid, "fy", q4[0] if q4 else period, year, None, value))
+    return out
+
+
+def _fiscal_year(fiscal_period: str | None) -> int | None:
+    if fiscal_period and fiscal_period[:4].isdigit():
+        return int(fiscal_period[:4])
+    return None
+
+
+def _normalize_timestamp(ts: str | None) -> str | None:
+    """An ISO-8601 timestamp in utcnow()'s format (None if missing or unparseable).
+
+    API stamps come with and without fractional seconds or as offsets, and
+    only one format compares correctly as a string against stored stamps.
+    """
+    if not ts:
+        return None
+    try:
+        parsed = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _as_timestamp(when: str) -> str:
+    """Normalize a date or timestamp so it compares correctly against stored ISO strings."""
+    if len(when) == 10:  # YYYY-MM-DD -> end of that day
+        return f"{when}T23:59:59.999999Z"
+    return _normalize_timestamp(when) or when
+
+
+_default_store: FundamentalsStore | None = None
+_default_lock = threading.Lock()
+
+
+def get_store() -> FundamentalsStore:
+    """Return the process-wide store at STORE_PATH, opening it on first use."""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = FundamentalsStore()
+        return _default_store
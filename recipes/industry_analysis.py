@@ -17,7 +17,9 @@ Usage:
 
 import sys
 
+import daloopa_client
 from daloopa_client import get, paginate
+from datapoint import Datapoint
 
 
 def list_sub_industries() -> list[dict]:
@@ -43,15 +45,9 @@ def get_metric_detail(metric_id: int, sub_industry_id: int) -> dict:
     return get(f"/taxonomy/metrics/{metric_id}", params={"sub_industry_id": sub_industry_id})
 
 
-def get_fundamentals(company_id: int, periods: list[str], series_ids: list[int]) -> list[dict]:
+def get_fundamentals(company_id: int, periods: list[str], series_ids: list[int]) -> list[Datapoint]:
     """Fetch fundamental data."""
-    param_tuples = [("company_id", company_id)]
-    for p in periods:
-        param_tuples.append(("periods", p))
-    for sid in series_ids:
-        param_tuples.append(("series_ids", sid))
-    data = get("/companies/fundamentals", params=param_tuples)
-    return data.get("results", []) if isinstance(data, dict) else data
+    return daloopa_client.get_fundamentals(company_id, periods, series_ids)
 
 
 def main():
@@ -0,0 +1,295 @@
+"""
+Recipe 10: Ingest Downloaded Excel Models
+===========================================
+Map Excel models saved by download_model.py into the local fundamentals store
+so they can be used offline. Workbooks are opened in openpyxl read-only mode
+and streamed row by row, so even very large models never load fully into
+memory. Many models can be ingested at once in a process pool.
+
+Each sheet is scanned for a header row of period columns (2024Q1, 1Q24, FY2024,
+...). Rows below it are matched to the company's series by a Tag ID / Series ID
+column when the sheet has one, otherwise by "Section | Label" against the
+series catalog (fetched from the API the first time a company is ingested).
+Fiscal headers are translated to calendar periods using datapoints already in
+the store; without them fiscal and calendar periods are assumed equal.
+
+The API stays the source of truth: datapoints the store already holds from the
+API are left untouched, and model values that differ from them are only
+counted. Model-only datapoints are added as versions effective from ingestion,
+with the unit from a Unit column or from the series' API datapoints.
+
+Usage:
+    # Ingest every downloaded model under reports/
+    python recipes/ingest_models.py
+
+    # Ingest specific models with 4 worker processes
+    python recipes/ingest_models.py reports/AAPL_model.xlsx reports/MSFT_model.xlsx --workers 4
+"""
+
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+from daloopa_client import get, resolve_company
+from fundamentals_store import FundamentalsStore, get_store
+
+MODEL_DIR = Path(__file__).resolve().parent.parent / "reports"
+BATCH_SIZE = 2000
+HEADER_SCAN_ROWS = 30  # rows searched for the period header on each sheet
+MIN_PERIOD_COLUMNS = 3
+
+MODEL_NAME = re.compile(r"^(?P<ticker>.+?)_model$")
+ID_HEADER = re.compile(r"^(tag[\s_]*id|series[\s_]*id)$", re.IGNORECASE)
+UNIT_HEADER = re.compile(r"^units?$", re.IGNORECASE)
+PERIOD_PATTERNS = [
+    (re.compile(r"^(\d{4})\s*-?\s*Q([1-4])$"), lambda m: f"{m[1]}Q{m[2]}"),
+    (re.compile(r"^([1-4])Q(\d{2}|\d{4})A?$"), lambda m: f"{_year(m[2])}Q{m[1]}"),
+    (re.compile(r"^Q([1-4])[\s'-]*(\d{2}|\d{4})A?$"), lambda m: f"{_year(m[2])}Q{m[1]}"),
+    (re.compile(r"^FY\s*'?(\d{2}|\d{4})A?$"), lambda m: f"{_year(m[1])}FY"),
+    (re.compile(r"^(\d{4})\s*FY$"), lambda m: f"{m[1]}FY"),
+]
+
+
+def _year(y: str) -> int:
+    return int(y) + 2000 if len(y) == 2 else int(y)
+
+
+def parse_period(value) -> str | None:
+    """Parse a model column header into YYYYQn / YYYYFY, or None if it isn't a period."""
+    if not isinstance(value, str):
+        return None
+    text = value.strip().upper()
+    for pattern, fmt in PERIOD_PATTERNS:
+        m = pattern.match(text)
+        if m:
+            return fmt(m)
+    return None
+
+
+def _column(row: tuple, pattern: re.Pattern) -> int | None:
+    return next((c for c, v in enumerate(row) if isinstance(v, str) and pattern.match(v.strip())), None)
+
+
+def find_header(row: tuple) -> tuple[dict[int, str], int | None, int | None] | None:
+    """Return ({column: period}, id_column, unit_column) if the row is a period header, else None."""
+    periods = {c: p for c, p in ((c, parse_period(v)) for c, v in enumerate(row)) if p}
+    if len(periods) < MIN_PERIOD_COLUMNS:
+        return None
+    return periods, _column(row, ID_HEADER), _column(row, UNIT_HEADER)
+
+
+class SeriesMatcher:
+    """Match model rows to series IDs by full series name or unambiguous label."""
+
+    def __init__(self, series: list[dict]):
+        self.by_name = {}
+        by_label: dict[str, list[int]] = {}
+        for s in series:
+            name = (s.get("full_series_name") or "").strip().lower()
+            if not name:
+                continue
+            self.by_name[name] = s["id"]
+            by_label.setdefault(name.rsplit("|", 1)[-1].strip(), []).append(s["id"])
+        self.by_label = {label: ids[0] for label, ids in by_label.items() if len(ids) == 1}
+
+    def match(self, section: str | None, label: str) -> int | None:
+        label = label.strip().lower()
+        if section:
+            sid = self.by_name.get(f"{section.strip().lower()} | {label}")
+            if sid:
+                return sid
+        return self.by_label.get(label)
+
+
+def iter_model_rows(path: str, matcher: SeriesMatcher, period_map: dict[str, str], units: dict[int, str]):
+    """Stream (series_id, datapoint) pairs from every sheet of a model workbook.
+
+    `units` ({series_id: unit}) fills in the unit for rows without a Unit column value.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = None
+            for _, row in zip(range(HEADER_SCAN_ROWS), rows):
+                header = find_header(row)
+                if header:
+                    break
+            if not header:
+                continue
+            periods, id_col, unit_col = header
+            first_period_col = min(periods)
+            section = None
+            for row in rows:
+                label = next((v for v in row[:first_period_col] if isinstance(v, str) and v.strip()), None)
+                if label is None:
+                    continue
+                values = {c: row[c] for c in periods if c < len(row) and isinstance(row[c], (int, float))
+                          and not isinstance(row[c], bool)}
+                if not values:
+                    section = label.strip()  # heading row: no numbers, only a label
+                    continue
+                sid = None
+                if id_col is not None and id_col < len(row) and row[id_col] is not None:
+                    try:
+                        sid = int(row[id_col])
+                    except (TypeError, ValueError):
+                        sid = None
+                if sid is None:
+                    sid = matcher.match(section, label)
+                if sid is None:
+                    yield None, None
+                    continue
+                unit = row[unit_col] if unit_col is not None and unit_col < len(row) else None
+                unit = unit.strip() if isinstance(unit, str) and unit.strip() else units.get(sid)
+                for c, value in values.items():
+                    fiscal = periods[c]
+                    yield sid, {
+                        "series_id": sid,
+                        "calendar_period": period_map.get(fiscal, fiscal),
+                        "fiscal_period": fiscal,
+                        "value_raw": float(value),
+                        "unit": unit,
+                        "label": label.strip(),
+                        "category": section,
+                        "title": f"{section} | {label.strip()}" if section else label.strip(),
+                        "span": "Annual" if fiscal.endswith("FY") else "Quarterly",
+                    }
+    finally:
+        wb.close()
+
+
+def ingest_model(path: str, company_id: int, store_path: str,
+                 batch_size: int = BATCH_SIZE) -> tuple[str, int, int, int, float]:
+    """Ingest one model. Runs in a worker process; returns (path, rows, unmatched_rows, differing, seconds).
+
+    Datapoints the store already holds from the API are skipped; `differing`
+    counts those whose model value does not match the API value. The rest are
+    written with no timestamps, so their versions are effective from now.
+    """
+    start = time.perf_counter()
+    written = unmatched = differing = 0
+    with FundamentalsStore(store_path) as store:
+        matcher = SeriesMatcher(store.series(company_id))
+        period_map = store.fiscal_to_calendar(company_id)
+        units = store.series_units(company_id)
+        batch = []
+
+        def flush() -> tuple[int, int]:
+            existing = {
+                (d["series_id"], d["calendar_period"]): d
+                for d in store.datapoints(company_id, series_ids=sorted({b["series_id"] for b in batch}))
+            }
+            new = []
+            diffs = 0
+            for dp in batch:
+                known = existing.get((dp["series_id"], dp["calendar_period"]))
+                if known is None or known["id"] is None:  # not from the API (or from an earlier model)
+                    new.append(dp)
+                elif known["value_raw"] is None or not math.isclose(known["value_raw"], dp["value_raw"],
+                                                                     rel_tol=1e-6, abs_tol=1e-9):
+                    diffs += 1
+            return (store.upsert_datapoints(company_id, new) if new else 0), diffs
+
+        for sid, dp in iter_model_rows(path, matcher, period_map, units):
+            if sid is None:
+                unmatched += 1
+                continue
+            batch.append(dp)
+            if len(batch) >= batch_size:
+                n, diffs = flush()
+                written, differing = written + n, differing + diffs
+                batch = []
+        if batch:
+            n, diffs = flush()
+            written, differing = written + n, differing + diffs
+    return path, written, unmatched, differing, time.perf_counter() - start
+
+
+def company_from_path(path: str) -> dict | None:
+    """Resolve the company for a {TICKER}_model.xlsx or company_{ID}_model.xlsx file."""
+    m = MODEL_NAME.match(Path(path).stem)
+    if not m:
+        return None
+    ticker = m.group("ticker")
+    by_id = re.match(r"^company_(\d+)$", ticker)
+    if by_id:
+        company_id = int(by_id.group(1))
+        return get_store().company(company_id) or {"id": company_id}
+    return resolve_company(ticker)
+
+
+def ensure_series_catalog(company_id: int):
+    """Fetch and cache the company's full series catalog if the store has none."""
+    store = get_store()
+    if not store.series(company_id):
+        if store.company(company_id) is None:
+            store.upsert_company({"id": company_id})
+        store.upsert_series(company_id, get("/companies/series", params={"company_id": company_id}))
+
+
+def ingest_models(paths: list[str], workers: int | None = None) -> int:
+    """Ingest downloaded models into the store in parallel. Returns total datapoints written."""
+    jobs = []
+    for path in paths:
+        company = company_from_path(path)
+        if company is None:
+            print(f"  Warning: can't resolve a company for {path}, skipping.")
+            continue
+        ensure_series_catalog(company["id"])
+        jobs.append((path, company["id"]))
+    if not jobs:
+        return 0
+
+    store_path = str(get_store().path)
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    total = failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(ingest_model, path, cid, store_path): path for path, cid in jobs}
+        for fut in as_completed(futures):
+            try:
+                path, written, unmatched, differing, secs = fut.result()
+            except Exception as e:
+                failed += 1
+                print(f"  Warning: {futures[fut]}: {e}, skipping.")
+                continue
+            total += written
+            print(f"  {Path(path).name}: {written:,} datapoints in {secs:.1f}s"
+                  + (f" ({unmatched:,} unmatched rows skipped)" if unmatched else "")
+                  + (f" ({differing:,} model values differ from the API and were not stored)" if differing else ""))
+
+    print(f"\nIngested {total:,} datapoints from {len(jobs) - failed} model(s) in "
+          f"{time.perf_counter() - start:.1f}s ({workers} worker(s))"
+          + (f"; {failed} failed" if failed else ""))
+    return total
+
+
+def main():
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if args and args[0] in ("-h", "--help"):
+        print("Usage: python recipes/ingest_models.py [MODEL.xlsx ...] [--workers N]")
+        sys.exit(1)
+
+    paths = args or sorted(str(p) for p in MODEL_DIR.glob("*_model.xlsx"))
+    if not paths:
+        print(f"No downloaded models found in {MODEL_DIR}. Run download_model.py first.")
+        sys.exit(1)
+
+    print(f"Ingesting {len(paths)} model(s) into {get_store().path}...")
+    ingest_models(paths, workers=workers)
+
+
+if __name__ == "__main__":
+    main()
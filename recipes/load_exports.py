@@ -0,0 +1,136 @@
+"""
+Recipe 9: Bulk Load Export CSVs
+=================================
+Stream `/export/{ticker}` CSV files (see export_csv.py) into the local
+fundamentals store. Files are parsed row by row with typed columns and written
+in batched transactions, with one worker process per file so a whole coverage
+universe of exports loads in parallel.
+
+The ticker is taken from the file name ({TICKER}_export.csv,
+{TICKER}_realtime_export.csv or {TICKER}_full_export.csv) and resolved to a
+company ID through the local store, falling back to the API.
+
+Usage:
+    # Load every export under reports/
+    python recipes/load_exports.py
+
+    # Load specific files with 8 worker processes
+    python recipes/load_exports.py reports/AAPL_export.csv reports/MSFT_export.csv --workers 8
+"""
+
+import csv
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from daloopa_client import resolve_company
+from fundamentals_store import FundamentalsStore, get_store
+
+EXPORT_DIR = Path(__file__).resolve().parent.parent / "reports"
+BATCH_SIZE = 5000
+EXPORT_NAME = re.compile(r"^(?P<ticker>.+?)(?:_realtime|_full)?_export$")
+
+INT_COLUMNS = ("id", "series_id", "document_id")
+FLOAT_COLUMNS = ("value_raw", "value_normalized")
+
+
+def parse_row(row: dict) -> dict:
+    """Convert a CSV row (all strings) into the /companies/fundamentals result shape."""
+    out = {k: (v if v != "" else None) for k, v in row.items() if k}
+    for col in INT_COLUMNS:
+        if out.get(col) is not None:
+            out[col] = int(float(out[col]))
+    for col in FLOAT_COLUMNS:
+        if out.get(col) is not None:
+            out[col] = float(out[col].replace(",", ""))
+    if out.get("restated") is not None:
+        out["restated"] = out["restated"].strip().lower() in ("true", "1", "yes")
+    return out
+
+
+def iter_batches(path: str, batch_size: int = BATCH_SIZE):
+    """Yield lists of parsed rows from an export CSV without reading it whole."""
+    batch = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if not row.get("series_id") or not row.get("calendar_period"):
+                continue
+            batch.append(parse_row(row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def load_file(path: str, company_id: int, store_path: str, batch_size: int = BATCH_SIZE) -> tuple[str, int, float]:
+    """Load one export into the store. Runs in a worker process; returns (path, rows, seconds)."""
+    start = time.perf_counter()
+    rows = 0
+    with FundamentalsStore(store_path) as store:
+        for batch in iter_batches(path, batch_size):
+            rows += store.upsert_datapoints(company_id, batch)
+    return path, rows, time.perf_counter() - start
+
+
+def ticker_from_path(path: str) -> str | None:
+    """Extract the ticker from an export file name."""
+    m = EXPORT_NAME.match(Path(path).stem)
+    return m.group("ticker").upper() if m else None
+
+
+def load_exports(paths: list[str], workers: int | None = None, batch_size: int = BATCH_SIZE) -> int:
+    """Load export CSVs into the store in parallel. Returns total rows loaded."""
+    jobs = []
+    for path in paths:
+        ticker = ticker_from_path(path)
+        company = resolve_company(ticker) if ticker else None
+        if company is None:
+            print(f"  Warning: can't resolve a company for {path}, skipping.")
+            continue
+        jobs.append((path, company["id"]))
+    if not jobs:
+        return 0
+
+    store_path = str(get_store().path)
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    total_rows = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(load_file, path, cid, store_path, batch_size) for path, cid in jobs]
+        for fut in as_completed(futures):
+            path, rows, secs = fut.result()
+            total_rows += rows
+            print(f"  {Path(path).name}: {rows:,} rows in {secs:.1f}s ({rows / max(secs, 1e-9):,.0f} rows/s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nLoaded {total_rows:,} rows from {len(jobs)} file(s) in {elapsed:.1f}s "
+          f"({total_rows / max(elapsed, 1e-9):,.0f} rows/s, {workers} worker(s))")
+    return total_rows
+
+
+def main():
+    args = sys.argv[1:]
+    workers = None
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    if args and args[0] in ("-h", "--help"):
+        print("Usage: python recipes/load_exports.py [EXPORT.csv ...] [--workers N]")
+        sys.exit(1)
+
+    paths = args or sorted(str(p) for p in EXPORT_DIR.glob("*_export.csv"))
+    if not paths:
+        print(f"No export CSVs found in {EXPORT_DIR}. Run export_csv.py first.")
+        sys.exit(1)
+
+    print(f"Loading {len(paths)} export file(s) into {get_store().path}...")
+    load_exports(paths, workers=workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,121 +4,293 @@ Recipe 3: Poll for Updates
 Monitor companies for new earnings data and fetch updates when detected.
 Useful for building automated pipelines that react to new filings.
 
+Tickers are resolved once (from the local store where possible), status is
+checked in batches of STATUS_BATCH companies, and the companies that changed
+are fetched concurrently, so a cycle over the full coverage universe finishes
+well inside POLL_INTERVAL. All requests share the client's rate limiter.
+
+A changed company pulls only the datapoints created or updated since its
+high-water mark (/companies/fundamental-updates) and upserts them into the
+local store together with the new mark. The first pull for a company fetches
+its latest period in full to seed the mark.
+
+Poll state (the last /companies/status seen per company) lives in the store's
+poll_state table and is committed in the same transaction as the data pulled
+for that status, its detection-latency rows and its rebuild request. A crash
+mid-pull leaves none of them behind: the next cycle sees the status as new and
+pulls again from the last committed mark. A restart resumes instantly. A
+legacy .poll_cache.json is imported on first run.
+
+With --adaptive, continuous polling follows each company's expected release
+window (see recipes/poll_schedule.py) instead of checking everything every
+POLL_INTERVAL: names about to report are checked every minute, quiet ones a
+few times a day, and status checks stay within STATUS_BUDGET requests a minute.
+
+Every new or revised datapoint is journaled as a change event; --stream also
+publishes them to rotating JSONL files and a local Unix socket for downstream
+jobs (see recipes/change_stream.py). --rebuild queues a debounced rebuild of
+each updated ticker's model, projections and charts for infra/rebuild_pipeline.py.
+Detection latency per document is recorded (see recipes/detection_latency.py).
+
 Usage:
     # One-shot check
     python recipes/03_poll_for_updates.py AAPL MSFT GOOG
 
     # Continuous polling (every 15 min)
     python recipes/03_poll_for_updates.py --poll AAPL MSFT GOOG
+
+    # Every company in coverage
+    python recipes/03_poll_for_updates.py --poll --coverage
+
+    # Poll around expected release windows
+    python recipes/03_poll_for_updates.py --poll --adaptive --coverage
+
+    # Publish change events to subscribers
+    python recipes/03_poll_for_updates.py --poll --stream AAPL MSFT GOOG
+
+    # Queue model rebuilds for updated tickers (run infra/rebuild_pipeline.py run)
+    python recipes/03_poll_for_updates.py --poll --rebuild AAPL MSFT GOOG
 """
 
+import asyncio
 import json
 import sys
 import time
 from pathlib import Path
 
-from daloopa_client import get, post
+from change_stream import ChangeStream
+from daloopa_client import RATE_LIMIT, get, get_fundamental_updates, paginate, post, resolve_company
+from datapoint import Datapoint
+from datapoint_meter import metered_job
+from detection_latency import detection_rows
+from fundamentals_store import get_store
+from poll_schedule import HOT_INTERVAL, PollScheduler
 
-CACHE_FILE = Path(__file__).parent / ".poll_cache.json"
+LEGACY_CACHE_FILE = Path(__file__).parent / ".poll_cache.json"
 POLL_INTERVAL = 900  # 15 minutes
+STATUS_BATCH = 200  # company IDs per /companies/status request
+CONCURRENCY = 8  # requests in flight at once (the rate limiter still applies)
+CHECKPOINT_EVERY = 16  # cycles between WAL checkpoints in continuous mode
+STATUS_BUDGET = max(1, RATE_LIMIT // 4)  # /companies/status requests per adaptive tick (one a minute)
 
 
 def check_status(company_ids: list[int]) -> list[dict]:
     """Check the latest update timestamps for a list of companies."""
-    return post("/companies/status", json_body={"companies": company_ids})
-
-
-def search_company(keyword: str) -> dict | None:
-    """Look up a single company by ticker."""
-    results = get("/companies", params={"keyword": keyword})
-    return results[0] if results else None
-
+    return post("/companies/status", json_body={"company_ids": company_ids})
 
-def load_cache() -> dict:
-    """Load last-seen timestamps from disk."""
-    if CACHE_FILE.exists():
-        return json.loads(CACHE_FILE.read_text())
-    return {}
 
-
-def save_cache(cache: dict):
-    """Persist last-seen timestamps to disk."""
-    CACHE_FILE.write_text(json.dumps(cache, indent=2))
-
-
-def get_fundamentals_since(company_id: int, latest_period: str) -> list[dict]:
+def migrate_poll_cache():
+    """Import last-seen timestamps from a legacy .poll_cache.json into the store, once."""
+    if not LEGACY_CACHE_FILE.exists():
+        return
+    try:
+        cache = json.loads(LEGACY_CACHE_FILE.read_text())
+    except ValueError:
+        print(f"  Warning: {LEGACY_CACHE_FILE.name} is corrupt; starting from the store's poll state.")
+        cache = {}
+    store = get_store()
+    known = store.poll_state()
+    store.save_poll_states({int(cid): {"latest_datapoint_created_at": ts}
+                            for cid, ts in cache.items() if int(cid) not in known})
+    LEGACY_CACHE_FILE.rename(LEGACY_CACHE_FILE.with_name(LEGACY_CACHE_FILE.name + ".migrated"))
+    print(f"  Imported poll state for {len(cache)} companies from {LEGACY_CACHE_FILE.name}")
+
+
+def get_fundamentals_since(company_id: int, latest_period: str) -> list[Datapoint]:
     """Fetch the latest period's data for a company."""
     param_tuples = [("company_id", company_id), ("periods", latest_period)]
-    data = get("/companies/fundamentals", params=param_tuples)
-    return data.get("results", []) if isinstance(data, dict) else data
+    data = get("/companies/fundamentals", params=param_tuples, fresh=True)
+    return Datapoint.from_api_list(data.get("results", []) if isinstance(data, dict) else data)
+
+
+def pull_updates(company_id: int, latest_period: str, status: dict | None = None, rebuild: bool = False,
+                 ticker: str | None = None) -> list[Datapoint]:
+    """Pull a company's changes since its high-water mark into the store and advance the mark.
+
+    The rows, the new mark, (if given) the /companies/status entry that
+    triggered the pull, the detection-latency rows and (with `rebuild`) a
+    rebuild request for `ticker` are committed together.
+    """
+    store = get_store()
+    since = store.updates_synced_through(company_id)
+    if since is None:
+        results = get_fundamentals_since(company_id, latest_period)
+    else:
+        results = get_fundamental_updates(company_id, since)
+    mark = max((r.updated_at or r.created_at or "" for r in results), default="")
+    detections = detection_rows(company_id, results, since) if since is not None else []
+    store.upsert_updates(company_id, results, max(mark, since or ""), status, detections, rebuild, ticker)
+    return results
 
 
-def check_once(tickers: list[str]):
-    """Run a single poll cycle."""
-    cache = load_cache()
+async def _bounded(sem: asyncio.Semaphore, fn, *args):
+    async with sem:
+        return await asyncio.to_thread(fn, *args)
+
 
-    # Resolve tickers to company IDs
+async def resolve_companies(tickers: list[str]) -> dict[int, dict]:
+    """Resolve tickers concurrently to {company_id: company}."""
+    sem = asyncio.Semaphore(CONCURRENCY)
+    found = await asyncio.gather(*(_bounded(sem, resolve_company, t) for t in tickers))
     companies = {}
-    for t in tickers:
-        c = search_company(t)
+    for t, c in zip(tickers, found):
         if c:
-            companies[t] = c
+            companies[c["id"]] = c
         else:
             print(f"  Warning: '{t}' not found, skipping.")
+    return companies
 
-    if not companies:
-        return
 
-    company_ids = [c["id"] for c in companies.values()]
-    statuses = check_status(company_ids)
+def list_coverage() -> dict[int, dict]:
+    """Every company in coverage as {company_id: company}."""
+    store = get_store()
+    companies = {}
+    for c in paginate("/companies"):
+        store.upsert_company(c)
+        companies[c["id"]] = c
+    return companies
 
-    updates_found = False
-    for status in statuses:
-        cid = status["company_id"]
-        ticker = next((t for t, c in companies.items() if c["id"] == cid), f"ID:{cid}")
-        last_ts = status.get("latest_datapoint_created_at", "")
-        cached_ts = cache.get(str(cid), "")
 
-        if last_ts != cached_ts:
-            updates_found = True
-            print(f"  NEW DATA for {ticker}: period={status['latest_period']}, updated={last_ts}")
+async def check_statuses(company_ids: list[int]) -> list[dict]:
+    """/companies/status for any number of companies, in concurrent STATUS_BATCH chunks."""
+    sem = asyncio.Semaphore(CONCURRENCY)
+    chunks = [company_ids[i:i + STATUS_BATCH] for i in range(0, len(company_ids), STATUS_BATCH)]
+    results = await asyncio.gather(*(_bounded(sem, check_status, chunk) for chunk in chunks))
+    return [status for chunk in results for status in chunk]
+
+
+async def check_once_async(companies: dict[int, dict], rebuild: bool = False) -> list[int]:
+    """Run a single poll cycle over already-resolved companies. Returns the IDs with new data."""
+    store = get_store()
+    seen = await asyncio.to_thread(store.poll_state)
+    statuses = await check_statuses(list(companies))
+    changed = [s for s in statuses
+               if (s.get("latest_datapoint_created_at") or "")
+               != (seen.get(s["company_id"], {}).get("latest_datapoint_created_at") or "")]
+    print(f"  {len(changed)} of {len(statuses)} companies have new data.")
+
+    sem = asyncio.Semaphore(CONCURRENCY)
 
-            # Fetch the new data
-            results = get_fundamentals_since(cid, status["latest_period"])
-            print(f"    Retrieved {len(results)} datapoints for {status['latest_period']}")
+    async def fetch(status):
+        cid = status["company_id"]
+        results = await _bounded(sem, pull_updates, cid, status["latest_period"], status, rebuild,
+                                 companies.get(cid, {}).get("ticker"))
+        return status, results
+
+    tasks = [asyncio.ensure_future(fetch(s)) for s in changed]
+    pulled = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                status, results = await next_done
+            except Exception as e:
+                print(f"  Fetch failed: {e}")
+                continue
+            cid = status["company_id"]
+            if results:
+                pulled.append(cid)
+            ticker = companies.get(cid, {}).get("ticker") or f"ID:{cid}"
+            print(f"  NEW DATA for {ticker}: period={status['latest_period']}, "
+                  f"updated={status.get('latest_datapoint_created_at')}")
+            print(f"    Retrieved {len(results)} new or changed datapoints")
             for r in results[:5]:
-                print(f"      {r['label']}: {r['value_raw']:,.2f} {r['unit']}")
+                value = f"{r['value_raw']:,.2f}" if r.get("value_raw") is not None else "—"
+                print(f"      {r['label']}: {value} {r.get('unit') or ''}")
             if len(results) > 5:
                 print(f"      ... and {len(results) - 5} more")
+    finally:
+        for t in tasks:
+            t.cancel()
+    return pulled
 
-            cache[str(cid)] = last_ts
-        else:
-            print(f"  {ticker}: no changes since last check")
-
-    if not updates_found:
-        print("  No new data detected.")
 
-    save_cache(cache)
+def check_once(tickers: list[str]):
+    """Resolve tickers and run a single poll cycle."""
+    companies = asyncio.run(resolve_companies(tickers))
+    if companies:
+        asyncio.run(check_once_async(companies))
+
+
+def poll_cycle(companies: dict[int, dict], stream: ChangeStream | None = None, rebuild: bool = False) -> list[int]:
+    """One poll cycle as a metered job (quota from DALOOPA_DATAPOINT_QUOTA). Returns the IDs with new data."""
+    with metered_job("poll_for_updates") as meter:
+        pulled = asyncio.run(check_once_async(companies, rebuild))
+    if meter.requests:
+        print(f"  {meter.report()}")
+    if stream and pulled:
+        stream.notify()
+    return pulled
+
+
+def poll_adaptive(companies: dict[int, dict], stream: ChangeStream | None = None, rebuild: bool = False):
+    """Poll continuously, checking each company at the interval of its release-window tier."""
+    scheduler = PollScheduler(list(companies), max_per_tick=STATUS_BUDGET * STATUS_BATCH)
+    print("  Tiers: " + ", ".join(f"{n} {t}" for t, n in scheduler.summary().items()))
+    cycles = 0
+    while True:
+        started = time.monotonic()
+        due = scheduler.due()
+        if due:
+            print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Checking {len(due)} due companies...")
+            pulled = poll_cycle({cid: companies[cid] for cid in due}, stream, rebuild)
+            scheduler.polled(due, pulled)
+            cycles += 1
+            if cycles % CHECKPOINT_EVERY == 0:
+                get_store().checkpoint()
+        elapsed = time.monotonic() - started
+        time.sleep(max(scheduler.wait_time(), HOT_INTERVAL - elapsed))
 
 
 def main():
-    continuous = "--poll" in sys.argv
-    tickers = [a for a in sys.argv[1:] if a != "--poll"]
-
-    if not tickers:
-        print("Usage: python recipes/03_poll_for_updates.py [--poll] TICKER1 [TICKER2 ...]")
+    args = sys.argv[1:]
+    continuous = "--poll" in args
+    coverage = "--coverage" in args
+    adaptive = "--adaptive" in args
+    streaming = "--stream" in args
+    rebuild = "--rebuild" in args
+    tickers = [a for a in args if not a.startswith("--")]
+
+    if not tickers and not coverage:
+        print("Usage: python recipes/03_poll_for_updates.py [--poll [--adaptive] [--stream]] [--rebuild] "
+              "(--coverage | TICKER1 [TICKER2 ...])")
         print("  --poll: continuously check every 15 minutes")
+        print("  --adaptive: with --poll, check around each company's expected release window")
+        print("  --stream: with --poll, publish change events (see recipes/change_stream.py)")
+        print("  --rebuild: queue a model rebuild for each updated ticker (infra/rebuild_pipeline.py)")
+        print("  --coverage: poll every company in coverage")
         sys.exit(1)
 
-    if continuous:
-        print(f"Polling {', '.join(tickers)} every {POLL_INTERVAL // 60} minutes (Ctrl+C to stop)...")
+    migrate_poll_cache()
+    companies = list_coverage() if coverage else asyncio.run(resolve_companies(tickers))
+    if not companies:
+        print("No companies to poll.")
+        sys.exit(1)
+    label = f"{len(companies)} companies" if coverage else ", ".join(tickers)
+
+    stream = None
+    if continuous and streaming:
+        stream = ChangeStream()
+        stream.start()
+
+    if continuous and adaptive:
+        print(f"Polling {label} around expected release windows (Ctrl+C to stop)...")
+        poll_adaptive(companies, stream, rebuild)
+    elif continuous:
+        print(f"Polling {label} every {POLL_INTERVAL // 60} minutes (Ctrl+C to stop)...")
+        cycles = 0
         while True:
+            started = time.monotonic()
             print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Checking...")
-            check_once(tickers)
-            time.sleep(POLL_INTERVAL)
+            poll_cycle(companies, stream, rebuild)
+            cycles += 1
+            if cycles % CHECKPOINT_EVERY == 0:
+                get_store().checkpoint()
+            elapsed = time.monotonic() - started
+            print(f"  Cycle took {elapsed:.1f}s")
+            time.sleep(max(0.0, POLL_INTERVAL - elapsed))
     else:
-        print(f"Checking {', '.join(tickers)} for updates...")
-        check_once(tickers)
+        print(f"Checking {label} for updates...")
+        poll_cycle(companies, rebuild=rebuild)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,205 @@
+"""
+Adaptive poll scheduling around expected release windows.
+
+Most companies report on a steady cadence: each quarter's results appear a
+similar number of days after the quarter closes. The scheduler learns that lag
+per company from the release history already in the local store (the earliest
+document_released_at, or filing_date, seen for each calendar period) and
+predicts when the next unreleased period should land. Each company is then
+checked at the interval of its tier:
+
+    hot      inside the expected window (median lag ± its spread)   HOT_INTERVAL
+    warm     within LEAD_TIME before the window, or overdue          WARM_INTERVAL
+    idle     anywhere else                                           IDLE_INTERVAL
+    unknown  fewer than MIN_HISTORY releases in the store            DEFAULT_INTERVAL
+
+A tick never checks more than `max_per_tick` companies (most overdue first),
+so a busy earnings night cannot push the poller past its share of the rate
+limit. History grows as the poller pulls new data; warm the store with
+recipes/warm_cache.py to give a new install several quarters to learn from.
+
+Usage:
+    from poll_schedule import PollScheduler
+
+    scheduler = PollScheduler(company_ids, max_per_tick=1_000)
+    due = scheduler.due()
+    ...  # check /companies/status for `due`, pull what changed
+    scheduler.polled(due, changed)
+
+    python recipes/poll_schedule.py [TICKER ...]     # expected release windows
+"""
+
+import re
+import statistics
+import sys
+from datetime import datetime, timedelta, timezone
+
+from fundamentals_store import get_store
+
+HOT_INTERVAL = 60
+WARM_INTERVAL = 900
+IDLE_INTERVAL = 6 * 3600
+DEFAULT_INTERVAL = 900
+TIER_INTERVALS = {"hot": HOT_INTERVAL, "warm": WARM_INTERVAL, "idle": IDLE_INTERVAL, "unknown": DEFAULT_INTERVAL}
+
+LEAD_TIME = timedelta(days=7)  # start warming up this long before a window opens
+OVERDUE_LIMIT = timedelta(days=30)  # a release this late is no longer treated as imminent
+MIN_WINDOW = timedelta(days=2)  # half-width floor for companies with very regular timing
+MAX_LAG_DAYS = 180  # later "first releases" are backfills, not the period's own report
+MIN_HISTORY = 2
+
+PERIOD_RE = re.compile(r"^\d{4}Q[1-4]$")
+
+
+def period_end(period: str) -> datetime:
+    """Close of a calendar quarter (midnight UTC after its last day)."""
+    year, q = int(period[:4]), int(period[-1])
+    return datetime(year + (q == 4), 1 if q == 4 else 3 * q + 1, 1, tzinfo=timezone.utc)
+
+
+def next_period(period: str) -> str:
+    year, q = int(period[:4]), int(period[-1])
+    return f"{year + 1}Q1" if q == 4 else f"{year}Q{q + 1}"
+
+
+def _parse(ts: str) -> datetime:
+    if len(ts) == 10:  # filing_date
+        ts += "T00:00:00Z"
+    return datetime.fromisoformat(ts.replace("Z", "+00:00"))
+
+
+def expected_release(history: list[tuple[str, str]], now: datetime | None = None) -> dict | None:
+    """Expected release window of the next unreleased period, from (period, released_at) history.
+
+    Uses the median lag of the same quarter when there are enough samples
+    (Q4 reports usually take longer), otherwise of all quarters. If the store
+    has not seen recent periods, the first window not yet OVERDUE_LIMIT past
+    `now` is returned. None if the history is too short to say anything.
+    """
+    lags: dict[int, list[float]] = {}
+    periods = []
+    for period, released_at in history:
+        if not PERIOD_RE.match(period or ""):
+            continue
+        lag = (_parse(released_at) - period_end(period)).total_seconds() / 86400
+        if 0 <= lag <= MAX_LAG_DAYS:
+            lags.setdefault(int(period[-1]), []).append(lag)
+            periods.append(period)
+    all_lags = [lag for sample in lags.values() for lag in sample]
+    if len(all_lags) < MIN_HISTORY:
+        return None
+
+    now = now or datetime.now(timezone.utc)
+    target = next_period(max(periods))
+    while True:
+        sample = lags.get(int(target[-1]), [])
+        if len(sample) < MIN_HISTORY:
+            sample = all_lags
+        mid = statistics.median(sample)
+        spread = statistics.median(abs(lag - mid) for lag in sample)
+        half = max(MIN_WINDOW, timedelta(days=2 * spread))
+        expected = period_end(target) + timedelta(days=mid)
+        if expected + half + OVERDUE_LIMIT >= now:
+            return {"period": target, "expected": expected, "start": expected - half, "end": expected + half}
+        target = next_period(target)
+
+
+def tier(window: dict | None, now: datetime) -> str:
+    """Polling tier for a company with the given expected window at time `now`."""
+    if window is None:
+        return "unknown"
+    if window["start"] <= now <= window["end"]:
+        return "hot"
+    if window["start"] - LEAD_TIME <= now < window["start"] or window["end"] < now <= window["end"] + OVERDUE_LIMIT:
+        return "warm"
+    return "idle"
+
+
+class PollScheduler:
+    """Which companies are due for a status check, and when the next one is."""
+
+    def __init__(self, company_ids: list[int], max_per_tick: int | None = None):
+        self.store = get_store()
+        self.max_per_tick = max_per_tick
+        self.windows: dict[int, dict | None] = {}
+        now = datetime.now(timezone.utc)
+        self.next_due = {cid: now for cid in company_ids}
+        self.learn(company_ids)
+
+    def learn(self, company_ids: list[int]):
+        """(Re)compute expected windows from the store's release history."""
+        history = self.store.release_history(list(company_ids))
+        for cid in company_ids:
+            self.windows[cid] = expected_release(history.get(cid, []))
+
+    def tier(self, company_id: int, now: datetime | None = None) -> str:
+        return tier(self.windows.get(company_id), now or datetime.now(timezone.utc))
+
+    def due(self, now: datetime | None = None) -> list[int]:
+        """Companies whose next check is due, most overdue first, capped at max_per_tick."""
+        now = now or datetime.now(timezone.utc)
+        due = sorted((t, cid) for cid, t in self.next_due.items() if t <= now)
+        return [cid for _, cid in due[:self.max_per_tick]]
+
+    def polled(self, company_ids: list[int], changed: list[int] = (), now: datetime | None = None):
+        """Reschedule checked companies.
+
+        Windows are re-learned first for companies with new data, and for those
+        whose expected release never came (so they roll on to the next period).
+        """
+        now = now or datetime.now(timezone.utc)
+        lapsed = [cid for cid in company_ids
+                  if self.windows.get(cid) and now > self.windows[cid]["end"] + OVERDUE_LIMIT]
+        if changed or lapsed:
+            self.learn(list(changed) + lapsed)
+        for cid in company_ids:
+            self.next_due[cid] = now + timedelta(seconds=TIER_INTERVALS[self.tier(cid, now)])
+
+    def wait_time(self, now: datetime | None = None) -> float:
+        """Seconds until the next company is due."""
+        now = now or datetime.now(timezone.utc)
+        return max(0.0, (min(self.next_due.values()) - now).total_seconds()) if self.next_due else 0.0
+
+    def summary(self, now: datetime | None = None) -> dict[str, int]:
+        """Number of companies in each tier."""
+        counts = dict.fromkeys(TIER_INTERVALS, 0)
+        for cid in self.next_due:
+            counts[self.tier(cid, now)] += 1
+        return counts
+
+
+def main():
+    store = get_store()
+    company_ids = None
+    if sys.argv[1:]:
+        company_ids = []
+        for t in sys.argv[1:]:
+            c = store.find_company(t)
+            if c:
+                company_ids.append(c["id"])
+            else:
+                print(f"  Warning: '{t}' is not in the local store, skipping.")
+        if not company_ids:
+            sys.exit(1)
+
+    history = store.release_history(company_ids)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for cid in company_ids or sorted(history):
+        window = expected_release(history.get(cid, []))
+        rows.append((cid, window, tier(window, now)))
+    rows.sort(key=lambda r: (r[1] is None, r[1]["start"] if r[1] else now))
+
+    print(f"{'Ticker':<8} {'Period':<8} {'Expected':<12} {'Window':<25} {'Tier':<8}")
+    print("-" * 64)
+    for cid, window, t in rows:
+        ticker = (store.company(cid) or {}).get("ticker") or cid
+        if window:
+            span = f"{window['start']:%Y-%m-%d} .. {window['end']:%Y-%m-%d}"
+            print(f"{ticker:<8} {window['period']:<8} {window['expected']:%Y-%m-%d}   {span:<25} {t:<8}")
+        else:
+            print(f"{ticker:<8} {'—':<8} {'—':<12} {'not enough history':<25} {t:<8}")
+
+
+if __name__ == "__main__":
+    main()
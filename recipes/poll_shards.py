@@ -0,0 +1,278 @@
+"""
+Sharded polling across processes.
+
+One poller process is bound by a single core for status parsing, upserts and
+journaling once the coverage universe gets large. This runs N poller
+processes instead, each owning a shard of the companies:
+
+  * companies are assigned to shards on a consistent-hash ring (VNODES points
+    per shard), so changing the shard count moves only ~1/N of them;
+  * each shard is a lease: an exclusive flock on reports/.poll/shard-K.lock.
+    A worker holds its home shard's lease for as long as it lives, and the
+    kernel drops the lock the moment the process dies;
+  * at the start of every cycle a worker also tries the other shards' leases.
+    Any it gets belonged to a dead worker, so it polls those companies too for
+    that cycle and then lets the lease go, handing the shard back as soon as
+    its owner is restarted. Poll state, detection rows and rebuild requests
+    are committed with the pulled data (see recipes/poll_for_updates.py), so
+    a worker that dies mid-pull leaves nothing half-applied and the taker
+    pulls again from the last committed mark, repeating only the API requests
+    of the pull that was cut short;
+  * all workers draw from one host-wide rate limiter (daloopa_client's
+    SharedRateLimiter), so N shards together stay within DALOOPA_RATE_LIMIT.
+
+The supervisor starts the N workers and restarts any that exit. Leases rely on
+flock, so the store and reports/.poll must be on a local filesystem, and all
+shards must run on the same host. Run change_stream.py serve separately to
+publish change events; it tails the journal every shard writes to.
+
+Usage:
+    python recipes/poll_shards.py --shards 4 --coverage
+    python recipes/poll_shards.py --shards 4 --rebuild AAPL MSFT GOOG NVDA
+    python recipes/poll_shards.py --shard 2/4 --coverage     # one worker, e.g. under systemd
+    python recipes/poll_shards.py --status
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from daloopa_client import SHARED_RATE_LIMIT
+from fundamentals_store import get_store, utcnow
+from poll_for_updates import (
+    CHECKPOINT_EVERY, POLL_INTERVAL, list_coverage, migrate_poll_cache, poll_cycle, resolve_companies,
+)
+
+LEASE_DIR = Path(__file__).resolve().parent.parent / "reports" / ".poll"
+VNODES = 64  # ring points per shard
+SUPERVISE_INTERVAL = 5  # seconds between worker liveness checks
+RESTART_BACKOFF = 30  # seconds before restarting a worker that just died again
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping company IDs to shards 0..shards-1."""
+
+    def __init__(self, shards: int, vnodes: int = VNODES):
+        points = sorted((_hash(f"shard-{s}-{v}"), s) for s in range(shards) for v in range(vnodes))
+        self.keys = [p for p, _ in points]
+        self.shards = [s for _, s in points]
+
+    def owner(self, company_id: int) -> int:
+        i = bisect.bisect(self.keys, _hash(str(company_id)))
+        return self.shards[i % len(self.shards)]
+
+    def partition(self, companies: dict[int, dict]) -> dict[int, dict[int, dict]]:
+        """{shard: {company_id: company}} for every shard with at least one company."""
+        parts: dict[int, dict[int, dict]] = {}
+        for cid, c in companies.items():
+            parts.setdefault(self.owner(cid), {})[cid] = c
+        return parts
+
+
+class ShardLease:
+    """Exclusive lease on one shard, held through a non-blocking flock on its lock file."""
+
+    def __init__(self, shard: int, directory: str | Path = LEASE_DIR):
+        self.shard = shard
+        self.path = Path(directory) / f"shard-{shard}.lock"
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Take the lease if no live process holds it. True if this process holds it now."""
+        if self._fd is not None:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps({"pid": os.getpid(), "acquired_at": utcnow()}).encode(), 0)
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.ftruncate(self._fd, 0)  # still under the flock, so a free lease never names a pid
+            os.close(self._fd)  # drops the flock
+            self._fd = None
+
+    def holder(self) -> dict | None:
+        """{"pid", "acquired_at"} of the live holder, or None if the lease is free.
+
+        Only reads the lock file: probing with flock, even briefly, could make a worker
+        starting on this shard find its own lease taken.
+        """
+        try:
+            info = json.loads(self.path.read_text() or "{}")
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return {}
+        pid = info.get("pid")
+        if not isinstance(pid, int):
+            return None
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return None  # died without releasing; the kernel already dropped its flock
+        except PermissionError:
+            pass  # alive, owned by another user
+        return info
+
+
+def run_worker(shard: int, count: int, companies: dict[int, dict], rebuild: bool = False):
+    """Poll the home shard every POLL_INTERVAL, plus any shard whose worker is dead."""
+    parts = HashRing(count).partition(companies)
+    leases = [ShardLease(s) for s in range(count)]
+    print(f"Shard {shard}/{count}: {len(parts.get(shard, {}))} of {len(companies)} companies "
+          f"(pid {os.getpid()})")
+    cycles = 0
+    while True:
+        started = time.monotonic()
+        held = [s for s in range(count) if leases[s].acquire()]
+        if shard not in held:
+            print(f"  Shard {shard} is still held by {leases[shard].holder()}; will retry")
+        taken = [s for s in held if s != shard]
+        targets = {cid: c for s in held for cid, c in parts.get(s, {}).items()}
+        try:
+            if targets:
+                note = f" (taking over shard {', '.join(map(str, taken))})" if taken else ""
+                print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] Shard {shard}: checking {len(targets)} "
+                      f"companies{note}...")
+                poll_cycle(targets, rebuild=rebuild)
+        finally:
+            for s in taken:
+                leases[s].release()
+        cycles += 1
+        if cycles % CHECKPOINT_EVERY == 0:
+            get_store().checkpoint()
+        elapsed = time.monotonic() - started
+        print(f"  Shard {shard} cycle took {elapsed:.1f}s")
+        time.sleep(max(0.0, POLL_INTERVAL - elapsed))
+
+
+def supervise(count: int, worker_args: list[str]):
+    """Run `count` shard workers, restarting any that exit, until interrupted."""
+    procs: dict[int, subprocess.Popen] = {}
+    exited: dict[int, float] = {}
+    try:
+        while True:
+            now = time.monotonic()
+            for s in range(count):
+                proc = procs.get(s)
+                if proc is not None and proc.poll() is None:
+                    continue
+                if proc is not None:
+                    print(f"  Shard {s} worker (pid {proc.pid}) exited with {proc.returncode}; restarting")
+                    procs.pop(s)
+                    exited[s] = now
+                if now - exited.get(s, -RESTART_BACKOFF) < RESTART_BACKOFF:
+                    continue  # its shard is being taken over meanwhile
+                procs[s] = subprocess.Popen([sys.executable, __file__, "--shard", f"{s}/{count}", *worker_args])
+            time.sleep(SUPERVISE_INTERVAL)
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            proc.wait()
+
+
+def status():
+    locks = sorted(LEASE_DIR.glob("shard-*.lock"), key=lambda p: int(p.stem.split("-")[1]))
+    if not locks:
+        print(f"No shard leases in {LEASE_DIR}.")
+        return
+    print(f"{'Shard':<7} {'State':<6} {'PID':>8}  Acquired")
+    print("-" * 50)
+    for path in locks:
+        shard = int(path.stem.split("-")[1])
+        holder = ShardLease(shard).holder()
+        state = "held" if holder is not None else "free"
+        holder = holder or {}
+        print(f"{shard:<7} {state:<6} {holder.get('pid', '—'):>8}  {holder.get('acquired_at', '—')}")
+
+
+def _usage():
+    print("Usage: python recipes/poll_shards.py (--shards N | --shard K/N) [--rebuild] (--coverage | TICKER ...)")
+    print("       python recipes/poll_shards.py --status")
+    print("  --shards N: supervise N worker processes, restarting any that exit")
+    print("  --shard K/N: run worker K of N in this process")
+    print("  --rebuild: queue a model rebuild for each updated ticker (infra/rebuild_pipeline.py)")
+    print("  --coverage: poll every company in coverage")
+    sys.exit(1)
+
+
+def main():
+    args = sys.argv[1:]
+    if fcntl is None:
+        print("Sharded polling needs flock (not available on this platform); use poll_for_updates.py --poll.")
+        sys.exit(1)
+    if "--status" in args:
+        status()
+        return
+
+    count = shard = None
+    try:
+        if "--shards" in args:
+            i = args.index("--shards")
+            count = int(args[i + 1])
+            del args[i:i + 2]
+        elif "--shard" in args:
+            i = args.index("--shard")
+            shard, count = map(int, args[i + 1].split("/"))
+            del args[i:i + 2]
+    except (IndexError, ValueError):
+        _usage()
+    coverage = "--coverage" in args
+    rebuild = "--rebuild" in args
+    tickers = [a for a in args if not a.startswith("--")]
+    if not count or count < 1 or (shard is not None and not 0 <= shard < count) or not (tickers or coverage):
+        _usage()
+    if any(a.startswith("--") and a not in ("--coverage", "--rebuild") for a in args):
+        _usage()
+    if not SHARED_RATE_LIMIT:
+        print("  Warning: DALOOPA_SHARED_RATE_LIMIT=0; each shard gets the full rate limit.")
+
+    if shard is None:
+        migrate_poll_cache()
+        print(f"Supervising {count} shard workers every {POLL_INTERVAL // 60} minutes (Ctrl+C to stop)...")
+        try:
+            supervise(count, args)
+        except KeyboardInterrupt:
+            print("\nStopped.")
+        return
+
+    companies = list_coverage() if coverage else asyncio.run(resolve_companies(tickers))
+    if not companies:
+        print("No companies to poll.")
+        sys.exit(1)
+    try:
+        run_worker(shard, count, companies, rebuild)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Recipe 14: Restatements Across Coverage
+=========================================
+List the datapoints whose reported value changed, or whose restated flag
+flipped, since a given date. Answered from the local store's restatement
+index, which is maintained as fundamentals are fetched, so no context JSON has
+to be re-diffed and no API calls are made.
+
+Usage:
+    # Everything restated in the last 7 days
+    python recipes/restatements.py
+
+    # Since a date, for some tickers
+    python recipes/restatements.py --since 2025-02-01 AAPL MSFT
+    python recipes/restatements.py --days 30
+"""
+
+import sys
+from datetime import datetime, timedelta, timezone
+
+from fundamentals_store import get_store
+
+DEFAULT_DAYS = 7
+
+
+def restated_since(since: str, tickers: list[str] | None = None) -> list[dict]:
+    """Restatements detected since a date/timestamp, optionally for some tickers only."""
+    store = get_store()
+    company_ids = None
+    if tickers:
+        company_ids = []
+        for t in tickers:
+            c = store.find_company(t)
+            if c:
+                company_ids.append(c["id"])
+            else:
+                print(f"  Warning: '{t}' is not in the local store, skipping.")
+        if not company_ids:
+            return []
+    return store.restated_since(since, company_ids)
+
+
+def _fmt(v) -> str:
+    return f"{v:,.2f}" if v is not None else "—"
+
+
+def main():
+    args = sys.argv[1:]
+    since = None
+    days = DEFAULT_DAYS
+    if "--since" in args:
+        i = args.index("--since")
+        since = args[i + 1]
+        del args[i:i + 2]
+    if "--days" in args:
+        i = args.index("--days")
+        days = int(args[i + 1])
+        del args[i:i + 2]
+    if any(a.startswith("--") for a in args):
+        print("Usage: python recipes/restatements.py [--since YYYY-MM-DD | --days N] [TICKER ...]")
+        sys.exit(1)
+    since = since or (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    rows = restated_since(since, args or None)
+    if not rows:
+        print(f"No restatements detected since {since}.")
+        return
+
+    print(f"\n{len(rows)} restated datapoints detected since {since}\n")
+    print(f"{'Ticker':<8} {'Series':<48} {'Period':<8} {'Old':>14} {'New':>14} {'Flag':<6} {'Detected':<10}")
+    print("-" * 114)
+    for r in rows:
+        name = (r["full_series_name"] or str(r["series_id"]))[-47:]
+        flag = "R" if r["new_restated"] else ""
+        print(f"{(r['ticker'] or r['company_id']):<8} {name:<48} {r['period']:<8} {_fmt(r['old_value']):>14} "
+              f"{_fmt(r['new_value']):>14} {flag:<6} {r['detected_at'][:10]:<10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+"""
+Compressed time-series archive of the local store
+==================================================
+Packs every datapoint value in the store into a compact columnar file that
+loads straight into NumPy arrays, for report hosts that want the whole
+universe's history in RAM without going through SQLite or JSON.
+
+Layout: a small series index (company, series, period kind, first period,
+count) followed by three streams cut into frames of FRAME_SIZE points:
+
+    gaps              quarters skipped between consecutive points of a series
+                      (delta-of-delta against the regular cadence, so a
+                      gap-free history is all zeros and packs to 0 bits)
+    value_raw         float values, each frame encoded with whichever is
+    value_normalized  smaller of:
+                        xor  Gorilla-style: XOR with the previous value, the
+                             common trailing zero bits dropped
+                        dod  values that are exact decimals (x * 10^k is an
+                             integer) as zigzag delta-of-deltas of the integers
+
+Every frame is bit-packed at a fixed width, so decoding needs no bit-level
+loops: frames of equal shape are unpacked together and rebuilt with
+np.bitwise_xor.accumulate / np.cumsum along the frame axis.
+
+Usage:
+    python recipes/series_codec.py pack                  # store -> reports/.store/series.dlz
+    python recipes/series_codec.py pack --tickers AAPL MSFT --out aapl_msft.dlz
+    python recipes/series_codec.py info
+    python recipes/series_codec.py selftest
+
+    from series_codec import load_archive
+    arc = load_archive()
+    periods, values = arc.series(company_id, series_id)
+"""
+
+import argparse
+import struct
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from fundamentals_store import STORE_PATH, get_store
+
+ARCHIVE_PATH = STORE_PATH.parent / "series.dlz"
+MAGIC = b"DLPZ"
+FORMAT_VERSION = 2  # 1 truncated raw/dod frames whose values shared trailing zero bits
+FRAME_SIZE = 1024  # a multiple of 8, so full frames are byte-aligned at any width
+MAX_DECIMALS = 6
+
+KIND_QUARTER, KIND_YEAR = 0, 1
+
+CODEC_RAW, CODEC_XOR, CODEC_DOD = 0, 1, 2
+
+INDEX_DTYPE = np.dtype([
+    ("company_id", "<i8"), ("series_id", "<i8"), ("kind", "u1"), ("start", "<i4"), ("count", "<u4"),
+])
+FRAME_DTYPE = np.dtype([
+    ("codec", "u1"), ("param", "u1"), ("width", "u1"), ("n", "<u4"),
+    ("base", "<u8"), ("delta", "<i8"), ("offset", "<u8"),
+])
+
+_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+# ---------------------------------------------------------------------------
+# Periods
+# ---------------------------------------------------------------------------
+
+def period_ordinal(period: str) -> tuple[int, int] | None:
+    """'2024Q3' -> (KIND_QUARTER, 2024*4+2); '2024FY' -> (KIND_YEAR, 2024); else None."""
+    if len(period) == 6 and period[:4].isdigit():
+        if period[4] == "Q" and period[5] in "1234":
+            return KIND_QUARTER, int(period[:4]) * 4 + int(period[5]) - 1
+        if period[4:] == "FY":
+            return KIND_YEAR, int(period[:4])
+    return None
+
+
+def ordinal_period(kind: int, ordinal: int) -> str:
+    if kind == KIND_YEAR:
+        return f"{ordinal}FY"
+    return f"{ordinal // 4}Q{ordinal % 4 + 1}"
+
+
+# ---------------------------------------------------------------------------
+# Bit packing
+# ---------------------------------------------------------------------------
+
+def _pack(values: np.ndarray, width: int) -> bytes:
+    """Pack uint64 values at a fixed bit width (little-endian bit order)."""
+    if width == 0 or len(values) == 0:
+        return b""
+    bits = ((values[:, None] >> _SHIFTS[:width]) & np.uint64(1)).astype(np.uint8)
+    return np.packbits(bits.ravel(), bitorder="little").tobytes()
+
+
+def _unpack(buf: np.ndarray, n: int, width: int) -> np.ndarray:
+    """Inverse of _pack for a (frames, nbytes) block of equal-shape frames -> (frames, n) uint64.
+
+    Each value is read from the (at most two) 64-bit words it straddles.
+    """
+    frames = buf.shape[0]
+    if width == 0 or n == 0:
+        return np.zeros((frames, n), dtype=np.uint64)
+    nwords = buf.shape[1] // 8 + 2
+    padded = np.zeros((frames, nwords * 8), dtype=np.uint8)
+    padded[:, :buf.shape[1]] = buf
+    words = padded.view("<u8")
+    bit = np.arange(n, dtype=np.uint64) * np.uint64(width)
+    word = (bit >> np.uint64(6)).astype(np.intp)
+    off = bit & np.uint64(63)
+    # the high part is shifted in two steps so off == 0 shifts it out entirely
+    values = (words[:, word] >> off) | ((words[:, word + 1] << np.uint64(1)) << (np.uint64(63) - off))
+    if width < 64:
+        values &= np.uint64((1 << width) - 1)
+    return values
+
+
+def _width(values: np.ndarray) -> tuple[int, int]:
+    """(trailing zero bits shared by all values, bit width after dropping them)."""
+    if len(values) == 0:
+        return 0, 0
+    combined = int(np.bitwise_or.reduce(values))
+    if combined == 0:
+        return 0, 0
+    shift = (combined & -combined).bit_length() - 1
+    return shift, (combined >> shift).bit_length()
+
+
+def _zigzag(d: np.ndarray) -> np.ndarray:
+    return ((d << 1) ^ (d >> 63)).view(np.uint64)
+
+
+def _unzigzag(z: np.ndarray) -> np.ndarray:
+    return (z >> np.uint64(1)).view(np.int64) ^ -(z & np.uint64(1)).view(np.int64)
+
+
+# ---------------------------------------------------------------------------
+# Frame encoders
+# ---------------------------------------------------------------------------
+
+def _encode_raw(values: np.ndarray):
+    shift, width = _width(values)
+    return (CODEC_RAW, shift, width, len(values), 0, 0), _pack(values >> np.uint64(shift), width)
+
+
+def _encode_xor(values: np.ndarray):
+    bits = values.view(np.uint64)
+    xored = bits[1:] ^ bits[:-1]
+    shift, width = _width(xored)
+    return (CODEC_XOR, shift, width, len(values), int(bits[0]), 0), _pack(xored >> np.uint64(shift), width)
+
+
+def _encode_dod(values: np.ndarray):
+    """Delta-of-delta over values scaled to integers, or None if they are not short decimals."""
+    if len(values) < 2 or not np.all(np.isfinite(values)):
+        return None
+    if np.any(np.signbit(values) & (values == 0)):
+        return None  # -0.0 would come back as 0.0
+    for k in range(MAX_DECIMALS + 1):
+        scaled = np.round(values * 10.0 ** k)
+        if np.abs(scaled).max() >= 2 ** 53:
+            return None
+        if np.array_equal(scaled / 10.0 ** k, values):
+            break
+    else:
+        return None
+    ints = scaled.astype(np.int64)
+    deltas = np.diff(ints)
+    dod = _zigzag(np.diff(deltas))
+    shift, width = _width(dod)
+    width += shift  # param holds the decimals, so trailing zeros are packed rather than dropped
+    header = (CODEC_DOD, k, width, len(values), int(ints[0]) & 0xFFFFFFFFFFFFFFFF, int(deltas[0]))
+    return header, _pack(dod, width)
+
+
+def encode_stream(values: np.ndarray, floats: bool = True, frame_size: int = FRAME_SIZE):
+    """Encode a stream into (frame headers, payload bytes)."""
+    headers, chunks, offset = [], [], 0
+    for start in range(0, len(values), frame_size):
+        frame = values[start:start + frame_size]
+        if floats:
+            candidates = [_encode_xor(frame), _encode_dod(frame)]
+            header, payload = min((c for c in candidates if c), key=lambda c: len(c[1]))
+        else:
+            header, payload = _encode_raw(frame)
+        headers.append(header + (offset,))
+        chunks.append(payload)
+        offset += len(payload)
+    return np.array(headers, dtype=FRAME_DTYPE), b"".join(chunks)
+
+
+def decode_stream(frames: np.ndarray, payload: np.ndarray, total: int, floats: bool = True) -> np.ndarray:
+    """Decode a stream; frames of equal (codec, width, n) are decoded together."""
+    out = np.empty(total, dtype=np.float64 if floats else np.uint64)
+    if not len(frames):
+        return out
+    sizes = frames["n"].astype(np.int64)
+    starts = np.cumsum(sizes) - sizes
+    keys = np.stack([frames["codec"], frames["width"], frames["n"]], axis=1)
+    groups, inverse = np.unique(keys, axis=0, return_inverse=True)
+    for g, (codec, width, n) in enumerate(groups):
+        idx = np.flatnonzero(inverse.ravel() == g)
+        codec, width, n = int(codec), int(width), int(n)
+        packed = n - 1 if codec == CODEC_XOR else n - 2 if codec == CODEC_DOD else n
+        nbytes = (packed * width + 7) // 8
+        block = payload[frames["offset"][idx][:, None].astype(np.int64) + np.arange(nbytes)]
+        vals = _unpack(block, packed, width)
+        f = frames[idx]
+        if codec == CODEC_XOR:
+            vals = vals << f["param"].astype(np.uint64)[:, None]
+            full = np.concatenate([f["base"][:, None], vals], axis=1)
+            decoded = np.bitwise_xor.accumulate(full, axis=1).view(np.float64)
+        elif codec == CODEC_DOD:
+            deltas = np.concatenate([f["delta"][:, None], _unzigzag(vals)], axis=1).cumsum(axis=1)
+            ints = np.concatenate([np.zeros((len(idx), 1), dtype=np.int64), deltas], axis=1).cumsum(axis=1)
+            ints += f["base"].view(np.int64)[:, None]
+            decoded = ints / (10.0 ** f["param"].astype(np.float64))[:, None]
+        else:
+            decoded = vals << f["param"].astype(np.uint64)[:, None]
+        out[starts[idx][:, None] + np.arange(n)] = decoded
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Archive
+# ---------------------------------------------------------------------------
+
+class SeriesArchive:
+    """A decoded archive: the series index plus flat per-point arrays.
+
+    Points are ordered by (company_id, series_id, kind, period); series i owns
+    points offsets[i] : offsets[i] + index["count"][i].
+    """
+
+    def __init__(self, index: np.ndarray, ordinals: np.ndarray, value_raw: np.ndarray,
+                 value_normalized: np.ndarray):
+        self.index = index
+        self.ordinals = ordinals
+        self.value_raw = value_raw
+        self.value_normalized = value_normalized
+        counts = index["count"].astype(np.int64)
+        self.offsets = np.cumsum(counts) - counts
+        self._lookup = {(int(c), int(s), int(k)): i for i, (c, s, k) in
+                        enumerate(zip(index["company_id"], index["series_id"], index["kind"]))}
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + self.ordinals.nbytes + self.value_raw.nbytes + self.value_normalized.nbytes
+
+    def series(self, company_id: int, series_id: int, kind: int = KIND_QUARTER,
+               field: str = "value_raw") -> tuple[list[str], np.ndarray]:
+        """(period labels, values) for one series; empty if it is not in the archive."""
+        i = self._lookup.get((company_id, series_id, kind))
+        if i is None:
+            return [], np.empty(0)
+        lo, hi = self.offsets[i], self.offsets[i] + self.index["count"][i]
+        periods = [ordinal_period(kind, int(o)) for o in self.ordinals[lo:hi]]
+        return periods, getattr(self, field)[lo:hi]
+
+
+def _collect(company_ids: list[int] | None):
+    """Read the store into sorted flat arrays (company, series, kind, ordinal, raw, normalized)."""
+    cols = {k: [] for k in ("company_id", "series_id", "kind", "ordinal", "value_raw", "value_normalized")}
+    skipped = 0
+    store = get_store()
+    for chunk in store.iter_rows(["company_id", "series_id", "period", "value_raw", "value_normalized"],
+                                 company_ids=company_ids):
+        for company_id, series_id, period, raw, norm in chunk:
+            parsed = period_ordinal(period or "")
+            if parsed is None:
+                skipped += 1
+                continue
+            cols["company_id"].append(company_id)
+            cols["series_id"].append(series_id)
+            cols["kind"].append(parsed[0])
+            cols["ordinal"].append(parsed[1])
+            cols["value_raw"].append(np.nan if raw is None else raw)
+            cols["value_normalized"].append(np.nan if norm is None else norm)
+    arrays = {
+        "company_id": np.array(cols["company_id"], dtype=np.int64),
+        "series_id": np.array(cols["series_id"], dtype=np.int64),
+        "kind": np.array(cols["kind"], dtype=np.uint8),
+        "ordinal": np.array(cols["ordinal"], dtype=np.int64),
+        "value_raw": np.array(cols["value_raw"], dtype=np.float64),
+        "value_normalized": np.array(cols["value_normalized"], dtype=np.float64),
+    }
+    order = np.lexsort((arrays["ordinal"], arrays["kind"], arrays["series_id"], arrays["company_id"]))
+    return {k: v[order] for k, v in arrays.items()}, skipped
+
+
+def _fill_nulls(values: np.ndarray) -> tuple[np.ndarray, bytes]:
+    """Replace NaNs with the previous value (so they encode as zero change) and return the null bitmap."""
+    nulls = np.isnan(values)
+    if not nulls.any():
+        return values, b""
+    idx = np.where(nulls, 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    filled = values[idx]
+    filled[np.isnan(filled)] = 0.0  # leading NaNs
+    return filled, np.packbits(nulls, bitorder="little").tobytes()
+
+
+def _write_section(f, data: bytes):
+    f.write(struct.pack("<Q", len(data)))
+    f.write(data)
+
+
+def _read_section(buf: memoryview, pos: int) -> tuple[memoryview, int]:
+    (size,) = struct.unpack_from("<Q", buf, pos)
+    pos += 8
+    return buf[pos:pos + size], pos + size
+
+
+def pack_archive(path: Path = ARCHIVE_PATH, company_ids: list[int] | None = None) -> dict:
+    """Encode the store (or some companies) into an archive file. Returns size stats."""
+    cols, skipped = _collect(company_ids)
+    n = len(cols["ordinal"])
+    keys = np.stack([cols["company_id"], cols["series_id"], cols["kind"].astype(np.int64)], axis=1)
+    new_series = np.ones(n, dtype=bool)
+    if n:
+        new_series[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    run_starts = np.flatnonzero(new_series)
+    counts = np.diff(np.append(run_starts, n))
+
+    index = np.empty(len(run_starts), dtype=INDEX_DTYPE)
+    index["company_id"] = cols["company_id"][run_starts]
+    index["series_id"] = cols["series_id"][run_starts]
+    index["kind"] = cols["kind"][run_starts]
+    index["start"] = cols["ordinal"][run_starts]
+    index["count"] = counts
+
+    gaps = np.zeros(n, dtype=np.int64)
+    if n:
+        gaps[1:] = np.diff(cols["ordinal"]) - 1
+    gaps[run_starts] = 0
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<BQQI", FORMAT_VERSION, len(index), n, FRAME_SIZE))
+        _write_section(f, index.tobytes())
+        frames, payload = encode_stream(gaps.astype(np.uint64), floats=False)
+        _write_section(f, frames.tobytes())
+        _write_section(f, payload)
+        for field in ("value_raw", "value_normalized"):
+            values, nulls = _fill_nulls(cols[field])
+            frames, payload = encode_stream(values)
+            _write_section(f, nulls)
+            _write_section(f, frames.tobytes())
+            _write_section(f, payload)
+    tmp.replace(path)
+    return {"series": len(index), "points": n, "skipped": skipped, "bytes": path.stat().st_size}
+
+
+def load_archive(path: Path = ARCHIVE_PATH) -> SeriesArchive:
+    """Read and decode an archive file into a SeriesArchive."""
+    buf = memoryview(Path(path).read_bytes())
+    if bytes(buf[:4]) != MAGIC:
+        raise ValueError(f"{path} is not a series archive")
+    version, _, n, _ = struct.unpack_from("<BQQI", buf, 4)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported archive version {version}")
+    pos = 4 + struct.calcsize("<BQQI")
+    section, pos = _read_section(buf, pos)
+    index = np.frombuffer(section, dtype=INDEX_DTYPE)
+
+    frames, pos = _read_section(buf, pos)
+    payload, pos = _read_section(buf, pos)
+    steps = decode_stream(np.frombuffer(frames, dtype=FRAME_DTYPE),
+                          np.frombuffer(payload, dtype=np.uint8), n, floats=False).astype(np.int64) + 1
+    counts = index["count"].astype(np.int64)
+    offsets = np.cumsum(counts) - counts
+    steps[offsets] = 0
+    cumulative = np.cumsum(steps)
+    ordinals = cumulative - np.repeat(cumulative[offsets], counts) + np.repeat(index["start"].astype(np.int64), counts)
+
+    values = []
+    for _ in ("value_raw", "value_normalized"):
+        nulls, pos = _read_section(buf, pos)
+        frames, pos = _read_section(buf, pos)
+        payload, pos = _read_section(buf, pos)
+        decoded = decode_stream(np.frombuffer(frames, dtype=FRAME_DTYPE), np.frombuffer(payload, dtype=np.uint8), n)
+        if len(nulls):
+            mask = np.unpackbits(np.frombuffer(nulls, dtype=np.uint8), count=n, bitorder="little").astype(bool)
+            decoded[mask] = np.nan
+        values.append(decoded)
+    return SeriesArchive(index, ordinals, values[0], values[1])
+
+
+def roundtrip_failures(seed: int = 0) -> list[str]:
+    """Encode and decode synthetic streams bit for bit. Returns the names of the cases that differ.
+
+    Covers random floats, short decimals (with -0.0 and values whose integer
+    deltas share trailing zero bits), gap streams that are all even, and
+    frames cut short at the end of a stream.
+    """
+    rng = np.random.default_rng(seed)
+    decimals = np.round(rng.normal(0, 1e6, 1500), 2)
+    decimals[::7] = 0.0
+    decimals[3] = -0.0
+    cases = {
+        "random floats": (rng.normal(0, 1e9, 2500), True),
+        "decimals": (decimals, True),
+        "large decimals": (np.array([123456789.123456, 1.0, -5.5] * 400), True),
+        "even steps": (np.arange(0, 4096 * 3, 4096, dtype=np.float64), True),
+        "even gaps": (np.array([0, 0, 4, 0, 0] * 300, dtype=np.uint64), False),
+        "random gaps": (rng.integers(0, 9, 2100).astype(np.uint64), False),
+        "one-point tail": (rng.normal(0, 1, FRAME_SIZE + 1), True),
+    }
+    failures = []
+    for name, (values, floats) in cases.items():
+        for frame_size in (FRAME_SIZE, 64):
+            frames, payload = encode_stream(values, floats, frame_size)
+            decoded = decode_stream(frames, np.frombuffer(payload, dtype=np.uint8), len(values), floats)
+            if floats:
+                same = np.array_equal(decoded.view(np.uint64), values.view(np.uint64))
+            else:
+                same = np.array_equal(decoded, values)
+            if not same:
+                failures.append(f"{name} (frames of {frame_size})")
+    return failures
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def cmd_pack(args):
+    company_ids = None
+    if args.tickers:
+        store = get_store()
+        company_ids = [c["id"] for c in (store.find_company(t) for t in args.tickers) if c]
+        if not company_ids:
+            print("None of the tickers are in the local store.", file=sys.stderr)
+            sys.exit(1)
+    start = time.perf_counter()
+    stats = pack_archive(Path(args.out), company_ids)
+    elapsed = time.perf_counter() - start
+    per_point = stats["bytes"] / stats["points"] if stats["points"] else 0
+    print(f"Packed {stats['points']:,} datapoints in {stats['series']:,} series to {args.out}")
+    print(f"  {stats['bytes'] / 2**20:.1f} MB ({per_point:.1f} bytes/datapoint) in {elapsed:.1f}s"
+          + (f"; {stats['skipped']:,} rows with non-quarterly/annual periods skipped" if stats["skipped"] else ""))
+
+
+def cmd_info(args):
+    start = time.perf_counter()
+    archive = load_archive(Path(args.path))
+    elapsed = time.perf_counter() - start
+    size = Path(args.path).stat().st_size
+    print(f"{args.path}: {len(archive.index):,} series, {len(archive):,} datapoints, "
+          f"{len(np.unique(archive.index['company_id'])):,} companies")
+    print(f"  on disk {size / 2**20:.1f} MB, in memory {archive.nbytes / 2**20:.1f} MB, decoded in {elapsed:.2f}s")
+
+
+def cmd_selftest(args):
+    failures = roundtrip_failures()
+    if failures:
+        print("Round-trip mismatches: " + ", ".join(failures), file=sys.stderr)
+        sys.exit(1)
+    print("All codec round-trips are exact.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compressed time-series archive of the local store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Encode the store into an archive")
+    pack_parser.add_argument("--out", default=str(ARCHIVE_PATH), help=f"Output file (default: {ARCHIVE_PATH})")
+    pack_parser.add_argument("--tickers", nargs="+", help="Only these companies")
+    pack_parser.set_defaults(func=cmd_pack)
+
+    info_parser = subparsers.add_parser("info", help="Decode an archive and print its size and load time")
+    info_parser.add_argument("path", nargs="?", default=str(ARCHIVE_PATH))
+    info_parser.set_defaults(func=cmd_info)
+
+    selftest_parser = subparsers.add_parser("selftest", help="Check that synthetic streams round-trip exactly")
+    selftest_parser.set_defaults(func=cmd_selftest)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
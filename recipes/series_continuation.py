@@ -5,6 +5,12 @@ Series IDs can change over time when Daloopa restructures a company's model.
 This recipe checks for deprecated series and their replacements so you can
 keep your cached series IDs up to date.
 
+The continuation graph is synced into the local fundamentals store, where
+chains (A -> B -> C) are resolved to the live series. Fundamentals fetched
+through `daloopa_client.get_fundamentals` and lookups via the store rewrite
+deprecated IDs automatically, so saved pipelines keep working after a model
+restructure.
+
 Usage:
     python recipes/08_series_continuation.py AAPL
     python recipes/08_series_continuation.py --by-id 2
@@ -13,6 +19,7 @@ Usage:
 import sys
 
 from daloopa_client import get
+from fundamentals_store import get_store
 
 
 def search_company(keyword: str) -> dict | None:
@@ -45,6 +52,10 @@ def main():
         print(f"Checking series continuations for {company['name']} (ID: {company_id})...")
 
     continuations = get_continuations(company_id)
+    store = get_store()
+    if store.company(company_id) is None:
+        store.upsert_company({"id": company_id})
+    store.save_continuations(company_id, continuations)
 
     if not continuations:
         print("  No series continuations found. All series IDs are current.")
@@ -65,13 +76,10 @@ def main():
             print(f"      [{s['id']}] {s['full_series_name']}")
         print()
 
-    # Summary: build a quick old->new lookup
-    print("  Quick lookup (old_id -> new_id):")
-    for c in continuations:
-        old_ids = [s["id"] for s in c.get("old_series", [])]
-        new_ids = [s["id"] for s in c.get("new_series", [])]
-        for oid in old_ids:
-            print(f"    {oid} -> {new_ids}")
+    # Summary: resolved lookup from the store (chains followed to the live series)
+    print("  Resolved lookup (old_id -> live ids), saved to the local store:")
+    for oid, live_ids in store.redirects(company_id).items():
+        print(f"    {oid} -> {live_ids}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""
+Host-level shared cache of API responses.
+
+Every session and report job on a box maps the same file
+(reports/.cache/responses-py3XX.bin) with mmap, so a response fetched by any
+process is served to all of them from one copy in the OS page cache, already
+parsed once: values are stored with marshal, which loads several times faster
+than re-parsing the JSON body.
+
+Layout: a header, an open-addressing slot table keyed by a 64-bit hash of the
+request, and an append-only data arena of (key, expiry, value) entries.
+Readers take a shared flock on the file, writers an exclusive one; within a
+process a mutex serializes access, since flock does not separate threads that
+share a descriptor. When the arena or slot table fills up the cache is reset
+in place (a new generation) rather than evicting entry by entry — responses
+are cheap to refetch and most have short TTLs anyway.
+
+The cache is keyed by API account, path and query parameters. It is disabled
+on platforms without fcntl or when DALOOPA_SHARED_CACHE=0.
+
+Usage:
+    from shared_cache import get_cache
+
+    cache = get_cache()
+    value = cache.get(key)            # None on miss/expiry
+    cache.put(key, value, ttl=3600)
+
+    python recipes/shared_cache.py stats
+    python recipes/shared_cache.py clear
+
+infra/cache_manager.py counts the file against the disk budget and clears it
+in place (never deletes it) when responses are evicted.
+"""
+
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / "reports" / ".cache"
+CACHE_PATH = CACHE_DIR / f"responses-py{sys.version_info[0]}{sys.version_info[1]}.bin"
+CACHE_SIZE = int(os.environ.get("DALOOPA_SHARED_CACHE_MB", 256)) * 2 ** 20
+ENABLED = os.environ.get("DALOOPA_SHARED_CACHE", "1") != "0" and fcntl is not None
+
+MAGIC = b"DLPSHM01"
+HEADER = struct.Struct("<8sIIQQQQ")  # magic, version, slots, data_start, data_end, entries, generation
+SLOT = struct.Struct("<QQI4x")  # key hash, entry offset, entry length
+ENTRY = struct.Struct("<IId")  # key length, value length, expires_at
+PAGE = 4096
+SLOTS = 65536
+MAX_LOAD = 0.7  # reset when this fraction of slots is used
+
+
+def _round_page(n: int) -> int:
+    return (n + PAGE - 1) // PAGE * PAGE
+
+
+def _hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+
+class SharedCache:
+    """An mmap-backed key/value cache shared by every process on the host."""
+
+    def __init__(self, path: str | Path = CACHE_PATH, size: int = CACHE_SIZE):
+        self.path = Path(path)
+        self.size = size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._inode = None
+
+    # -- mapping -------------------------------------------------------------
+
+    def _ensure_open(self):
+        """(Re)map the file on first use, after fork, or if it was deleted/replaced."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self._map is not None and self._pid == os.getpid() and inode == self._inode:
+            return
+        self._close()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(fd).st_size
+            if size < PAGE or os.pread(fd, len(MAGIC), 0) != MAGIC:
+                size = max(self.size, _round_page(PAGE + SLOTS * SLOT.size) + PAGE)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)  # sparse: pages are only allocated as they fill
+                data_start = _round_page(PAGE + SLOTS * SLOT.size)
+                os.pwrite(fd, HEADER.pack(MAGIC, 1, SLOTS, data_start, data_start, 0, 0), 0)
+            self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._pid = os.getpid()
+        self._inode = os.fstat(fd).st_ino
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._map = self._fd = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    def _find(self, h: int, key: bytes) -> tuple[int, int | None, int | None]:
+        """(slot index, entry offset, entry length) for a key; offset is None if absent."""
+        _, _, slots, *_ = self._header()
+        i = h % slots
+        for _ in range(slots):
+            pos = PAGE + i * SLOT.size
+            slot_hash, offset, length = SLOT.unpack_from(self._map, pos)
+            if slot_hash == 0:
+                return i, None, None
+            if slot_hash == h:
+                key_len, _, _ = ENTRY.unpack_from(self._map, offset)
+                start = offset + ENTRY.size
+                if self._map[start:start + key_len] == key:
+                    return i, offset, length
+            i = (i + 1) % slots
+        return i, None, None
+
+    # -- public API ----------------------------------------------------------
+
+    def get(self, key: str):
+        """Cached value for key, or None if missing or expired."""
+        raw = key.encode()
+        h = _hash(raw)
+        with self._lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                _, offset, _ = self._find(h, raw)
+                if offset is not None:
+                    key_len, value_len, expires_at = ENTRY.unpack_from(self._map, offset)
+                    if expires_at >= time.time():
+                        start = offset + ENTRY.size + key_len
+                        value = marshal.loads(self._map[start:start + value_len])
+                        self.hits += 1
+                        return value
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value, ttl: float) -> bool:
+        """Store a marshal-able value for ttl seconds. Returns False if it is too large to cache."""
+        raw = key.encode()
+        try:
+            payload = marshal.dumps(value)
+        except ValueError:
+            return False
+        entry = ENTRY.pack(len(raw), len(payload), time.time() + ttl) + raw + payload
+        h = _hash(raw)
+        with self._lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                magic, version, slots, data_start, data_end, entries, generation = self._header()
+                if len(entry) > len(self._map) - data_start:
+                    return False
+                slot, existing, _ = self._find(h, raw)
+                if data_end + len(entry) > len(self._map) or (existing is None and entries + 1 > slots * MAX_LOAD):
+                    self._reset_locked()
+                    magic, version, slots, data_start, data_end, entries, generation = self._header()
+                    slot, existing, _ = self._find(h, raw)
+                self._map[data_end:data_end + len(entry)] = entry
+                SLOT.pack_into(self._map, PAGE + slot * SLOT.size, h, data_end, len(entry))
+                entries += existing is None
+                HEADER.pack_into(self._map, 0, magic, version, slots, data_start,
+                                 data_end + len(entry), entries, generation)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return True
+
+    def clear(self):
+        """Empty the cache in place and return its arena's disk blocks to the filesystem.
+
+        The file is never unlinked or resized, so every process keeps sharing the
+        same mapping: the arena is cut off and re-extended as a hole while the
+        exclusive lock keeps other processes out of the map.
+        """
+        with self._lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._reset_locked()
+                data_start = self._header()[3]
+                os.ftruncate(self._fd, data_start)
+                os.ftruncate(self._fd, len(self._map))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reset_locked(self):
+        magic, version, slots, data_start, _, _, generation = self._header()
+        self._map[PAGE:PAGE + slots * SLOT.size] = bytes(slots * SLOT.size)
+        HEADER.pack_into(self._map, 0, magic, version, slots, data_start, data_start, 0, generation + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_open()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                _, _, slots, data_start, data_end, entries, generation = self._header()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return {
+            "path": str(self.path),
+            "size": len(self._map),
+            "used": data_end - data_start,
+            "entries": entries,
+            "slots": slots,
+            "generation": generation,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_default_cache: SharedCache | None = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> SharedCache | None:
+    """The process-wide handle on CACHE_PATH, or None when the shared cache is disabled."""
+    global _default_cache
+    if not ENABLED:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = SharedCache()
+        return _default_cache
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ("stats", "clear"):
+        print("Usage: python recipes/shared_cache.py stats|clear")
+        sys.exit(1)
+    cache = get_cache()
+    if cache is None:
+        print("Shared cache is disabled (DALOOPA_SHARED_CACHE=0 or no fcntl on this platform).")
+        sys.exit(1)
+    if sys.argv[1] == "clear":
+        cache.clear()
+        print(f"Cleared {cache.path}")
+        return
+    s = cache.stats()
+    print(f"Shared cache: {s['path']}")
+    print(f"  {s['entries']:,} entries, {s['used'] / 2**20:.1f} MB of {s['size'] / 2**20:.0f} MB used "
+          f"(generation {s['generation']}, {s['slots']:,} slots)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Recipe 11: Warm the Local Store for the Coverage Universe
+===========================================================
+Overnight batch job that walks the companies list and pulls each company's
+series catalog, full fundamentals history (via the CSV export, one request per
+company) and series-continuation graph into the local fundamentals store.
+
+Companies are processed in parallel threads that share the client's rate
+limiter, so the job stays within RATE_LIMIT requests per minute. Progress is
+checkpointed per company in the store: after a crash, rerunning resumes with
+the companies that did not finish, and companies whose `model_updated_at` is
+unchanged since their last successful warm-up are skipped.
+
+The datapoints each run pulls are metered; with --quota the run stops as soon
+as the next company could take it past that many datapoints.
+
+Usage:
+    # Warm every company in coverage
+    python recipes/warm_cache.py
+
+    # Warm a subset, 8 threads, ignoring checkpoints
+    python recipes/warm_cache.py AAPL MSFT GOOG --workers 8 --force
+
+    # Stop before pulling more than 2M datapoints
+    python recipes/warm_cache.py --quota 2000000
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from daloopa_client import get, paginate, refresh_continuations
+from datapoint_meter import QuotaExceeded, current_meter, metered_job
+from export_csv import export_csv
+from fundamentals_store import get_store
+from load_exports import load_file
+
+DEFAULT_WORKERS = 4
+
+
+def list_coverage(tickers: list[str] | None = None) -> list[dict]:
+    """All companies with models, optionally limited to the given tickers."""
+    companies = paginate("/companies", fresh=True)  # model_updated_at must be current
+    if tickers:
+        wanted = {t.upper() for t in tickers}
+        companies = [c for c in companies if (c.get("ticker") or "").upper() in wanted]
+    return companies
+
+
+def needs_warmup(company: dict, force: bool = False) -> bool:
+    """True unless the company was warmed successfully at its current model_updated_at."""
+    if force:
+        return True
+    checkpoint = get_store().warmup_checkpoint(company["id"])
+    return not (
+        checkpoint
+        and checkpoint["status"] == "done"
+        and checkpoint["model_updated_at"] == company.get("model_updated_at")
+    )
+
+
+def warm_company(company: dict) -> int:
+    """Pull one company's catalog, history and continuations. Returns datapoints loaded."""
+    store = get_store()
+    company_id = company["id"]
+    store.upsert_series(company_id, get("/companies/series", params={"company_id": company_id}, fresh=True))
+    meter = current_meter()
+    meter.check()
+    dest = export_csv(company["ticker"])
+    _, rows, _ = load_file(dest, company_id, str(store.path))
+    meter.charge(rows)
+    refresh_continuations(company_id, force=True)
+    return rows
+
+
+def warm(companies: list[dict], workers: int = DEFAULT_WORKERS, force: bool = False) -> dict:
+    """Warm the store for a list of companies. Returns counts of done/skipped/failed/cancelled."""
+    store = get_store()
+    pending = []
+    for c in companies:
+        store.upsert_company(c)
+        if needs_warmup(c, force):
+            pending.append(c)
+    counts = {"done": 0, "skipped": len(companies) - len(pending), "failed": 0, "cancelled": 0, "datapoints": 0}
+    print(f"{len(pending)} of {len(companies)} companies need warming "
+          f"({counts['skipped']} unchanged since last run).")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(warm_company, c): c for c in pending}
+        for i, fut in enumerate(as_completed(futures), 1):
+            c = futures[fut]
+            if fut.cancelled():
+                counts["cancelled"] += 1  # never started; no checkpoint, so the next run picks it up
+                continue
+            try:
+                rows = fut.result()
+            except QuotaExceeded as e:
+                counts["failed"] += 1
+                store.save_warmup_checkpoint(c["id"], "failed", c.get("model_updated_at"), error=str(e))
+                print(f"  [{i}/{len(pending)}] {c['ticker']}: SKIPPED ({e})")
+                for f in futures:
+                    f.cancel()
+                continue
+            except Exception as e:
+                counts["failed"] += 1
+                store.save_warmup_checkpoint(c["id"], "failed", c.get("model_updated_at"), error=str(e))
+                print(f"  [{i}/{len(pending)}] {c['ticker']}: FAILED ({e})")
+                continue
+            counts["done"] += 1
+            counts["datapoints"] += rows
+            store.save_warmup_checkpoint(c["id"], "done", c.get("model_updated_at"), datapoints=rows)
+            print(f"  [{i}/{len(pending)}] {c['ticker']}: {rows:,} datapoints")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nWarmed {counts['done']} companies ({counts['datapoints']:,} datapoints) in {elapsed / 60:.1f} min; "
+          f"{counts['skipped']} skipped, {counts['failed']} failed"
+          + (f", {counts['cancelled']} not started (quota reached)." if counts["cancelled"] else "."))
+    return counts
+
+
+def main():
+    args = sys.argv[1:]
+    workers = DEFAULT_WORKERS
+    if "--workers" in args:
+        i = args.index("--workers")
+        workers = int(args[i + 1])
+        del args[i:i + 2]
+    quota = None
+    if "--quota" in args:
+        i = args.index("--quota")
+        quota = int(args[i + 1])
+        del args[i:i + 2]
+    force = "--force" in args
+    tickers = [a for a in args if not a.startswith("--")]
+
+    print("Loading coverage universe...")
+    companies = list_coverage(tickers or None)
+    if not companies:
+        print("No companies found.")
+        sys.exit(1)
+    with metered_job("warm_cache", quota=quota) as meter:
+        warm(companies, workers=workers, force=force)
+    print(meter.report())
+
+
+if __name__ == "__main__":
+    main()
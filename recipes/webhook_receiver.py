@@ -0,0 +1,303 @@
+"""
+Recipe 15: Webhook Receiver
+=============================
+Receive Daloopa webhooks instead of polling. A small asyncio HTTP server
+accepts POSTed events, checks the authentication header configured with your
+Daloopa team ({header_name}: {prefix} {auth_secret}), and commits each delivery
+to a durable queue in the local store before answering 200. Repeated
+deliveries of the same body within DEDUPE_WINDOW are acknowledged but not
+queued again.
+
+A worker drains the queue: pending events are grouped by company, and each
+company pulls only its changed datapoints once through the incremental update
+path of recipes/poll_for_updates.py (series_updated events with merges also
+resync the series-continuation graph). With --rebuild, each pull also queues
+a debounced model rebuild, which is what completes the pull's detection-latency
+records (recipes/detection_latency.py). Events that fail are retried with
+backoff and marked failed after MAX_ATTEMPTS. Anything still queued when the
+receiver stops is processed on the next start.
+
+Configuration (environment or .env):
+    DALOOPA_WEBHOOK_SECRET   auth_secret given to Daloopa (required)
+    DALOOPA_WEBHOOK_HEADER   header_name (default: Authorization)
+    DALOOPA_WEBHOOK_PREFIX   optional prefix, e.g. Bearer
+
+Daloopa delivers to HTTPS URLs only: terminate TLS in front of the receiver,
+or pass --certfile/--keyfile.
+
+Usage:
+    python recipes/webhook_receiver.py serve --port 8080
+    python recipes/webhook_receiver.py serve --port 8080 --rebuild
+    python recipes/webhook_receiver.py serve --port 8443 --certfile cert.pem --keyfile key.pem
+
+    # Send sample payloads to a running receiver (local testing)
+    python recipes/webhook_receiver.py replay --event incremental_update --company-id 2
+    python recipes/webhook_receiver.py replay --url http://localhost:8080/webhooks/daloopa event.json
+
+    python recipes/webhook_receiver.py status
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import sys
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from daloopa_client import refresh_continuations
+from datapoint_meter import metered_job
+from fundamentals_store import get_store
+from poll_for_updates import check_status, pull_updates
+
+DEFAULT_PORT = 8080
+WEBHOOK_PATH = "/webhooks/daloopa"
+DEDUPE_WINDOW = timedelta(hours=6)
+MAX_BODY = 10 * 2 ** 20
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # seconds, doubled per consecutive failed batch
+CONCURRENCY = 8
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large"}
+
+SAMPLE_PAYLOADS = {
+    "incremental_update": lambda cid: {
+        "event_type": "incremental_update", "company_id": cid,
+        "series": {"1": {"periods": ["2025Q1"]}, "2": {"periods": ["2025Q1"]}},
+    },
+    "clientview_updated": lambda cid: {
+        "event_type": "clientview_updated", "company_id": cid,
+        "series": {"1": {"periods": ["2025Q1"]}},
+    },
+    "series_updated": lambda cid: {
+        "event_type": "series_updated", "company_id": cid,
+        "series": [{"id": 4, "type": "VALUE_ERROR", "period": "2024Q2", "run_date": "2024-06-04T12:00:00Z",
+                    "details": {"fundamental_id": 15, "series_id": 105, "field_changed": "fundamental_value",
+                                "new_value": 1500, "old_value": 1200}}],
+    },
+}
+
+
+def expected_auth() -> tuple[str, str]:
+    """(header name, expected header value) from the environment."""
+    secret = os.environ.get("DALOOPA_WEBHOOK_SECRET", "")
+    if not secret:
+        raise EnvironmentError("Set DALOOPA_WEBHOOK_SECRET (the auth_secret configured with Daloopa).")
+    header = os.environ.get("DALOOPA_WEBHOOK_HEADER", "Authorization")
+    prefix = os.environ.get("DALOOPA_WEBHOOK_PREFIX", "")
+    return header, f"{prefix} {secret}".strip()
+
+
+def event_periods(event: dict) -> list[str]:
+    """Calendar periods an event touches, from either payload shape."""
+    series = event.get("series") or {}
+    if isinstance(series, dict):
+        return sorted({p for s in series.values() for p in (s or {}).get("periods", [])})
+    return sorted({s["period"] for s in series if s.get("period")})
+
+
+def process_company(company_id: int, events: list[dict], rebuild: bool = False) -> int:
+    """Pull one company's changes for a group of queued events. Returns datapoints received.
+
+    With `rebuild`, a rebuild of the company's model is queued in the same
+    transaction as the pull (see infra/rebuild_pipeline.py).
+    """
+    payloads = [json.loads(e["payload"]) for e in events]
+    if any(s.get("type") == "MERGING_ERROR" for p in payloads if isinstance(p.get("series"), list)
+           for s in p["series"]):
+        refresh_continuations(company_id, force=True)
+    periods = [period for p in payloads for period in event_periods(p)]
+    company = get_store().company(company_id) or {}
+    latest = max(periods) if periods else company.get("latest_quarter")
+    status = None
+    if latest is None:
+        status = next(iter(check_status([company_id])), None) or {}
+        latest = status.get("latest_period")
+    if latest is None:
+        print(f"  Company {company_id} has no periods yet; nothing to pull")
+        return 0
+    return len(pull_updates(company_id, latest, status, rebuild, company.get("ticker")))
+
+
+class WebhookReceiver:
+    """asyncio HTTP endpoint plus the worker that drains the durable event queue."""
+
+    def __init__(self, path: str = WEBHOOK_PATH, rebuild: bool = False):
+        self.path = path
+        self.rebuild = rebuild
+        self.header, auth_value = expected_auth()
+        self.auth_value = auth_value.encode()
+        self.store = get_store()
+        self.wakeup = asyncio.Event()
+
+    # -- HTTP ----------------------------------------------------------------
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            status, body = await self._handle_request(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, body = 400, {"error": "malformed request"}
+        payload = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> tuple[int, dict]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if len(request_line) < 2:
+            return 400, {"error": "malformed request"}
+        method, target = request_line[0], request_line[1].split("?")[0]
+        if target != self.path:
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "POST only"}
+        # compare bytes: compare_digest rejects non-ASCII str, and headers were decoded as latin-1
+        if not hmac.compare_digest(headers.get(self.header.lower(), "").encode("latin-1"), self.auth_value):
+            return 401, {"error": "invalid credentials"}
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            return 413, {"error": "payload too large"}
+        raw = await reader.readexactly(length)
+        try:
+            event = json.loads(raw)
+        except ValueError:
+            return 400, {"error": "invalid JSON"}
+        if not isinstance(event, dict) or not isinstance(event.get("company_id"), int):
+            return 400, {"error": "expected a JSON object with a company_id"}
+
+        digest = hashlib.sha256(raw).hexdigest()
+        dedupe_since = (datetime.now(timezone.utc) - DEDUPE_WINDOW).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        event_id = await asyncio.to_thread(
+            self.store.enqueue_webhook, digest, event.get("event_type"), event.get("company_id"),
+            raw.decode("utf-8"), dedupe_since,
+        )
+        if event_id is None:
+            return 200, {"status": "duplicate"}
+        print(f"  Queued {event.get('event_type')} for company {event.get('company_id')} (event {event_id})")
+        self.wakeup.set()
+        return 200, {"status": "queued", "id": event_id}
+
+    # -- worker --------------------------------------------------------------
+
+    async def worker(self):
+        """Drain the queue whenever deliveries arrive (and once at startup)."""
+        delay = RETRY_DELAY
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        async def run(company_id, events):
+            async with sem:
+                return await asyncio.to_thread(process_company, company_id, events, self.rebuild)
+
+        while True:
+            # clear before reading the queue: a delivery queued while the query runs sets it again
+            self.wakeup.clear()
+            events = await asyncio.to_thread(self.store.pending_webhooks)
+            if not events:
+                await self.wakeup.wait()
+                continue
+            groups: dict[int, list[dict]] = {}
+            for e in events:
+                groups.setdefault(e["company_id"], []).append(e)
+            with metered_job("webhook_receiver"):
+                results = await asyncio.gather(*(run(cid, evs) for cid, evs in groups.items()),
+                                               return_exceptions=True)
+            failed = False
+            for (cid, evs), result in zip(groups.items(), results):
+                ids = [e["id"] for e in evs]
+                if isinstance(result, BaseException):
+                    failed = True
+                    print(f"  Company {cid}: update failed ({result}); will retry")
+                    await asyncio.to_thread(self.store.finish_webhooks, ids, str(result), MAX_ATTEMPTS)
+                else:
+                    print(f"  Company {cid}: {result} new or changed datapoints from {len(evs)} event(s)")
+                    await asyncio.to_thread(self.store.finish_webhooks, ids)
+            if failed:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 3600)
+            else:
+                delay = RETRY_DELAY
+
+    async def serve(self, host: str, port: int, ssl_context: ssl.SSLContext | None = None):
+        server = await asyncio.start_server(self.handle, host, port, ssl=ssl_context)
+        scheme = "https" if ssl_context else "http"
+        print(f"Listening on {scheme}://{host}:{port}{self.path} (header: {self.header})")
+        worker = asyncio.create_task(self.worker())
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                worker.cancel()
+
+
+def replay(url: str, payloads: list[dict]):
+    """POST payloads to a receiver with the configured auth header."""
+    header, value = expected_auth()
+    for payload in payloads:
+        resp = requests.post(url, json=payload, headers={header: value}, timeout=30)
+        print(f"  {payload.get('event_type')} company {payload.get('company_id')}: "
+              f"HTTP {resp.status_code} {resp.text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive Daloopa webhooks and pull updates incrementally.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_p = sub.add_parser("serve", help="Run the receiver")
+    serve_p.add_argument("--host", default="0.0.0.0")
+    serve_p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_p.add_argument("--path", default=WEBHOOK_PATH)
+    serve_p.add_argument("--certfile", help="TLS certificate (PEM) to serve HTTPS directly")
+    serve_p.add_argument("--keyfile", help="TLS private key (PEM)")
+    serve_p.add_argument("--rebuild", action="store_true",
+                         help="Queue a model rebuild for each updated company (infra/rebuild_pipeline.py)")
+
+    replay_p = sub.add_parser("replay", help="Send sample or saved payloads to a receiver")
+    replay_p.add_argument("files", nargs="*", help="JSON payload files (default: a built-in sample)")
+    replay_p.add_argument("--url", default=f"http://localhost:{DEFAULT_PORT}{WEBHOOK_PATH}")
+    replay_p.add_argument("--event", choices=sorted(SAMPLE_PAYLOADS), default="incremental_update")
+    replay_p.add_argument("--company-id", type=int, default=2)
+
+    sub.add_parser("status", help="Counts of queued, processed and failed deliveries")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        ssl_context = None
+        if args.certfile:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(args.certfile, args.keyfile)
+        try:
+            asyncio.run(WebhookReceiver(args.path, args.rebuild).serve(args.host, args.port, ssl_context))
+        except KeyboardInterrupt:
+            print("\nStopped.")
+    elif args.command == "replay":
+        if args.files:
+            payloads = [json.loads(open(f).read()) for f in args.files]
+        else:
+            payloads = [SAMPLE_PAYLOADS[args.event](args.company_id)]
+        replay(args.url, payloads)
+    else:
+        counts = get_store().webhook_counts()
+        print("  ".join(f"{k}: {counts.get(k, 0):,}" for k in ("pending", "done", "failed")))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except EnvironmentError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
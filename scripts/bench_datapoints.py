@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Benchmark API-dict datapoints against compact Datapoint records.
+
+Builds a synthetic fundamentals pull (default 1M datapoints spread over
+~2,000 series x 40 quarters, shaped like /companies/fundamentals results),
+then measures the memory held by each representation and the time to
+aggregate value_raw by series.
+
+Usage:
+    python scripts/bench_datapoints.py
+    python scripts/bench_datapoints.py --n 200000
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recipes"))
+
+from datapoint import Datapoint  # noqa: E402
+
+N_PERIODS = 40
+
+
+def synthetic_payload(n):
+    """JSON text of n datapoints, so both representations start from a fresh parse."""
+    rows = []
+    for i in range(n):
+        series_id = 2_400_000 + i // N_PERIODS
+        year, q = 2015 + (i % N_PERIODS) // 4, (i % 4) + 1
+        rows.append({
+            "id": 90_000_000 + i,
+            "label": f"Line item {series_id % 500}",
+            "category": "Income Statement",
+            "restated": False,
+            "filing_type": "10-Q",
+            "series_id": series_id,
+            "title": f"Income Statement | Line item {series_id % 500}",
+            "value_raw": 1000.0 + i % 997,
+            "value_normalized": 1000.0 + i % 997,
+            "unit": "Million",
+            "calendar_period": f"{year}Q{q}",
+            "fiscal_period": f"{year}Q{q}",
+            "span": "Quarterly",
+            "fiscal_date": f"{year}-{q * 3:02d}-30",
+            "document_id": 25_000_000 + i // 500,
+            "filing_date": f"{year}-{q * 3:02d}-30",
+            "document_released_at": f"{year}-{q * 3:02d}-30T20:30:34Z",
+            "created_at": f"{year}-{q * 3:02d}-30T20:33:56.013697Z",
+            "updated_at": "2026-02-02T12:12:56.284556Z",
+        })
+    return json.dumps(rows)
+
+
+def measure(build):
+    """Return (object, bytes allocated while building it, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current, elapsed
+
+
+def aggregate_dicts(rows):
+    totals = {}
+    for r in rows:
+        totals[r["series_id"]] = totals.get(r["series_id"], 0.0) + r["value_raw"]
+    return totals
+
+
+def aggregate_records(rows):
+    totals = {}
+    for r in rows:
+        totals[r.series_id] = totals.get(r.series_id, 0.0) + r.value_raw
+    return totals
+
+
+def timed(fn, rows, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dict vs Datapoint representations")
+    parser.add_argument("--n", type=int, default=1_000_000, help="Number of datapoints (default: 1M)")
+    args = parser.parse_args()
+
+    print(f"Generating {args.n:,} synthetic datapoints...")
+    payload = synthetic_payload(args.n)
+
+    dicts, dict_bytes, dict_build = measure(lambda: json.loads(payload))
+    dict_iter = timed(aggregate_dicts, dicts)
+    del dicts
+
+    records, rec_bytes, rec_build = measure(lambda: Datapoint.from_api_list(json.loads(payload)))
+    rec_iter = timed(aggregate_records, records)
+    del records
+
+    print(f"\n{'':<22}{'Memory':>12}{'Per row':>10}{'Build':>10}{'Aggregate':>12}")
+    print("-" * 66)
+    print(f"{'API dicts':<22}{dict_bytes / 2**20:>10.0f}MB{dict_bytes / args.n:>9.0f}B"
+          f"{dict_build:>9.2f}s{dict_iter:>11.3f}s")
+    print(f"{'Datapoint (__slots__)':<22}{rec_bytes / 2**20:>10.0f}MB{rec_bytes / args.n:>9.0f}B"
+          f"{rec_build:>9.2f}s{rec_iter:>11.3f}s")
+    print(f"\nMemory: {dict_bytes / rec_bytes:.1f}x smaller, aggregate: {dict_iter / rec_iter:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()